@@ -12,16 +12,23 @@ django_asgi_app = get_asgi_application()
 
 # NOW import your routing after Django is configured
 import rooms.routing
+from rooms.auth import JWTAuthMiddleware
+from rooms.backpressure import SendBackpressure
+from rooms.metrics import MetricsEndpoint
 
 # Updated ASGI application configuration
 application = ProtocolTypeRouter({
-    # For standard HTTP requests
-    "http": django_asgi_app,
+    # For standard HTTP requests (plus Prometheus metrics on /metrics)
+    "http": MetricsEndpoint(django_asgi_app),
     
-    # For WebSocket requests
-    "websocket": AllowedHostsOriginValidator(
-        URLRouter(
-            rooms.routing.websocket_urlpatterns
+    # For WebSocket requests (sends wait for slow clients, see rooms.backpressure)
+    "websocket": SendBackpressure(
+        AllowedHostsOriginValidator(
+            JWTAuthMiddleware(
+                URLRouter(
+                    rooms.routing.websocket_urlpatterns
+                )
+            )
         )
     ),
 })
\ No newline at end of file
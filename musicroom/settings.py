@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -150,11 +152,167 @@ ASGI_APPLICATION = 'musicroom.asgi.application'
 
 # Configure the channel layer to use Redis.
 # This is the "post office" for all messages.
-CHANNEL_LAYERS = {
+# Rooms are sharded by room code across the comma-separated
+# REDIS_CHANNEL_HOSTS (rooms.layers.ShardedRedisChannelLayer). Set
+# CHANNEL_LAYER=memory to keep messages in-process: one worker or tests only.
+REDIS_CHANNEL_HOSTS = os.environ.get('REDIS_CHANNEL_HOSTS', 'redis://127.0.0.1:6379/0').split(',')
+
+if os.environ.get('CHANNEL_LAYER') == 'memory':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'rooms.layers.ShardedRedisChannelLayer',
+            'CONFIG': {
+                "hosts": REDIS_CHANNEL_HOSTS,
+                "max_connections": 50,
+            },
+        },
+    }
+
+# Cache for room snapshots (rooms.snapshot). Local memory is per process, so
+# with several workers set REDIS_CACHE_URL (e.g. redis://127.0.0.1:6379/1)
+# to share snapshots between them.
+CACHES = {
     'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+if os.environ.get('REDIS_CACHE_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_CACHE_URL'],
+    }
+
+ROOM_SNAPSHOT_CACHE = 'default'
+ROOM_SNAPSHOT_TTL = 300
+
+# How often (in seconds) buffered host sync positions are written to the
+# Room table. Pauses, song changes and the last user leaving flush sooner.
+ROOM_SYNC_FLUSH_INTERVAL = 5
+
+# Room lifecycle (rooms.sweeper). Consumers' activity is written in batches
+# every ACTIVITY_TOUCH_INTERVAL seconds; participants unseen for
+# PARTICIPANT_IDLE_TIMEOUT seconds are deactivated and rooms idle for
+# ROOM_IDLE_TIMEOUT seconds are ended. Run `manage.py sweep_rooms` from cron,
+# or set ROOM_SWEEP_INTERVAL to sweep from inside each ASGI worker.
+ACTIVITY_TOUCH_INTERVAL = 60
+PARTICIPANT_IDLE_TIMEOUT = 10 * 60
+ROOM_IDLE_TIMEOUT = 6 * 60 * 60
+ROOM_SWEEP_INTERVAL = None
+
+# Who is connected to each room (rooms.presence), refreshed by client pings
+# (every 30s) and expired TTL seconds after the last one. It follows the
+# channel layer: the in-memory backend only sees its own process, so
+# several workers share Redis (REDIS_PRESENCE_URL, or the first channel host).
+if os.environ.get('CHANNEL_LAYER') == 'memory':
+    ROOM_PRESENCE = {
+        'BACKEND': 'rooms.presence.InMemoryPresence',
+        'CONFIG': {'ttl': 90},
+    }
+else:
+    ROOM_PRESENCE = {
+        'BACKEND': 'rooms.presence.RedisPresence',
         'CONFIG': {
-            "hosts": [('127.0.0.1', 6379)],
+            'url': os.environ.get('REDIS_PRESENCE_URL', REDIS_CHANNEL_HOSTS[0]),
+            'ttl': 90,
+        },
+    }
+
+# Joins and leaves in a room are batched for this many seconds into one
+# roster_update frame (rooms.roster).
+ROSTER_UPDATE_WINDOW = 0.25
+
+# Chat persistence (rooms.chat): messages are written with bulk_create once
+# CHAT_FLUSH_SIZE are pending or CHAT_FLUSH_INTERVAL seconds after the first,
+# and the last CHAT_HISTORY_SIZE per room are replayed to connecting clients.
+CHAT_FLUSH_SIZE = 50
+CHAT_FLUSH_INTERVAL = 0.5
+CHAT_HISTORY_SIZE = 50
+
+# Token-bucket limits on client WebSocket messages (rooms.ratelimit), as
+# (messages per second, burst) per connection, per user and per room.
+# Rejected messages get a rate_limited frame; unlisted types are unlimited.
+WS_RATE_LIMITS = {
+    'chat_message': {'connection': (2, 10), 'user': (3, 15), 'room': (20, 60)},
+    'add_song': {'connection': (0.5, 5), 'user': (0.5, 5), 'room': (2, 20)},
+    'sync_playback': {'connection': (4, 10), 'user': (4, 10), 'room': (4, 10)},
+    'toggle_playback': {'connection': (2, 5), 'user': (2, 5), 'room': (4, 10)},
+    'next_song': {'connection': (1, 5), 'user': (1, 5), 'room': (2, 10)},
+    'previous_song': {'connection': (1, 5), 'user': (1, 5), 'room': (2, 10)},
+}
+
+# Outbound WebSocket queue per connection (rooms.outbox). Frames queued in
+# one event-loop tick are batched into a JSON array frame (up to
+# WS_OUTBOX_BATCH_SIZE) for clients that negotiated a subprotocol. Pending
+# playback state frames are replaced by newer ones; past
+# WS_OUTBOX_MAX_FRAMES pending frames the client is closed with 4008.
+# Closing waits up to WS_OUTBOX_DRAIN_TIMEOUT seconds for queued frames.
+WS_OUTBOX_BATCH_SIZE = 50
+WS_OUTBOX_MAX_FRAMES = 256
+WS_OUTBOX_DRAIN_TIMEOUT = 5
+
+# Accept permessage-deflate offers under daphne (rooms.deflate). Costs CPU
+# and memory per connection; off by default.
+WS_PERMESSAGE_DEFLATE = os.environ.get('WS_PERMESSAGE_DEFLATE') == '1'
+
+# /metrics (rooms.metrics.MetricsEndpoint) answers only these client
+# addresses, or requests with "Authorization: Bearer <METRICS_TOKEN>".
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# WebSocket JWT auth cache (rooms.auth.JWTAuthMiddleware): verified tokens
+# are trusted for at most WS_AUTH_TOKEN_TTL seconds (never past their own
+# expiry), user snapshots for WS_AUTH_USER_TTL seconds.
+WS_AUTH_CACHE_SIZE = 10000
+WS_AUTH_TOKEN_TTL = 300
+WS_AUTH_USER_TTL = 60
+WS_AUTH_INVALID_TTL = 30
+
+# Logging. The "rooms" logger writes JSON lines through a queue drained by a
+# background thread (rooms.log.QueueingStreamHandler), so the event loop
+# never blocks on stderr. High-frequency events (ping, sync, per-message
+# traces) are sampled 1 in LOG_SAMPLE_RATE. Set LOG_LEVEL=DEBUG to see them.
+# `manage.py test` only shows errors unless LOG_LEVEL is set.
+TESTING = sys.argv[1:2] == ['test']
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'ERROR' if TESTING else 'INFO')
+LOG_SAMPLE_RATE = int(os.environ.get('LOG_SAMPLE_RATE', '100'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {
+            '()': 'rooms.log.StructuredFormatter',
+        },
+    },
+    'filters': {
+        'sampling': {
+            '()': 'rooms.log.SamplingFilter',
+            'rates': {
+                'ws.ping': LOG_SAMPLE_RATE,
+                'ws.sync': LOG_SAMPLE_RATE,
+                'ws.message': LOG_SAMPLE_RATE,
+                'ws.rate_limited': LOG_SAMPLE_RATE,
+            },
         },
     },
-}
\ No newline at end of file
+    'handlers': {
+        'queued': {
+            '()': 'rooms.log.QueueingStreamHandler',
+            'formatter': 'structured',
+            'filters': ['sampling'],
+        },
+    },
+    'loggers': {
+        'rooms': {
+            'handlers': ['queued'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
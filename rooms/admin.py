@@ -1,4 +1,5 @@
 from django.contrib import admin
-from .models import Room    
+from .models import ChatMessage, Room
 # Register your models here.
-admin.site.register(Room)
\ No newline at end of file
+admin.site.register(Room)
+admin.site.register(ChatMessage)
\ No newline at end of file
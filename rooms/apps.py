@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class RoomsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rooms'
+
+    def ready(self):
+        if getattr(settings, 'WS_PERMESSAGE_DEFLATE', False):
+            from .deflate import enable_permessage_deflate
+
+            enable_permessage_deflate()
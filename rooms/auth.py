@@ -0,0 +1,144 @@
+# rooms/auth.py
+
+import asyncio
+import time
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import UntypedToken
+
+from . import metrics
+from .cache import TTLCache
+
+User = get_user_model()
+
+ws_auth = metrics.registry.counter(
+    'musicroom_ws_auth_total', 'WebSocket token checks by outcome.', ['result']
+)
+
+
+class UserSnapshot:
+    """The few user fields a RoomConsumer needs, cached instead of a model instance."""
+
+    __slots__ = ('id', 'name', 'is_active')
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, id, name, is_active):
+        self.id = id
+        self.name = name
+        self.is_active = is_active
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __repr__(self):
+        return f'<UserSnapshot {self.id} {self.name!r}>'
+
+
+class TokenAuthCache:
+    """
+    Caches signature-verification results per token and user snapshots per id.
+    A reconnect storm then costs a dict lookup per connection instead of a
+    JWT decode and a database round-trip.
+    """
+
+    def __init__(self, maxsize=None, user_ttl=None, invalid_ttl=None):
+        maxsize = maxsize or getattr(settings, 'WS_AUTH_CACHE_SIZE', 10000)
+        self.tokens = TTLCache(maxsize=maxsize, ttl=getattr(settings, 'WS_AUTH_TOKEN_TTL', 300))
+        self.users = TTLCache(maxsize=maxsize, ttl=user_ttl or getattr(settings, 'WS_AUTH_USER_TTL', 60))
+        self.invalid_ttl = invalid_ttl or getattr(settings, 'WS_AUTH_INVALID_TTL', 30)
+        self._loading = {}
+
+    def verify(self, token):
+        """Return the token's user id, or None if the token is invalid or expired."""
+        cached = self.tokens.get(token)
+        if cached is not None:
+            ws_auth.labels('token_cache_hit').inc()
+            return None if cached is False else cached
+
+        try:
+            validated = UntypedToken(token)
+            user_id = validated[api_settings.USER_ID_CLAIM]
+        except (TokenError, KeyError):
+            ws_auth.labels('invalid_token').inc()
+            # Remember failures briefly so a bad token can't force repeated decodes
+            self.tokens.set(token, False, ttl=self.invalid_ttl)
+            return None
+
+        # Never trust a cached verification past the token's own expiry
+        ttl = validated.get('exp', 0) - time.time()
+        self.tokens.set(token, user_id, ttl=min(ttl, self.tokens.ttl))
+        ws_auth.labels('token_verified').inc()
+        return user_id
+
+    async def get_user(self, user_id):
+        snapshot = self.users.get(user_id)
+        if snapshot is not None:
+            ws_auth.labels('user_cache_hit').inc()
+            return snapshot
+
+        # Coalesce concurrent lookups of the same user into one query
+        pending = self._loading.get(user_id)
+        if pending is None:
+            pending = self._loading[user_id] = asyncio.ensure_future(self._load_user(user_id))
+            pending.add_done_callback(lambda _: self._loading.pop(user_id, None))
+        return await asyncio.shield(pending)
+
+    async def _load_user(self, user_id):
+        ws_auth.labels('user_loaded').inc()
+        snapshot = await database_sync_to_async(load_user_snapshot)(user_id)
+        if snapshot is not None:
+            self.users.set(user_id, snapshot)
+        return snapshot
+
+    def clear(self):
+        self.tokens.clear()
+        self.users.clear()
+
+
+def load_user_snapshot(user_id):
+    row = User.objects.filter(pk=user_id).values('id', 'name', 'is_active').first()
+    return UserSnapshot(**row) if row else None
+
+
+auth_cache = TokenAuthCache()
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Populates scope['user'] from a `token` query parameter carrying a
+    SimpleJWT token; unauthenticated connections get AnonymousUser.
+    """
+
+    def __init__(self, inner, cache=None):
+        super().__init__(inner)
+        self.cache = cache or auth_cache
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        scope['user'] = await self.authenticate(scope)
+        return await super().__call__(scope, receive, send)
+
+    async def authenticate(self, scope):
+        query = parse_qs(scope.get('query_string', b'').decode())
+        token = query.get('token', [None])[0]
+        if not token:
+            return AnonymousUser()
+
+        user_id = self.cache.verify(token)
+        if user_id is None:
+            return AnonymousUser()
+
+        user = await self.cache.get_user(user_id)
+        if user is None or not user.is_active:
+            return AnonymousUser()
+        return user
@@ -0,0 +1,105 @@
+# rooms/backpressure.py
+"""
+Send backpressure for WebSocket connections served by daphne.
+
+Under daphne, `await send(...)` hands the frame to Twisted and returns at
+once: a client that stops reading only grows the transport's write
+buffer, so nothing upstream (rooms.outbox) ever sees it fall behind.
+uvicorn already waits for its transport to drain.
+
+SendBackpressure registers a TransportWindow as the push producer of each
+daphne WebSocket transport. Twisted pauses it once the write buffer passes
+its high-water mark (64 KiB) and resumes it when the buffer drains, and
+`websocket.send` waits while it is paused. Frames then pile up in the
+Outbox, where stale ones are replaced and overflow closes the client.
+Other servers' `send` is passed through untouched.
+"""
+
+import asyncio
+import logging
+
+try:
+    from twisted.internet.interfaces import IPushProducer
+    from zope.interface import implementer
+except ImportError:
+    IPushProducer = None
+
+logger = logging.getLogger(__name__)
+
+
+class TransportWindow:
+    """Push producer that is open while the transport accepts writes."""
+
+    def __init__(self):
+        self._open = asyncio.Event()
+        self._open.set()
+
+    @property
+    def paused(self):
+        return not self._open.is_set()
+
+    def pauseProducing(self):
+        self._open.clear()
+
+    def resumeProducing(self):
+        self._open.set()
+
+    def stopProducing(self):
+        # The connection is gone; let waiting senders through
+        self._open.set()
+
+    async def wait(self):
+        await self._open.wait()
+
+
+if IPushProducer is not None:
+    TransportWindow = implementer(IPushProducer)(TransportWindow)
+
+
+def daphne_transport(send):
+    """The Twisted transport behind daphne's `send` callable, or None under other servers."""
+    # daphne passes partial(Server.handle_reply, protocol)
+    protocol = next(iter(getattr(send, 'args', ())), None)
+    if type(protocol).__module__ != 'daphne.ws_protocol':
+        return None
+    return getattr(protocol, 'transport', None)
+
+
+def open_window(transport):
+    """Register a TransportWindow on `transport`; None if it can't be registered."""
+    if IPushProducer is None:
+        return None
+    window = TransportWindow()
+    # The HTTP channel that handled the upgrade is still registered
+    if getattr(transport, 'producer', None) is not None:
+        transport.unregisterProducer()
+    try:
+        transport.registerProducer(window, True)
+    except (AttributeError, RuntimeError):
+        logger.debug("Could not register a transport window", exc_info=True)
+        return None
+    return window
+
+
+class SendBackpressure:
+    """ASGI wrapper making `websocket.send` wait for daphne's write buffer to drain."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'websocket':
+            transport = daphne_transport(send)
+            window = open_window(transport) if transport is not None else None
+            if window is not None:
+                send = self.wrap(send, window)
+        return await self.app(scope, receive, send)
+
+    @staticmethod
+    def wrap(send, window):
+        async def send_when_drained(message):
+            await send(message)
+            if message['type'] == 'websocket.send' and window.paused:
+                await window.wait()
+
+        return send_when_drained
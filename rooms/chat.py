@@ -0,0 +1,132 @@
+# rooms/chat.py
+
+import asyncio
+import logging
+import uuid
+from collections import deque
+from datetime import datetime, timezone as dt_timezone
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from .models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+
+class ChatWriter:
+    """
+    Batches chat messages into bulk_create calls: a batch is written once it
+    holds CHAT_FLUSH_SIZE messages or CHAT_FLUSH_INTERVAL seconds after its
+    first message, whichever comes first. Handlers never wait for the write.
+    """
+
+    def __init__(self, size=None, interval=None):
+        self.size = size
+        self.interval = interval
+        self._pending = []
+        self._timer = None
+
+    def get_size(self):
+        return self.size or getattr(settings, 'CHAT_FLUSH_SIZE', 50)
+
+    def get_interval(self):
+        if self.interval is not None:
+            return self.interval
+        return getattr(settings, 'CHAT_FLUSH_INTERVAL', 0.5)
+
+    def add(self, room_id, payload):
+        """Queue a broadcast chat payload (see ChatMessage.to_dict) for writing."""
+        self._pending.append(ChatMessage(
+            id=uuid.UUID(payload['id']),
+            room_id=room_id,
+            user_id=payload['user_id'],
+            name=payload['name'],
+            message=payload['message'],
+            created_at=datetime.fromtimestamp(payload['created_at'] / 1000, tz=dt_timezone.utc),
+        ))
+        if len(self._pending) >= self.get_size():
+            asyncio.ensure_future(self.flush())
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.get_interval())
+        await self.flush()
+
+    async def flush(self):
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            await database_sync_to_async(ChatMessage.objects.bulk_create)(batch, ignore_conflicts=True)
+        except Exception:
+            logger.exception("Failed to write %s chat messages", len(batch))
+
+
+class ChatHistory:
+    """
+    Ring buffer of the last CHAT_HISTORY_SIZE messages per room, replayed to
+    connecting clients. Filled from the chat events this process delivers,
+    and seeded from the database the first time a room is replayed here.
+    Callers drop a room's buffer when its last local connection closes.
+    """
+
+    def __init__(self, size=None):
+        self.size = size
+        self._rooms = {}
+        self._loading = {}
+
+    def get_size(self):
+        return self.size or getattr(settings, 'CHAT_HISTORY_SIZE', 50)
+
+    def _buffer(self, code):
+        buffer = self._rooms.get(code)
+        if buffer is None:
+            buffer = self._rooms[code] = {
+                'messages': deque(maxlen=self.get_size()), 'ids': set(), 'loaded': False,
+            }
+        return buffer
+
+    def append(self, code, payload):
+        """Add a delivered message; every consumer of the room calls this, so duplicates are skipped."""
+        buffer = self._buffer(code)
+        if payload['id'] in buffer['ids']:
+            return
+        messages = buffer['messages']
+        if len(messages) == messages.maxlen:
+            buffer['ids'].discard(messages[0]['id'])
+        messages.append(payload)
+        buffer['ids'].add(payload['id'])
+
+    async def recent(self, code, room_id):
+        if not self._buffer(code)['loaded']:
+            # Connections arriving while the room loads wait for the same query
+            pending = self._loading.get(code)
+            if pending is None:
+                pending = self._loading[code] = asyncio.ensure_future(self._load(code, room_id))
+                pending.add_done_callback(lambda _: self._loading.pop(code, None))
+            await asyncio.shield(pending)
+        return list(self._buffer(code)['messages'])
+
+    async def _load(self, code, room_id):
+        stored = await database_sync_to_async(load_recent_messages)(room_id, self.get_size())
+        buffer = self._buffer(code)
+        live = list(buffer['messages'])
+        buffer['messages'].clear()
+        buffer['ids'].clear()
+        for payload in sorted(stored + live, key=lambda payload: payload['created_at']):
+            self.append(code, payload)
+        buffer['loaded'] = True
+
+    def discard(self, code):
+        self._rooms.pop(code, None)
+
+
+def load_recent_messages(room_id, limit):
+    messages = ChatMessage.objects.filter(room_id=room_id).order_by('-created_at')[:limit]
+    return [message.to_dict() for message in reversed(messages)]
+
+
+chat_writer = ChatWriter()
+chat_history = ChatHistory()
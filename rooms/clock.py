@@ -0,0 +1,44 @@
+# rooms/clock.py
+
+import time
+from datetime import datetime, timezone as dt_timezone
+
+# Wall-clock time at which this process' monotonic clock read zero. Server
+# time is derived from the monotonic clock plus this offset, so it never
+# jumps backwards when the system clock is adjusted.
+_EPOCH_OFFSET = time.time() - time.monotonic()
+
+
+def server_time_ms():
+    """Current server time in milliseconds since the epoch."""
+    return (time.monotonic() + _EPOCH_OFFSET) * 1000
+
+
+def server_now():
+    """Current server time as an aware datetime, used as a playback anchor."""
+    return datetime.fromtimestamp(server_time_ms() / 1000, tz=dt_timezone.utc)
+
+
+def playback_position(room, now=None):
+    """
+    Position (in seconds) of the current song.
+    `current_position` is the position at the `playback_started_at` anchor;
+    while playing, the position advances with server time from there.
+    """
+    position = room.current_position or 0
+    if room.is_playing and room.playback_started_at:
+        now = now or server_now()
+        position += max((now - room.playback_started_at).total_seconds(), 0)
+    return position
+
+
+def clock_payload(room):
+    """Anchor fields that let a client compute the position at any moment."""
+    anchor = room.playback_started_at
+    return {
+        'is_playing': room.is_playing,
+        'anchor_position': room.current_position or 0,
+        'anchor_time': anchor.timestamp() * 1000 if anchor else None,
+        'server_time': server_time_ms(),
+        'current_time': playback_position(room),
+    }
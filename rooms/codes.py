@@ -0,0 +1,55 @@
+# rooms/codes.py
+"""
+Room code encoding.
+
+Room codes are the values 0 .. 36^6 - 1 of a database sequence, passed
+through a keyed permutation and written in base 36. Distinct sequence
+numbers always give distinct codes, and consecutive rooms get unrelated
+codes, so the next room's code can't be guessed from your own.
+"""
+
+import hashlib
+import string
+
+from django.conf import settings
+
+ALPHABET = string.ascii_uppercase + string.digits
+CODE_LENGTH = 6
+HALF_SPACE = len(ALPHABET) ** (CODE_LENGTH // 2)
+CODE_SPACE = HALF_SPACE * HALF_SPACE
+ROUNDS = 4
+
+
+def _round_key(round_number):
+    secret = getattr(settings, 'ROOM_CODE_KEY', None) or settings.SECRET_KEY
+    return hashlib.blake2b(f'{round_number}:{secret}'.encode(), digest_size=16).digest()
+
+
+def _round(value, key):
+    digest = hashlib.blake2b(value.to_bytes(4, 'big'), key=key, digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % HALF_SPACE
+
+
+def permute(number):
+    """
+    Bijection on [0, CODE_SPACE): a balanced Feistel network over the two
+    base-36^3 halves of the number, with modular addition so every round
+    stays inside the code space.
+    """
+    left, right = divmod(number % CODE_SPACE, HALF_SPACE)
+    for round_number in range(ROUNDS):
+        left, right = right, (left + _round(right, _round_key(round_number))) % HALF_SPACE
+    return left * HALF_SPACE + right
+
+
+def encode(number):
+    chars = []
+    for _ in range(CODE_LENGTH):
+        number, digit = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+def code_for(sequence_value):
+    """The room code of the n-th allocated room."""
+    return encode(permute(sequence_value))
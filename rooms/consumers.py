@@ -1,139 +1,175 @@
 # rooms/consumers.py
 
 import json
+import logging
+import math
+import uuid
+from time import perf_counter
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
-from channels.db import database_sync_to_async
-from django.contrib.auth.models import AnonymousUser
-from rest_framework_simplejwt.tokens import UntypedToken  # Fixed: was UntokenedToken
-from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
-from django.contrib.auth import get_user_model
-from .models import Room, RoomParticipant
-from urllib.parse import parse_qs
+from . import metrics, wire
+from .chat import chat_history, chat_writer
+from .clock import clock_payload, playback_position, server_now, server_time_ms
+from .frames import dumps, group_event, loads
+from .log import log_event
+from .metrics import timed_database_sync_to_async
+from .models import QueueItem, Room, RoomParticipant
+from .outbox import Outbox
+from .presence import get_presence
+from .ratelimit import rate_limiter
+from .roster import roster_updates
+from .snapshot import invalidate_participants, invalidate_playback
+from .state import (
+    StaleRoomState, load_room_state, publish_room_state, room_state_channel, room_states,
+)
+from .sweeper import activity, reactivate_participant, room_sweeper
+from .writebehind import playback_writes
 
-User = get_user_model()
+logger = logging.getLogger(__name__)
+
+# High-frequency client messages get their own event names so they can be sampled
+MESSAGE_EVENTS = {'ping': 'ws.ping', 'sync_playback': 'ws.sync'}
 
 class RoomConsumer(AsyncJsonWebsocketConsumer):
     """
     WebSocket consumer for room real-time communication.
-    Handles user authentication via JWT token in query parameters.
+    Expects scope['user'] to be set by rooms.auth.JWTAuthMiddleware.
     """
 
+    # Whether this connection negotiated binary frames (see rooms.wire)
+    binary = False
+    # Outbound frame queue, set up once the connection is accepted (see rooms.outbox)
+    outbox = None
+
     async def connect(self):
-        print("--- WebSocket connect() called. ---")
-        
         # 1. Get the room code from the URL
         self.room_code = self.scope['url_route']['kwargs']['code']
         self.room_group_name = f'room_{self.room_code}'
         
-        print(f"Attempting to connect to room: {self.room_code}")
-        
-        # 2. Extract JWT token from query string
-        query_string = self.scope.get('query_string', b'').decode()
-        print(f"Query string: {query_string}")
-        
-        if not query_string:
-            print("No query string found, rejecting connection")
-            await self.close(code=4001)
-            return
-        
-        # Parse query parameters
-        query_params = parse_qs(query_string)
-        token = query_params.get('token', [None])[0]
+        log_event(logger, logging.DEBUG, 'ws.connect', "Connecting to room %s", self.room_code,
+                  room=self.room_code)
         
-        if not token:
-            print("No token found in query parameters, rejecting connection")
-            await self.close(code=4001)
-            return
-        
-        print(f"Token found: {token[:20]}...")
-        
-        # 3. Authenticate user using JWT token
-        try:
-            # Decode the JWT token
-            untyped_token = UntypedToken(token)  # Fixed: was UntokenedToken
-            user_id = untyped_token['user_id']
-            print(f"Token decoded successfully, user_id: {user_id}")
-            
-            # Get the user from database
-            self.user = await self.get_user(user_id)
-            
-            if not self.user:
-                print(f"User with ID {user_id} not found, rejecting connection")
-                await self.close(code=4001)
-                return
-                
-            print(f"User authenticated: {self.user.name}")
-            
-        except (InvalidToken, TokenError) as e:
-            print(f"Invalid token, rejecting connection: {e}")
-            await self.close(code=4001)
-            return
-        except Exception as e:
-            print(f"Error during authentication: {e}")
+        # 2. The user was authenticated by JWTAuthMiddleware from the token in the query string
+        self.user = self.scope.get('user')
+        if not self.user or not self.user.is_authenticated:
+            log_event(logger, logging.INFO, 'ws.reject', "Rejected unauthenticated connection to room %s",
+                      self.room_code, room=self.room_code, code=4001)
+            self.user = None
             await self.close(code=4001)
             return
         
-        # 4. Check if room exists and is active
-        room = await self.get_room()
+        # 3. Check if room exists and is active
+        room = await self.get_room_state()
         if not room:
-            print(f"Room {self.room_code} not found or inactive, rejecting connection")
+            log_event(logger, logging.INFO, 'ws.reject', "Room %s not found or inactive",
+                      self.room_code, room=self.room_code, user_id=self.user.id, code=4004)
             await self.close(code=4004)
             return
         
-        # 5. Check if user is a participant in this room
-        is_participant = await self.is_user_participant(room)
-        if not is_participant:
-            print(f"User {self.user.name} is not a participant in room {self.room_code}")
+        # 4. Check if user is a participant in this room, and remember their role
+        participant = await self.get_participant(room)
+        if not participant:
+            log_event(logger, logging.INFO, 'ws.reject', "User %s is not a participant in room %s",
+                      self.user.id, self.room_code, room=self.room_code, user_id=self.user.id, code=4003)
             await self.close(code=4003)
             return
+        self.role, is_active = participant
+        
+        # Connecting counts as activity, and brings back a participant the sweeper deactivated
+        self.room_id = room.room_id
+        if is_active:
+            activity.touch(self.room_id, self.user.id)
+        else:
+            # Their place may have been taken since the sweeper deactivated them
+            if not await self.can_rejoin():
+                log_event(logger, logging.INFO, 'ws.reject', "Room %s is full", self.room_code,
+                          room=self.room_code, user_id=self.user.id, code=4009)
+                await self.close(code=4009)
+                return
+            await timed_database_sync_to_async(reactivate_participant)(self.room_id, self.user.id)
+            invalidate_participants(self.room_code)
         
-        print(f"User {self.user.name} is authorized for room {self.room_code}")
+        # Keep the cached room state alive while this connection is open
+        room_states.acquire(self.room_code)
+        room_states.set(self.room_code, room)
+        self.holds_room_state = True
+        if room_states.connection_count(self.room_code) == 1:
+            await room_state_channel.update(self.channel_layer, self.room_code)
         
-        # 6. Add user to the room group
+        # 5. Add user to the room group
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
         
-        # 7. Accept the connection
-        await self.accept()
-        print(f"WebSocket connection accepted for user {self.user.name}")
+        # 6. Accept the connection, in the wire protocol the client asked for
+        subprotocol = wire.select_protocol(self.scope.get('subprotocols', []))
+        self.binary = subprotocol == wire.MSGPACK_PROTOCOL
+        await self.accept(subprotocol=subprotocol)
+        self.accepted = True
+        # Clients that negotiated a subprotocol also understand batched frames
+        self.outbox = Outbox(self.write_frame, self.close_slow_client, batching=subprotocol is not None)
+        metrics.ws_connects.labels('accepted').inc()
+        metrics.ws_connections.inc()
+        room_sweeper.ensure_running()
+        self.rate_limit_keys = {'connection': self.channel_name, 'user': self.user.id, 'room': self.room_code}
+        log_event(logger, logging.INFO, 'ws.accept', "User %s connected to room %s",
+                  self.user.id, self.room_code, room=self.room_code, user_id=self.user.id, role=self.role)
+        
+        # 7. Mark this connection present, send the roster, and announce
+        # the user (batched) unless they were already online in another tab
+        presence = get_presence()
+        self.member = {'user_id': self.user.id, 'name': self.user.name, 'role': self.role}
+        first_connection = await presence.join(self.room_code, self.channel_name, self.member)
+        self.present = True
+        roster = await presence.roster(self.room_code)
+        await self.send_json({
+            'type': 'roster',
+            'participants': roster,
+            'online_count': len(roster),
+        })
+        if first_connection:
+            await roster_updates.join(self.room_code, self.member)
+        
+        # Replay recent chat
+        history = await chat_history.recent(self.room_code, self.room_id)
+        if history:
+            await self.send_json({
+                'type': 'chat_history',
+                'messages': history,
+            })
         
-        # 8. Announce that user has joined
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user.join',
-                'payload': {
-                    'user_id': self.user.id,
-                    'name': self.user.name,
-                }
-            }
-        )
+        # 8. Bring a late joiner up to the current playback position
+        if room.current_song:
+            await self.send_json({
+                'type': 'playback_state',
+                'current_song': room.current_song,
+                'current_artist': room.current_artist,
+                'song_url': room.current_song_url,
+                **clock_payload(room)
+            })
 
     async def disconnect(self, close_code):
         """
         Called when the WebSocket connection is closed.
         """
-        print(f"--- WebSocket disconnect() called. Close code: {close_code} ---")
-        
-        # Only proceed if user was successfully authenticated
-        if hasattr(self, 'user') and self.user and hasattr(self.user, 'name'):
-            print(f"User {self.user.name} disconnecting from room {self.room_code}")
+        if self.outbox is not None:
+            self.outbox.discard()
+        if getattr(self, 'accepted', False):
+            self.accepted = False
+            metrics.ws_connections.dec()
+            metrics.ws_disconnects.labels(metrics.close_code_label(close_code)).inc()
+        
+        # Only proceed if this connection made it into the room
+        if getattr(self, 'present', False):
+            self.present = False
+            log_event(logger, logging.INFO, 'ws.disconnect', "User %s left room %s (code %s)",
+                      self.user.id, self.room_code, close_code,
+                      room=self.room_code, user_id=self.user.id, code=close_code)
             
-            # Announce that user has left
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user.leave',
-                    'payload': {
-                        'user_id': self.user.id,
-                        'name': self.user.name,
-                    }
-                }
-            )
-        else:
-            print("User was not authenticated, skipping user.leave announcement")
+            # Announce (batched) that user has left, unless they are still online in another tab
+            member = await get_presence().leave(self.room_code, self.channel_name)
+            if member:
+                await roster_updates.leave(self.room_code, member)
         
         # Remove user from the room group
         if hasattr(self, 'room_group_name') and hasattr(self, 'channel_name'):
@@ -141,18 +177,151 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
                 self.room_group_name,
                 self.channel_name
             )
+        
+        if getattr(self, 'holds_room_state', False):
+            self.holds_room_state = False
+            activity.touch(self.room_id, self.user.id)
+            if room_states.connection_count(self.room_code) == 1:
+                # Last local user is leaving: persist any buffered position first
+                await playback_writes.flush_room(self.room_code)
+                chat_history.discard(self.room_code)
+            if not room_states.release(self.room_code):
+                await room_state_channel.update(self.channel_layer, self.room_code)
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        if bytes_data is not None and self.binary:
+            try:
+                content = wire.decode(bytes_data)
+            except ValueError as exc:
+                await self.send_json({'type': 'error', 'message': str(exc)})
+                return
+            await self.receive_json(content)
+        else:
+            await super().receive(text_data=text_data, bytes_data=bytes_data, **kwargs)
 
     async def receive_json(self, content):
         """Enhanced to handle music control messages"""
-        print(f"Received message from {self.user.name}: {content}")
-        
-        message_type = content.get('type')
+        received_at = server_time_ms()
+        message_type = content.get('type') if isinstance(content, dict) else None
+        if not isinstance(message_type, str):
+            # Handled as an unknown type; also keeps it out of label and bucket lookups
+            message_type = None
+        label = metrics.message_type_label(message_type)
+        log_event(logger, logging.DEBUG, MESSAGE_EVENTS.get(label, 'ws.message'),
+                  "Received %s from user %s", label, self.user.id,
+                  room=self.room_code, user_id=self.user.id, type=label)
+        metrics.ws_messages.labels(label).inc()
+        
+        limited = rate_limiter.check(message_type, self.rate_limit_keys)
+        if limited:
+            scope, retry_after = limited
+            metrics.ws_rate_limited.labels(label, scope).inc()
+            log_event(logger, logging.INFO, 'ws.rate_limited', "Rate limited %s from user %s (%s limit)",
+                      label, self.user.id, scope, room=self.room_code, user_id=self.user.id,
+                      type=label, scope=scope)
+            await self.send_json({
+                'type': 'rate_limited',
+                'message_type': message_type,
+                'scope': scope,
+                'retry_after': math.ceil(retry_after * 1000)
+            })
+            return
         
+        started = perf_counter()
+        with metrics.track_db_time() as db_time:
+            try:
+                await self.dispatch_message(message_type, content, received_at)
+                activity.touch(self.room_id, self.user.id)
+            except StaleRoomState:
+                # Another worker changed the room since we cached it
+                room_states.invalidate(self.room_code)
+                await self.send_json({
+                    'type': 'error',
+                    'message': 'Room state changed, please try again'
+                })
+        metrics.ws_handler_seconds.labels(label).observe(perf_counter() - started)
+        metrics.ws_handler_db_seconds.labels(label).observe(db_time.seconds)
+
+    async def close(self, code=None, reason=None):
+        """Close the socket, counting rejections (4001/4003/4004) made during connect."""
+        if not getattr(self, 'accepted', False):
+            metrics.ws_connects.labels(code or 'closed').inc()
+        if self.outbox is not None:
+            # Send what is already queued, e.g. the frame explaining the close
+            await self.outbox.drain()
+        await super().close(code=code)
+
+    async def close_slow_client(self):
+        """Called by the outbox when this client can't keep up with the room."""
+        log_event(logger, logging.WARNING, 'ws.slow_client', "Closing slow connection of user %s in room %s",
+                  self.user.id, self.room_code, room=self.room_code, user_id=self.user.id, code=4008)
+        await self.close(code=4008)
+
+    async def dispatch(self, message):
+        # Channel-layer events (not websocket.* frames) show how far behind this consumer is
+        if not message['type'].startswith('websocket.'):
+            depth = metrics.channel_queue_depth(self.channel_layer, self.channel_name)
+            if depth is not None:
+                metrics.channel_backlog.observe(depth)
+        await super().dispatch(message)
+
+    @classmethod
+    async def decode_json(cls, text_data):
+        return loads(text_data)
+
+    @classmethod
+    async def encode_json(cls, content):
+        return dumps(content)
+
+    async def send(self, text_data=None, bytes_data=None, close=False, kind=None):
+        """Queue a frame of type `kind` on the outbox rather than waiting for the client."""
+        if self.outbox is None:
+            await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+            return
+        self.outbox.put(kind, text=text_data, data=bytes_data)
+        if close:
+            await self.close()
+
+    async def write_frame(self, text_data=None, bytes_data=None):
+        """Write one frame to the client (called by the outbox)."""
+        await super().send(text_data=text_data, bytes_data=bytes_data)
+
+    async def send_json(self, content, close=False):
+        """Send a frame, in binary if this connection negotiated it and the type has a binary form."""
+        kind = content.get('type')
+        data = wire.encode(content) if self.binary else None
+        if data is not None:
+            await self.send(bytes_data=data, close=close, kind=kind)
+        else:
+            await self.send(text_data=await self.encode_json(content), close=close, kind=kind)
+
+    async def send_event(self, event, kind=None):
+        """Deliver a frame pre-encoded by rooms.frames.group_event."""
+        if self.binary and 'bytes' in event:
+            await self.send(bytes_data=event['bytes'], kind=kind)
+        else:
+            await self.send(text_data=event['text'], kind=kind)
+
+    async def broadcast(self, event):
+        """
+        Send an event to everyone in the room group, recording the fan-out.
+        Events for clients come from group_event(), already encoded.
+        """
+        metrics.observe_group_send(self.channel_layer, self.room_group_name, event['type'])
+        await self.channel_layer.group_send(self.room_group_name, event)
+
+    async def dispatch_message(self, message_type, content, received_at):
+        """Route a client message to its handler"""
         if message_type == 'ping':
+            # NTP-style reply: the client estimates its clock offset from
+            # its send/receive times and the server receive/send times.
             await self.send_json({
                 'type': 'pong',
-                'timestamp': content.get('timestamp')
+                'timestamp': content.get('timestamp'),
+                'server_received': received_at,
+                'server_time': server_time_ms()
             })
+            await self.heartbeat()
         elif message_type == 'chat_message':
             await self.handle_chat_message(content)
         elif message_type == 'toggle_playback':
@@ -166,7 +335,8 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
         elif message_type == 'sync_playback':
             await self.handle_sync_playback(content)
         else:
-            print(f"Unknown message type: {message_type}")
+            log_event(logger, logging.WARNING, 'ws.unknown_type', "Unknown message type from user %s",
+                      self.user.id, room=self.room_code, user_id=self.user.id, type=str(message_type)[:50])
             await self.send_json({
                 'type': 'error',
                 'message': f'Unknown message type: {message_type}'
@@ -174,39 +344,31 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
 
     async def handle_toggle_playback(self, content):
         """Handle play/pause toggle - host only"""
-        room = await self.get_room()
-        if not room or not await self.is_user_host(room):
+        room = await self.get_room_state()
+        if not room or not self.is_host:
             await self.send_json({'type': 'error', 'message': 'Only host can control playback'})
             return
         
         # Toggle the playback state
         new_state = not room.is_playing
         await self.update_room_playback(room, new_state)
-        
-        # Get updated room data
-        updated_room = await self.get_room()
+        updated_room = room
         
         # Broadcast to all participants
         message_type = 'song_resumed' if new_state else 'song_paused'
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'playback.changed',
-                'payload': {
-                    'type': message_type,
-                    'is_playing': new_state,
-                    'current_song': updated_room.current_song,
-                    'current_artist': updated_room.current_artist,
-                    'current_time': updated_room.current_position,
-                    'timestamp': content.get('timestamp')
-                }
-            }
-        )
+        await self.broadcast(group_event('playback.changed', {
+            'type': message_type,
+            'current_song': updated_room.current_song,
+            'current_artist': updated_room.current_artist,
+            'timestamp': content.get('timestamp'),
+            **clock_payload(updated_room),
+            'is_playing': new_state
+        }))
 
     async def handle_next_song(self, content):
         """Handle next song - host only"""
-        room = await self.get_room()
-        if not room or not await self.is_user_host(room):
+        room = await self.get_room_state()
+        if not room or not self.is_host:
             await self.send_json({'type': 'error', 'message': 'Only host can control playback'})
             return
         
@@ -214,30 +376,32 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
         next_song_data = await self.get_next_song(room)
         
         if next_song_data:
-            await self.start_song(room, next_song_data['title'], next_song_data['artist'], next_song_data.get('url'))
+            try:
+                await self.start_song(room, next_song_data['title'], next_song_data['artist'], next_song_data.get('url'))
+            except StaleRoomState:
+                # The song is already off the queue, so retry on fresh state rather than drop it
+                room_states.invalidate(self.room_code)
+                room = await self.get_room_state()
+                if not room:
+                    await self.send_json({'type': 'error', 'message': 'Room is no longer active'})
+                    return
+                await self.start_song(room, next_song_data['title'], next_song_data['artist'], next_song_data.get('url'))
             
             # Broadcast the change
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'song.started',
-                    'payload': {
-                        'type': 'song_started',
-                        'current_song': next_song_data['title'],
-                        'current_artist': next_song_data['artist'],
-                        'song_url': next_song_data.get('url'),
-                        'is_playing': True,
-                        'current_time': 0
-                    }
-                }
-            )
+            await self.broadcast(group_event('song.started', {
+                'type': 'song_started',
+                'current_song': next_song_data['title'],
+                'current_artist': next_song_data['artist'],
+                'song_url': next_song_data.get('url'),
+                **clock_payload(room)
+            }))
         else:
             await self.send_json({'type': 'error', 'message': 'No songs in queue'})
 
     async def handle_previous_song(self, content):
         """Handle previous song - host only"""
-        room = await self.get_room()
-        if not room or not await self.is_user_host(room):
+        room = await self.get_room_state()
+        if not room or not self.is_host:
             await self.send_json({'type': 'error', 'message': 'Only host can control playback'})
             return
         
@@ -245,18 +409,13 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
         await self.simulate_next_song(room)
         
         # Broadcast the change
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'song.changed',
-                'payload': {
-                    'current_song': room.current_song,
-                    'current_artist': room.current_artist,
-                    'is_playing': room.is_playing,
-                    'current_position': 0
-                }
-            }
-        )
+        await self.broadcast(group_event('song.changed', {
+            'type': 'song_started',
+            'current_song': room.current_song,
+            'current_artist': room.current_artist,
+            'current_position': 0,
+            **clock_payload(room)
+        }))
 
     async def handle_add_song(self, content):
         """Handle adding song to queue"""
@@ -268,7 +427,7 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
             await self.send_json({'type': 'error', 'message': 'Song title and URL are required'})
             return
         
-        room = await self.get_room()
+        room = await self.get_room_state()
         if not room:
             return
         
@@ -276,20 +435,13 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
         if not room.current_song:
             # Start playing immediately
             await self.start_song(room, song_title, artist, song_url)
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'song.started',
-                    'payload': {
-                        'type': 'song_started',
-                        'current_song': song_title,
-                        'current_artist': artist,
-                        'song_url': song_url,
-                        'is_playing': True,
-                        'current_time': 0
-                    }
-                }
-            )
+            await self.broadcast(group_event('song.started', {
+                'type': 'song_started',
+                'current_song': song_title,
+                'current_artist': artist,
+                'song_url': song_url,
+                **clock_payload(room)
+            }))
             await self.send_json({'type': 'success', 'message': f'Now playing "{song_title}"'})
         else:
             # Add to queue
@@ -297,30 +449,46 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
             await self.send_json({'type': 'success', 'message': f'Added "{song_title}" to queue'})
 
     async def handle_sync_playback(self, content):
-        """Handle playback synchronization from host"""
-        room = await self.get_room()
-        if not room or not await self.is_user_host(room):
+        """
+        Handle a seek from the host.
+        The server clock keeps time between seeks, so hosts only send this
+        when the position jumps rather than streaming it.
+        """
+        room = await self.get_room_state()
+        if not room or not self.is_host:
             return
         
-        current_time = content.get('current_time', 0)
-        is_playing = content.get('is_playing', False)
+        try:
+            current_time = max(float(content.get('current_time', 0)), 0)
+        except (TypeError, ValueError):
+            await self.send_json({'type': 'error', 'message': 'Invalid playback position'})
+            return
+        is_playing = bool(content.get('is_playing', False))
         
-        # Update room state
+        # Re-anchor the playback clock
         await self.update_room_position(room, current_time, is_playing)
         
         # Sync with other participants (excluding host)
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'playback.sync',
-                'payload': {
-                    'type': 'playback_synced',
-                    'current_time': current_time,
-                    'is_playing': is_playing,
-                    'sync_from_host': True
-                }
-            }
-        )
+        await self.broadcast(group_event('playback.sync', {
+            'type': 'playback_synced',
+            **clock_payload(room),
+            'sync_from_host': True
+        }, exclude_host=True))
+        # The host already seeked; it only needs the new anchor for drift correction
+        await self.send_json({'type': 'playback_anchor', **clock_payload(room)})
+
+    async def heartbeat(self):
+        """
+        Pings double as the presence heartbeat: refresh this channel, come
+        back online if it lapsed while the client was unreachable, and
+        announce peers whose heartbeats lapsed as left.
+        """
+        presence = get_presence()
+        if not await presence.touch(self.room_code, self.channel_name):
+            if await presence.join(self.room_code, self.channel_name, self.member):
+                await roster_updates.join(self.room_code, self.member)
+        for member in await presence.expire(self.room_code):
+            await roster_updates.leave(self.room_code, member)
 
     async def handle_chat_message(self, content):
         """
@@ -330,161 +498,195 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
         if not message:
             return
         
-        # Broadcast the chat message to all room members
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat.message',
-                'payload': {
-                    'user_id': self.user.id,
-                    'name': self.user.name,
-                    'message': message,
-                    'timestamp': content.get('timestamp')
-                }
-            }
-        )
+        payload = {
+            'id': uuid.uuid4().hex,
+            'user_id': self.user.id,
+            'name': self.user.name,
+            'message': message,
+            'timestamp': content.get('timestamp'),
+            'created_at': server_time_ms(),
+        }
+        # Persisted in batches; the broadcast doesn't wait for the write
+        chat_writer.add(self.room_id, payload)
+        
+        # Broadcast the chat message to all room members; handlers keep the
+        # payload for history replay
+        await self.broadcast(group_event('chat.message', {
+            'type': 'chat_message',
+            **payload
+        }, payload=payload))
 
     # --- Event handlers called by channel_layer.group_send ---
+    # Client frames arrive encoded by the sender (rooms.frames.group_event)
     
-    async def user_join(self, event):
-        """Handle user join events."""
-        print(f"Broadcasting user_join: {event['payload']}")
-        await self.send_json({
-            'type': 'user_joined',
-            **event['payload']
-        })
-
-    async def user_leave(self, event):
-        """Handle user leave events."""
-        print(f"Broadcasting user_leave: {event['payload']}")
-        await self.send_json({
-            'type': 'user_left',
-            **event['payload']
-        })
+    async def roster_update(self, event):
+        """Handle batched join/leave deltas (see rooms.roster)."""
+        await self.send_event(event)
 
     async def chat_message(self, event):
         """Handle chat message events."""
-        await self.send_json({
-            'type': 'chat_message',
-            **event['payload']
-        })
+        chat_history.append(self.room_code, event['payload'])
+        await self.send_event(event)
 
     async def playback_changed(self, event):
         """Handle playback state changes"""
-        await self.send_json(event['payload'])
+        await self.send_event(event, kind='playback_changed')
 
     async def song_changed(self, event):
-        await self.send_json({
-            'type': 'song_started',
-            **event['payload']
-        })
+        await self.send_event(event)
 
     async def song_started(self, event):
         """Handle new song starting"""
-        await self.send_json(event['payload'])
+        await self.send_event(event)
 
     async def playback_sync(self, event):
         """Handle playback synchronization"""
         # Don't send sync messages back to the host
-        if not event['payload'].get('sync_from_host') or not await self.is_user_host(await self.get_room()):
-            await self.send_json(event['payload'])
+        if not event.get('exclude_host') or not self.is_host:
+            await self.send_event(event, kind='playback_synced')
+
+    async def participant_role(self, event):
+        """Handle role changes such as a host handoff."""
+        payload = event['payload']
+        if payload['user_id'] == self.user.id:
+            self.role = payload['role']
+            self.member = {**self.member, 'role': self.role}
+            await get_presence().add(self.room_code, self.channel_name, self.member)
+        if payload['role'] == 'host':
+            room = room_states.get(self.room_code)
+            if room:
+                room.host_id = payload['user_id']
+        await self.send_event(event)
+
+    async def participant_removed(self, event):
+        """Close this connection if its user was removed from the room."""
+        if event['payload']['user_id'] == self.user.id:
+            self.role = None
+            await self.close(code=4003)
+
+    @property
+    def is_host(self):
+        """Whether this connection's user is the room host, as resolved at connect."""
+        return getattr(self, 'role', None) == 'host'
+
+    # --- Room state cache ---
+
+    async def get_room_state(self):
+        """Get the room state from the process cache, loading it on a miss."""
+        state = room_states.get(self.room_code)
+        if state is None:
+            state = await timed_database_sync_to_async(load_room_state)(self.room_code)
+            if state:
+                room_states.set(self.room_code, state)
+        return state
+
+    async def save_room_state(self, room, fields):
+        """
+        Write changed fields to the Room row, then update and publish the cached state.
+        Raises StaleRoomState if the row changed since the state was cached.
+        """
+        # Wait out a flush in progress: it bumps room.version when it lands
+        async with playback_writes.writing(self.room_code):
+            # A state transition also persists any buffered host seek
+            fields = {**playback_writes.take(self.room_code), **fields}
+            if not await self.write_room_fields(room.room_id, room.version, fields):
+                raise StaleRoomState(self.room_code)
+            room.update(fields)
+            room.version += 1
+        await invalidate_playback(self.room_code)
+        await self.publish_room_state(room)
+
+    async def buffer_room_state(self, room, fields):
+        """Apply and publish fields now, but leave the Room row write to the write-behind buffer."""
+        room.update(fields)
+        playback_writes.add(self.room_code, room, fields)
+        await self.publish_room_state(room)
+
+    async def publish_room_state(self, room):
+        """Send the cached state to other workers."""
+        await publish_room_state(self.channel_layer, self.room_code, room)
 
     # --- Database operations ---
     
-    @database_sync_to_async
-    def get_user(self, user_id):
-        """Get user by ID from database."""
-        try:
-            return User.objects.get(id=user_id)
-        except User.DoesNotExist:
-            return None
+    @timed_database_sync_to_async
+    def get_participant(self, room):
+        """Get the user's (role, is_active) in the room, or None if they are not a participant."""
+        return RoomParticipant.objects.filter(
+            room_id=room.room_id, user_id=self.user.id
+        ).values_list('role', 'is_active').first()
 
-    @database_sync_to_async
-    def get_room(self):
-        """Get room by code from database."""
-        try:
-            return Room.objects.get(code=self.room_code, status='active')
-        except Room.DoesNotExist:
-            return None
+    @timed_database_sync_to_async
+    def can_rejoin(self):
+        """Whether the room still has a place for this (inactive) participant."""
+        return Room.objects.get(pk=self.room_id).can_join(self.user)
 
-    @database_sync_to_async
-    def is_user_participant(self, room):
-        """Check if user is a participant in the room."""
-        try:
-            RoomParticipant.objects.get(room=room, user=self.user)
-            return True
-        except RoomParticipant.DoesNotExist:
-            return False
-
-    @database_sync_to_async
-    def is_user_host(self, room):
-        """Check if user is the host of the room."""
-        try:
-            participant = RoomParticipant.objects.get(room=room, user=self.user)
-            return participant.role == 'host'
-        except RoomParticipant.DoesNotExist:
-            return False
-
-    @database_sync_to_async
-    def update_room_playback(self, room, is_playing):
-        """Update room playback state"""
-        from django.utils import timezone
-        room.is_playing = is_playing
+    @timed_database_sync_to_async
+    def write_room_fields(self, room_id, version, fields):
+        """Update only the given columns of the room row, if it is still at `version`"""
+        return Room.objects.update_playback(room_id, version, **fields)
+
+    @timed_database_sync_to_async
+    def enqueue_song(self, room_id, title, artist, url):
+        """Append a song to the room's queue table"""
+        item = QueueItem.objects.enqueue(
+            room_id, title=title, artist=artist, url=url, added_by_id=self.user.id
+        )
+        return item.to_dict()
+
+    @timed_database_sync_to_async
+    def dequeue_song(self, room_id):
+        """Pop the head of the room's queue, returning it and the new head"""
+        item = QueueItem.objects.dequeue(room_id)
+        if item is None:
+            return None, None
+        head = QueueItem.objects.head(room_id)
+        return item.to_dict(), head.to_dict() if head else None
+
+    async def update_room_playback(self, room, is_playing):
+        """Update room playback state, re-anchoring the clock at the current position"""
         if is_playing and not room.current_song:
             return  # Can't play if no song is set
-        if is_playing:
-            room.playback_started_at = timezone.now()
-        room.save()
-
-    @database_sync_to_async
-    def update_room_position(self, room, current_time, is_playing):
-        """Update room playback position and state"""
-        room.current_position = int(current_time)
-        room.is_playing = is_playing
-        room.save()
-
-    @database_sync_to_async
-    def start_song(self, room, title, artist, url=None):
+        now = server_now()
+        await self.save_room_state(room, {
+            'is_playing': is_playing,
+            'current_position': playback_position(room, now),
+            'playback_started_at': now,
+        })
+
+    async def update_room_position(self, room, current_time, is_playing):
+        """Re-anchor the playback clock at the given position (written behind)"""
+        await self.buffer_room_state(room, {
+            'current_position': current_time,
+            'is_playing': is_playing,
+            'playback_started_at': server_now(),
+        })
+
+    async def start_song(self, room, title, artist, url=None):
         """Start playing a new song"""
-        from django.utils import timezone
-        room.current_song = title
-        room.current_artist = artist
-        room.is_playing = True
-        room.current_position = 0
-        room.playback_started_at = timezone.now()
-        
-        # Store URL in queue_data for now (you can improve this later)
-        if url:
-            queue_data = room.queue_data or []
-            # Remove the current song from queue if it exists
-            queue_data = [song for song in queue_data if song.get('title') != title]
-            room.queue_data = queue_data
-        
-        room.save()
-
-    @database_sync_to_async
-    def add_to_queue(self, room, title, artist, url):
+        fields = {
+            'current_song': title,
+            'current_artist': artist,
+            'current_song_url': url,
+            'is_playing': True,
+            'current_position': 0,
+            'playback_started_at': server_now(),
+        }
+        await self.save_room_state(room, fields)
+
+    async def add_to_queue(self, room, title, artist, url):
         """Add song to the room's queue"""
-        from django.utils import timezone
-        queue_data = room.queue_data or []
-        queue_data.append({
-            'title': title,
-            'artist': artist,
-            'url': url,
-            'added_by': self.user.id,
-            'added_at': str(timezone.now())
-        })
-        room.queue_data = queue_data
-        room.save()
+        item = await self.enqueue_song(room.room_id, title, artist, url)
+        if room.queue_head is None:
+            room.queue_head = item
+            await invalidate_playback(self.room_code)
+            await self.publish_room_state(room)
 
-    @database_sync_to_async
-    def get_next_song(self, room):
+    async def get_next_song(self, room):
         """Get the next song from queue"""
-        queue_data = room.queue_data or []
-        if queue_data:
-            next_song = queue_data.pop(0)  # Get first song and remove it
-            room.queue_data = queue_data
-            room.save()
+        next_song, queue_head = await self.dequeue_song(room.room_id)
+        if next_song:
+            # The caller starts the song, which publishes the new queue head
+            room.queue_head = queue_head
             return next_song
         
         # If no queue, return a sample song for testing
@@ -504,8 +706,7 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
         import random
         return random.choice(sample_songs)
 
-    @database_sync_to_async
-    def simulate_next_song(self, room):
+    async def simulate_next_song(self, room):
         """Simulate changing to next song (replace with actual queue logic)"""
         # This is a placeholder - you can implement actual queue logic
         sample_songs = [
@@ -517,9 +718,10 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
         import random
         song, artist = random.choice(sample_songs)
         
-        from django.utils import timezone
-        room.current_song = song
-        room.current_artist = artist
-        room.current_position = 0
-        room.playback_started_at = timezone.now()
-        room.save()
\ No newline at end of file
+        await self.save_room_state(room, {
+            'current_song': song,
+            'current_artist': artist,
+            'current_song_url': None,
+            'current_position': 0,
+            'playback_started_at': server_now(),
+        })
@@ -0,0 +1,35 @@
+# rooms/deflate.py
+"""
+permessage-deflate for WebSocket connections served by daphne.
+
+Compression is negotiated by the ASGI server, not by consumers, and
+daphne never accepts a client's permessage-deflate offer. With
+WS_PERMESSAGE_DEFLATE = True, RoomsConfig.ready() calls
+`enable_permessage_deflate()` so daphne's factory accepts it. Under
+uvicorn use its --ws-per-message-deflate option instead.
+"""
+
+
+def accept_deflate(offers):
+    from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+
+    for offer in offers:
+        if isinstance(offer, PerMessageDeflateOffer):
+            return PerMessageDeflateOfferAccept(offer)
+    return None
+
+
+def enable_permessage_deflate():
+    """Make daphne's WebSocket factory accept permessage-deflate offers."""
+    from daphne.ws_protocol import WebSocketFactory
+
+    if getattr(WebSocketFactory, 'accepts_deflate', False):
+        return
+    set_protocol_options = WebSocketFactory.setProtocolOptions
+
+    def setProtocolOptions(self, **options):
+        options.setdefault('perMessageCompressionAccept', accept_deflate)
+        set_protocol_options(self, **options)
+
+    WebSocketFactory.setProtocolOptions = setProtocolOptions
+    WebSocketFactory.accepts_deflate = True
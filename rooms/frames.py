@@ -0,0 +1,43 @@
+# rooms/frames.py
+"""
+JSON encoding of WebSocket frames.
+
+Room broadcasts are encoded once by the sender (see `group_event`) and
+travel through the channel layer as text, so every recipient's handler
+passes the same string to send(text_data=...) instead of encoding the
+frame again per connection. orjson is used when it is installed.
+"""
+
+import json
+
+from . import wire
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    def dumps(frame):
+        return orjson.dumps(frame).decode()
+
+    loads = orjson.loads
+else:
+    def dumps(frame):
+        return json.dumps(frame, separators=(',', ':'))
+
+    loads = json.loads
+
+
+def group_event(event_type, frame, **fields):
+    """
+    A group_send event delivering `frame` to clients pre-encoded as `text`,
+    plus `bytes` for frame types with a binary form (see rooms.wire).
+    `fields` travel alongside for handlers that filter or act on the event.
+    """
+    event = {'type': event_type, 'text': dumps(frame), **fields}
+    data = wire.encode(frame)
+    if data is not None:
+        event['bytes'] = data
+    return event
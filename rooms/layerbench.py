@@ -0,0 +1,112 @@
+# rooms/layerbench.py
+"""
+Channel layer fan-out benchmark.
+
+Creates `groups` groups of `members` channels on a layer, group_sends
+`messages` events into every group concurrently while all channels
+receive, and reports group sends and deliveries per second. Run it
+against the in-memory layer, real Redis hosts, or fakeredis servers
+standing in for Redis shards (see `manage.py bench_channel_layer`).
+"""
+
+import asyncio
+import time
+
+from channels.layers import InMemoryChannelLayer
+from channels_redis.core import RedisChannelLayer
+
+from .layers import ShardedRedisChannelLayer
+
+
+def fake_redis_hosts(shards):
+    """Host configs for `shards` independent in-process fakeredis servers."""
+    try:
+        from fakeredis import FakeServer
+        from fakeredis.aioredis import FakeConnection
+    except ImportError:
+        raise ImportError("fakeredis is not installed (pip install 'fakeredis[lua]')")
+    return [{'connection_class': FakeConnection, 'server': FakeServer()} for _ in range(shards)]
+
+
+def build_layer(kind, hosts=None, shards=1, capacity=1000, stock=False):
+    """`stock` uses channels_redis' own RedisChannelLayer, as a baseline."""
+    if kind == 'memory':
+        return InMemoryChannelLayer(capacity=capacity)
+    if kind == 'fake':
+        hosts = fake_redis_hosts(shards)
+    layer_class = RedisChannelLayer if stock else ShardedRedisChannelLayer
+    return layer_class(hosts=hosts, capacity=capacity)
+
+
+class LayerBenchmark:
+    def __init__(self, layer, groups=10, members=25, messages=50, payload_size=200):
+        self.layer = layer
+        self.groups = groups
+        self.members = members
+        self.messages = messages
+        self.payload = 'x' * payload_size
+
+    async def receive_all(self, channel, expected):
+        for _ in range(expected):
+            await self.layer.receive(channel)
+
+    async def send_all(self, group):
+        for sequence in range(self.messages):
+            await self.layer.group_send(group, {
+                'type': 'chat.message', 'sequence': sequence, 'payload': self.payload,
+            })
+
+    async def run_async(self):
+        groups = [f'bench_{index}' for index in range(self.groups)]
+        channels = []
+        for group in groups:
+            for _ in range(self.members):
+                channel = await self.layer.new_channel()
+                await self.layer.group_add(group, channel)
+                channels.append(channel)
+
+        receivers = [
+            asyncio.ensure_future(self.receive_all(channel, self.messages)) for channel in channels
+        ]
+        started = time.perf_counter()
+        await asyncio.gather(*(self.send_all(group) for group in groups))
+        sent = time.perf_counter() - started
+        await asyncio.gather(*receivers)
+        elapsed = time.perf_counter() - started
+
+        for group in groups:
+            for channel in channels:
+                await self.layer.group_discard(group, channel)
+        if hasattr(self.layer, 'flush'):
+            await self.layer.flush()
+
+        shards = getattr(self.layer, 'ring_size', 1)
+        group_sends = self.groups * self.messages
+        deliveries = group_sends * self.members
+        return {
+            'layer': type(self.layer).__name__,
+            'shards': shards,
+            'groups': self.groups,
+            'members': self.members,
+            'group_sends': group_sends,
+            'deliveries': deliveries,
+            'send_seconds': sent,
+            'seconds': elapsed,
+            'group_sends_per_second': group_sends / sent if sent else 0.0,
+            'deliveries_per_second': deliveries / elapsed if elapsed else 0.0,
+            'deliveries_per_second_per_shard': deliveries / elapsed / shards if elapsed else 0.0,
+        }
+
+    def run(self):
+        return asyncio.run(self.run_async())
+
+
+def format_report(report):
+    return '\n'.join([
+        f"{report['layer']} ({report['shards']} shards)",
+        f"{report['groups']} groups x {report['members']} members, {report['group_sends']} group sends "
+        f"-> {report['deliveries']} deliveries in {report['seconds']:.2f}s",
+        f"  group sends/s          {report['group_sends_per_second']:10.0f}",
+        f"  deliveries/s           {report['deliveries_per_second']:10.0f}",
+        f"  deliveries/s per shard {report['deliveries_per_second_per_shard']:10.0f}",
+    ])
@@ -0,0 +1,96 @@
+# rooms/layers.py
+"""
+Channel layer used in production: channels_redis' RedisChannelLayer with
+group sends cut down to one round trip per shard.
+
+Each room is a group (`room_<code>`), and a group's member set lives on
+the host picked by hashing its name, so rooms are spread across `hosts`
+by room code. A group_send then costs:
+
+- one pipelined round trip to the room's shard for the member list;
+- one EVALSHA per shard holding member channels, sent to all shards
+  concurrently, which expires old messages and queues the new one.
+
+The stock layer makes 2 + 2 x shards sequential round trips and sends
+the full Lua script each time. Each worker keeps one connection pool per
+host of up to `max_connections` connections.
+
+CHANNEL_LAYER=memory in the environment selects channels'
+InMemoryChannelLayer instead (see settings.CHANNEL_LAYERS), for a single
+worker or tests. `manage.py bench_channel_layer` measures either one.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+
+from channels_redis.core import RedisChannelLayer
+from redis.exceptions import NoScriptError
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# KEYS: channel keys; ARGV: one message per key, one capacity per key, now, expiry
+GROUP_SEND_LUA = """
+local over_capacity = 0
+local current_time = ARGV[#ARGV - 1]
+local expiry = ARGV[#ARGV]
+for i=1,#KEYS do
+    redis.call('ZREMRANGEBYSCORE', KEYS[i], 0, math.floor(current_time) - expiry)
+    if redis.call('ZCOUNT', KEYS[i], '-inf', '+inf') < tonumber(ARGV[i + #KEYS]) then
+        redis.call('ZADD', KEYS[i], current_time, ARGV[i])
+        redis.call('EXPIRE', KEYS[i], expiry)
+    else
+        over_capacity = over_capacity + 1
+    end
+end
+return over_capacity
+"""
+GROUP_SEND_SHA = hashlib.sha1(GROUP_SEND_LUA.encode()).hexdigest()
+
+
+class ShardedRedisChannelLayer(RedisChannelLayer):
+    # group_send observes metrics.group_send_fanout from the member list it fetched
+    records_fanout = True
+
+    def __init__(self, hosts=None, max_connections=50, **kwargs):
+        super().__init__(hosts=hosts, **kwargs)
+        if max_connections:
+            self.hosts = [{'max_connections': max_connections, **host} for host in self.hosts]
+
+    async def group_send(self, group, message):
+        assert self.require_valid_group_name(group), "Group name not valid"
+        key = self._group_key(group)
+        connection = self.connection(self.consistent_hash(group))
+        now = time.time()
+        async with connection.pipeline(transaction=False) as pipe:
+            pipe.zremrangebyscore(key, min=0, max=int(now) - self.group_expiry)
+            pipe.zrange(key, 0, -1)
+            _, members = await pipe.execute()
+        metrics.group_send_fanout.labels(message.get('type')).observe(len(members))
+        if not members:
+            return
+
+        channel_names = [member.decode('utf8') for member in members]
+        shard_keys, messages, capacities = self._map_channel_keys_to_connection(channel_names, message)
+        over_capacity = await asyncio.gather(*(
+            self._queue_on_shard(index, channel_keys, messages, capacities, now)
+            for index, channel_keys in shard_keys.items()
+        ))
+        if sum(over_capacity):
+            logger.info("%s of %s channels over capacity in group %s",
+                        sum(over_capacity), len(channel_names), group)
+
+    async def _queue_on_shard(self, index, channel_keys, messages, capacities, now):
+        """Queue the per-key messages on one shard; returns how many channels were full."""
+        connection = self.connection(index)
+        args = [messages[key] for key in channel_keys]
+        args += [capacities[key] for key in channel_keys]
+        args += [now, int(self.expiry)]
+        try:
+            return await connection.evalsha(GROUP_SEND_SHA, len(channel_keys), *channel_keys, *args)
+        except NoScriptError:
+            # First send to this shard since it started: EVAL also caches the script
+            return await connection.eval(GROUP_SEND_LUA, len(channel_keys), *channel_keys, *args)
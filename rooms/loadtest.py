@@ -0,0 +1,322 @@
+# rooms/loadtest.py
+"""
+In-process load test for the room WebSocket protocol.
+
+Runs the ASGI application from musicroom/asgi.py against a throwaway test
+database and an in-memory channel layer, drives N rooms x M participants
+with channels' WebsocketCommunicator, and reports latency percentiles,
+throughput and database queries per message.
+"""
+
+import asyncio
+import json
+import random
+import time
+
+from channels.layers import channel_layers
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import Room, RoomParticipant
+from .presence import reset_presence
+
+User = get_user_model()
+
+# Message kinds: who sends them and which frame marks them as delivered.
+MESSAGE_KINDS = {
+    'chat_message': {'sender': 'any', 'reply': 'chat_message', 'probe': 'sender'},
+    'sync_playback': {'sender': 'host', 'reply': 'playback_synced', 'probe': 'guest'},
+    'add_song': {'sender': 'any', 'reply': 'success', 'probe': 'sender'},
+    'next_song': {'sender': 'host', 'reply': 'song_started', 'probe': 'sender'},
+    'ping': {'sender': 'any', 'reply': 'pong', 'probe': 'sender'},
+}
+
+DEFAULT_MIX = {'chat_message': 5, 'sync_playback': 3, 'add_song': 1, 'next_song': 1}
+
+
+def disable_rate_limits():
+    """Let every message through: the load test measures the server, not WS_RATE_LIMITS."""
+    settings.WS_RATE_LIMITS = {}
+
+
+def use_in_memory_channel_layer(capacity=1000):
+    """Point the default channel layer and presence at fresh in-process backends."""
+    settings.CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+            'CONFIG': {'capacity': capacity},
+        },
+    }
+    channel_layers.backends.clear()
+    settings.ROOM_PRESENCE = {'BACKEND': 'rooms.presence.InMemoryPresence'}
+    reset_presence()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def summarize(samples):
+    """Latency summary in milliseconds."""
+    values = sorted(samples)
+    return {
+        'count': len(values),
+        'p50': percentile(values, 0.50) * 1000,
+        'p90': percentile(values, 0.90) * 1000,
+        'p99': percentile(values, 0.99) * 1000,
+        'max': (values[-1] if values else 0.0) * 1000,
+    }
+
+
+class QueryCounter:
+    """Counts SQL statements on every connection, including consumer threads."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, connection):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def _on_connection_created(self, sender, connection, **kwargs):
+        self.install(connection)
+
+    def __enter__(self):
+        connection_created.connect(self._on_connection_created)
+        for connection in connections.all():
+            self.install(connection)
+        return self
+
+    def __exit__(self, *exc_info):
+        connection_created.disconnect(self._on_connection_created)
+        for connection in connections.all():
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+
+class Client:
+    """A connected participant that drains its socket and resolves reply waiters."""
+
+    def __init__(self, application, room_code, user):
+        self.user = user
+        self.communicator = WebsocketCommunicator(
+            application,
+            f'/ws/rooms/{room_code}/?token={AccessToken.for_user(user)}',
+            headers=[(b'origin', b'http://localhost')],
+        )
+        self.waiters = {}
+        self.frames = 0
+        self.reader = None
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect()
+        if not connected:
+            raise RuntimeError(f'Connection refused for user {self.user.pk}')
+        self.reader = asyncio.ensure_future(self.read())
+
+    async def read(self):
+        while True:
+            message = await self.communicator.output_queue.get()
+            if message['type'] != 'websocket.send':
+                return
+            self.frames += 1
+            frame = json.loads(message['text'])
+            waiters = self.waiters.get(frame.get('type'))
+            if waiters:
+                waiters.pop(0).set_result(time.perf_counter())
+
+    def expect(self, frame_type):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(frame_type, []).append(future)
+        return future
+
+    async def send(self, content):
+        await self.communicator.send_json_to(content)
+
+    async def close(self):
+        if self.reader:
+            self.reader.cancel()
+        await self.communicator.disconnect()
+
+
+class LoadTest:
+    """Simulates `rooms` rooms of `participants` users each sending a message mix."""
+
+    def __init__(self, rooms=5, participants=10, messages=100, mix=None,
+                 timeout=5.0, seed=None):
+        self.room_count = rooms
+        self.participant_count = max(participants, 2)
+        self.message_count = messages
+        self.mix = mix or DEFAULT_MIX
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.latencies = {kind: [] for kind in MESSAGE_KINDS}
+        self.timeouts = 0
+
+    # --- Fixtures ---
+
+    def create_fixtures(self):
+        """Create rooms and participants; returns [(room_code, [host, *guests])]."""
+        run = int(time.time())
+        users = User.objects.bulk_create([
+            User(email=f'load-{run}-{index}@example.com', name=f'Load {index}', password='!')
+            for index in range(self.room_count * self.participant_count)
+        ])
+        fixtures = []
+        for index in range(self.room_count):
+            members = users[index * self.participant_count:(index + 1) * self.participant_count]
+            room = Room.objects.create(
+                name=f'Load room {index}', host=members[0], max_participants=len(members)
+            )
+            RoomParticipant.objects.bulk_create([
+                RoomParticipant(room=room, user=member, role='host' if member is members[0] else 'guest')
+                for member in members
+            ])
+            fixtures.append((room.code, members))
+        return fixtures
+
+    def build_message(self, kind, sequence):
+        if kind == 'chat_message':
+            return {'type': kind, 'message': f'load message {sequence}', 'timestamp': sequence}
+        if kind == 'sync_playback':
+            return {'type': kind, 'current_time': sequence % 240, 'is_playing': True}
+        if kind == 'add_song':
+            return {
+                'type': kind,
+                'song_title': f'Load track {sequence}',
+                'artist': 'Load Artist',
+                'song_url': f'https://example.com/load/{sequence}.mp3',
+            }
+        return {'type': kind, 'timestamp': sequence}
+
+    # --- Driving traffic ---
+
+    async def send_and_wait(self, clients, kind, sequence):
+        spec = MESSAGE_KINDS[kind]
+        sender = clients[0] if spec['sender'] == 'host' else self.random.choice(clients)
+        probe = sender if spec['probe'] == 'sender' else clients[1]
+        reply = probe.expect(spec['reply'])
+        started = time.perf_counter()
+        await sender.send(self.build_message(kind, sequence))
+        try:
+            finished = await asyncio.wait_for(reply, self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return
+        self.latencies[kind].append(finished - started)
+
+    async def drive_room(self, clients):
+        kinds = list(self.mix)
+        weights = [self.mix[kind] for kind in kinds]
+        for sequence in range(self.message_count):
+            kind = self.random.choices(kinds, weights)[0]
+            await self.send_and_wait(clients, kind, sequence)
+
+    async def connect_room(self, application, code, members):
+        clients = []
+        for member in members:
+            client = Client(application, code, member)
+            await client.connect()
+            clients.append(client)
+        return clients
+
+    async def measure_queries(self, clients, counter, samples=5):
+        """Queries per message of each kind, measured one message at a time."""
+        per_kind = {}
+        for kind in MESSAGE_KINDS:
+            before = counter.count
+            for sequence in range(samples):
+                await self.send_and_wait(clients, kind, sequence)
+            per_kind[kind] = (counter.count - before) / samples
+        for kind in self.latencies:
+            self.latencies[kind].clear()
+        return per_kind
+
+    async def run_async(self, application, fixtures):
+        report = {}
+        with QueryCounter() as counter:
+            started = time.perf_counter()
+            rooms = [
+                await self.connect_room(application, code, members)
+                for code, members in fixtures
+            ]
+            connect_seconds = time.perf_counter() - started
+            connections_opened = sum(len(clients) for clients in rooms)
+            report['connect'] = {
+                'connections': connections_opened,
+                'seconds': connect_seconds,
+                'queries_per_connect': counter.count / max(connections_opened, 1),
+            }
+
+            report['queries_per_message'] = await self.measure_queries(rooms[0], counter)
+
+            frames_before = sum(client.frames for clients in rooms for client in clients)
+            queries_before = counter.count
+            started = time.perf_counter()
+            await asyncio.gather(*(self.drive_room(clients) for clients in rooms))
+            elapsed = time.perf_counter() - started
+            frames = sum(client.frames for clients in rooms for client in clients) - frames_before
+            sent = sum(len(samples) for samples in self.latencies.values()) + self.timeouts
+
+            report['load'] = {
+                'messages': sent,
+                'seconds': elapsed,
+                'messages_per_second': sent / elapsed if elapsed else 0.0,
+                'frames_per_second': frames / elapsed if elapsed else 0.0,
+                'queries_per_message': (counter.count - queries_before) / max(sent, 1),
+                'timeouts': self.timeouts,
+            }
+            report['latency_ms'] = {
+                kind: summarize(samples) for kind, samples in self.latencies.items() if samples
+            }
+
+            for clients in rooms:
+                for client in clients:
+                    await client.close()
+        return report
+
+    def run(self):
+        """Run against the current database; callers provide a throwaway one."""
+        from musicroom.asgi import application
+
+        fixtures = self.create_fixtures()
+        return asyncio.run(self.run_async(application, fixtures))
+
+
+def format_report(report):
+    lines = []
+    connect = report['connect']
+    lines.append(
+        f"Connected {connect['connections']} clients in {connect['seconds']:.2f}s "
+        f"({connect['queries_per_connect']:.1f} queries/connect)"
+    )
+    lines.append('')
+    lines.append('Queries per message (sequential):')
+    for kind, queries in report['queries_per_message'].items():
+        lines.append(f'  {kind:<15} {queries:6.1f}')
+    load = report['load']
+    lines.append('')
+    lines.append(
+        f"Load: {load['messages']} messages in {load['seconds']:.2f}s -> "
+        f"{load['messages_per_second']:.0f} msg/s, {load['frames_per_second']:.0f} frames/s, "
+        f"{load['queries_per_message']:.2f} queries/msg, {load['timeouts']} timeouts"
+    )
+    lines.append('')
+    lines.append(f"{'type':<15} {'count':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for kind, stats in report['latency_ms'].items():
+        lines.append(
+            f"{kind:<15} {stats['count']:>6} {stats['p50']:>8.2f} {stats['p90']:>8.2f} "
+            f"{stats['p99']:>8.2f} {stats['max']:>8.2f}"
+        )
+    return '\n'.join(lines)
@@ -0,0 +1,126 @@
+# rooms/log.py
+"""
+Logging helpers for the WebSocket hot path.
+
+- `log_event` skips building the record entirely when the level is disabled.
+- `SamplingFilter` keeps 1 in N records of high-frequency events.
+- `QueueingStreamHandler` only enqueues records on the calling thread; a
+  background listener thread formats and writes them, so log I/O never
+  blocks the event loop.
+- `StructuredFormatter` writes one JSON object per line with secrets redacted.
+"""
+
+import json
+import logging
+import queue
+import re
+import sys
+from datetime import datetime, timezone as dt_timezone
+from logging.handlers import QueueHandler, QueueListener
+
+REDACTED = '[redacted]'
+SECRET_FIELDS = {'token', 'access', 'refresh', 'password', 'authorization', 'query_string'}
+SECRET_PATTERN = re.compile(r'((?:token|access|refresh|password)=)[^&\s\'"]+', re.IGNORECASE)
+JWT_PATTERN = re.compile(r'eyJ[\w-]+\.[\w-]+\.[\w-]+')
+
+
+def log_event(logger, level, event, message, *args, **fields):
+    """Log `message` (lazily %-formatted) tagged with an event name and structured fields."""
+    if logger.isEnabledFor(level):
+        logger.log(level, message, *args, extra={'event': event, 'fields': fields})
+
+
+def redact(text):
+    text = SECRET_PATTERN.sub(r'\1' + REDACTED, text)
+    return JWT_PATTERN.sub(REDACTED, text)
+
+
+def redact_fields(fields):
+    return {
+        key: REDACTED if key.lower() in SECRET_FIELDS else value
+        for key, value in fields.items()
+    }
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes only every Nth record of an event, per `rates` ({event: N}).
+    Warnings and errors are never sampled out.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = rates or {}
+        self.counts = {}
+
+    def filter(self, record):
+        rate = self.rates.get(getattr(record, 'event', None))
+        if not rate or rate <= 1 or record.levelno >= logging.WARNING:
+            return True
+        count = self.counts.get(record.event, 0)
+        self.counts[record.event] = count + 1
+        if count % rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, event, message and fields."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, tz=dt_timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': redact(record.getMessage()),
+        }
+        event = getattr(record, 'event', None)
+        if event:
+            entry['event'] = event
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(redact_fields(fields))
+        sample_rate = getattr(record, 'sample_rate', None)
+        if sample_rate:
+            entry['sample_rate'] = sample_rate
+        if record.exc_info:
+            entry['exc_info'] = redact(self.formatException(record.exc_info))
+        return json.dumps(entry, default=str)
+
+
+class QueueingStreamHandler(QueueHandler):
+    """
+    Hands records to a bounded queue drained by a QueueListener thread that
+    writes to `stream`. When the queue is full, records are dropped rather
+    than blocking the caller.
+    """
+
+    def __init__(self, stream=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.dropped = 0
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+        self.listening = True
+
+    def setFormatter(self, formatter):
+        # Formatting happens on the listener thread
+        self.target.setFormatter(formatter)
+
+    def prepare(self, record):
+        # Skip QueueHandler's eager formatting; the record's args are formatted later
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # Called by logging.shutdown() at exit: drain the queue before the process ends
+        if self.listening:
+            self.listening = False
+            self.listener.stop()
+        super().close()
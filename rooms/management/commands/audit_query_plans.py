@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_databases, teardown_databases
+
+from rooms.queryplan import audit
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN the rooms app's hot queries on a throwaway database built "
+        "from the migrations, and fail if any of them scans a whole table. "
+        "SQLite only, unless --current-db points it at a populated database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plans', action='store_true', help='Print every query plan')
+        parser.add_argument(
+            '--current-db', action='store_true',
+            help='Audit the configured database instead of a fresh test database'
+        )
+
+    def handle(self, *args, **options):
+        old_config = None
+        if not options['current_db'] and connection.vendor != 'sqlite':
+            # Other planners pick full scans on the empty tables of a fresh database
+            raise CommandError(
+                f'A fresh {connection.vendor} database says nothing about its plans; '
+                'run with --current-db against a populated, ANALYZEd database'
+            )
+        if not options['current_db']:
+            old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            results = audit()
+        finally:
+            if old_config is not None:
+                teardown_databases(old_config, verbosity=0)
+
+        failures = 0
+        for name, plan, scans in results:
+            if scans:
+                failures += 1
+                self.stdout.write(self.style.ERROR(f'FULL SCAN  {name}'))
+                for line in scans:
+                    self.stdout.write(f'    {line}')
+            else:
+                self.stdout.write(self.style.SUCCESS(f'ok         {name}'))
+            if options['plans']:
+                for line in plan.splitlines():
+                    self.stdout.write(f'    | {line}')
+
+        if failures:
+            raise CommandError(f'{failures} hot quer{"y" if failures == 1 else "ies"} fell back to a full table scan')
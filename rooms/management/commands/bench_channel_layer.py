@@ -0,0 +1,51 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rooms.layerbench import LayerBenchmark, build_layer, format_report
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure channel layer fan-out: group sends and deliveries per second for "
+        "the in-memory layer, Redis hosts, or fakeredis shards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--layer', choices=['memory', 'redis', 'fake'], default='fake',
+                            help='fake = in-process fakeredis servers standing in for Redis shards')
+        parser.add_argument('--hosts', default='redis://127.0.0.1:6379/0',
+                            help='Comma-separated Redis URLs, one per shard (--layer redis)')
+        parser.add_argument('--shards', type=int, default=1, help='fakeredis servers (--layer fake)')
+        parser.add_argument('--stock', action='store_true',
+                            help="Use channels_redis' RedisChannelLayer instead, as a baseline")
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--members', type=int, default=25, help='Channels per group')
+        parser.add_argument('--messages', type=int, default=50, help='Group sends per group')
+        parser.add_argument('--payload-size', type=int, default=200)
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        try:
+            layer = build_layer(
+                options['layer'],
+                hosts=options['hosts'].split(','),
+                shards=options['shards'],
+                capacity=max(1000, options['messages']),
+                stock=options['stock'],
+            )
+        except ImportError as exc:
+            raise CommandError(str(exc))
+
+        report = LayerBenchmark(
+            layer,
+            groups=options['groups'],
+            members=options['members'],
+            messages=options['messages'],
+            payload_size=options['payload_size'],
+        ).run()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.stdout.write(format_report(report))
@@ -0,0 +1,72 @@
+import json
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, teardown_databases
+
+from rooms.loadtest import (
+    DEFAULT_MIX, MESSAGE_KINDS, LoadTest, disable_rate_limits, format_report, use_in_memory_channel_layer,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test RoomConsumer in-process: N rooms x M participants over an "
+        "in-memory channel layer and a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=5)
+        parser.add_argument('--participants', type=int, default=10, help='Users per room, host included')
+        parser.add_argument('--messages', type=int, default=100, help='Messages sent per room')
+        parser.add_argument(
+            '--mix', default=','.join(f'{kind}={weight}' for kind, weight in DEFAULT_MIX.items()),
+            help='Weighted message mix, e.g. chat_message=5,sync_playback=3'
+        )
+        parser.add_argument('--timeout', type=float, default=5.0, help='Seconds to wait for each reply')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+        parser.add_argument('--rate-limits', action='store_true', help='Keep WS_RATE_LIMITS enabled')
+        parser.add_argument('--show-app-output', action='store_true', help="Don't silence the rooms logger")
+
+    def parse_mix(self, value):
+        mix = {}
+        for part in value.split(','):
+            kind, _, weight = part.partition('=')
+            if kind not in MESSAGE_KINDS:
+                raise CommandError(f'Unknown message type in --mix: {kind}')
+            mix[kind] = float(weight or 1)
+        return mix
+
+    def handle(self, *args, **options):
+        load_test = LoadTest(
+            rooms=options['rooms'],
+            participants=options['participants'],
+            messages=options['messages'],
+            mix=self.parse_mix(options['mix']),
+            timeout=options['timeout'],
+            seed=options['seed'],
+        )
+
+        use_in_memory_channel_layer()
+        if not options['rate_limits']:
+            disable_rate_limits()
+        # Consumers log every connect and disconnect; keep the report readable.
+        # Importing the ASGI application runs django.setup(), which re-applies
+        # LOGGING, so do it before changing the level.
+        import musicroom.asgi  # noqa: F401
+        app_logger = logging.getLogger('rooms')
+        app_log_level = app_logger.level
+        if not options['show_app_output']:
+            app_logger.setLevel(logging.CRITICAL + 1)
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            report = load_test.run()
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            app_logger.setLevel(app_log_level)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.stdout.write(format_report(report))
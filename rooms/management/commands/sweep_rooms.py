@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rooms.sweeper import sweep
+
+
+class Command(BaseCommand):
+    help = (
+        "End rooms with no WebSocket activity for ROOM_IDLE_TIMEOUT seconds and "
+        "deactivate participants unseen for PARTICIPANT_IDLE_TIMEOUT seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--room-idle', type=int, default=None,
+            help=f'Seconds without activity before a room ends (default {settings.ROOM_IDLE_TIMEOUT})'
+        )
+        parser.add_argument(
+            '--participant-idle', type=int, default=None,
+            help=f'Seconds unseen before a participant is deactivated (default {settings.PARTICIPANT_IDLE_TIMEOUT})'
+        )
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows per UPDATE')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would change')
+
+    def handle(self, *args, **options):
+        counts = sweep(
+            room_idle=options['room_idle'],
+            participant_idle=options['participant_idle'],
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+        )
+        verb = 'Would end' if options['dry_run'] else 'Ended'
+        self.stdout.write(
+            f"{verb} {counts['rooms']} idle rooms and deactivate{'' if options['dry_run'] else 'd'} "
+            f"{counts['participants']} stale participants"
+        )
@@ -0,0 +1,341 @@
+# rooms/metrics.py
+"""
+Low-overhead, Prometheus-style metrics for the WebSocket layer.
+
+Each worker process keeps its own registry and serves it on /metrics (see
+MetricsEndpoint), in the Prometheus text exposition format.
+"""
+
+import contextvars
+import functools
+import hmac
+from bisect import bisect_left
+from time import perf_counter
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _label_text(self, values, extra=None):
+        pairs = list(zip(self.labelnames, values))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        body = ','.join(f'{name}="{escape(value)}"' for name, value in pairs)
+        return '{' + body + '}'
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._sample_lines(values, child))
+        return lines
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(Metric):
+    kind = 'counter'
+    _new_child = _Value
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _sample_lines(self, values, child):
+        return [f'{self.name}{self._label_text(values)} {format_value(child.value)}']
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _sample_lines(self, values, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else format_value(bound)
+            lines.append(f'{self.name}_bucket{self._label_text(values, ("le", le))} {cumulative}')
+        lines.append(f'{self.name}_sum{self._label_text(values)} {format_value(child.sum)}')
+        lines.append(f'{self.name}_count{self._label_text(values)} {child.count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def expose(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+registry = Registry()
+
+# --- RoomConsumer metrics ---
+
+ws_connections = registry.gauge(
+    'musicroom_ws_connections', 'Open WebSocket connections in this worker.'
+)
+ws_connects = registry.counter(
+    'musicroom_ws_connects_total', 'WebSocket connection attempts by result.', ['result']
+)
+ws_disconnects = registry.counter(
+    'musicroom_ws_disconnects_total', 'WebSocket disconnects by close code.', ['code']
+)
+ws_messages = registry.counter(
+    'musicroom_ws_messages_total', 'Client messages received by type.', ['type']
+)
+ws_handler_seconds = registry.histogram(
+    'musicroom_ws_handler_seconds', 'Time spent handling a client message.', ['type']
+)
+ws_handler_db_seconds = registry.histogram(
+    'musicroom_ws_handler_db_seconds', 'Database time spent while handling a client message.', ['type']
+)
+group_send_fanout = registry.histogram(
+    'musicroom_group_send_fanout', 'Recipients per group_send.', ['event'], buckets=SIZE_BUCKETS
+)
+ws_rate_limited = registry.counter(
+    'musicroom_ws_rate_limited_total', 'Client messages rejected by a rate limit, by type and scope.',
+    ['type', 'scope']
+)
+ws_outbox_batch = registry.histogram(
+    'musicroom_ws_outbox_batch_frames', 'Frames per outbound WebSocket message.', buckets=SIZE_BUCKETS
+)
+ws_outbox_dropped = registry.counter(
+    'musicroom_ws_outbox_dropped_total',
+    'Outbound frames dropped: superseded syncs (stale) or queues of clients too slow to keep up (overflow).',
+    ['reason']
+)
+ws_outbox_depth = registry.histogram(
+    'musicroom_ws_outbox_depth', 'Frames already waiting in a connection\'s outbound queue when one is queued.',
+    buckets=SIZE_BUCKETS
+)
+channel_backlog = registry.histogram(
+    'musicroom_channel_backlog', 'Channel-layer messages waiting for a consumer when it dispatches one.',
+    buckets=SIZE_BUCKETS
+)
+
+# Client message types are user input; anything else is counted as "unknown"
+# to keep label cardinality bounded.
+KNOWN_MESSAGE_TYPES = {
+    'ping', 'chat_message', 'toggle_playback', 'next_song', 'previous_song',
+    'add_song', 'sync_playback',
+}
+
+# Close codes are partly client-chosen; others are counted as "other"
+KNOWN_CLOSE_CODES = {1000, 1001, 1005, 1006, 1011, 1012, 4001, 4003, 4004, 4008}
+
+
+def message_type_label(message_type):
+    if isinstance(message_type, str) and message_type in KNOWN_MESSAGE_TYPES:
+        return message_type
+    return 'unknown'
+
+
+def close_code_label(code):
+    return code if code in KNOWN_CLOSE_CODES else 'other'
+
+
+# --- Database time accounting ---
+
+_db_time = contextvars.ContextVar('musicroom_db_time', default=None)
+
+
+class track_db_time:
+    """Context manager that collects DB time spent by `timed_database_sync_to_async` calls."""
+
+    def __enter__(self):
+        self.total = [0.0]
+        self._token = _db_time.set(self.total)
+        return self
+
+    def __exit__(self, *exc_info):
+        _db_time.reset(self._token)
+
+    @property
+    def seconds(self):
+        return self.total[0]
+
+
+def timed_database_sync_to_async(func):
+    """database_sync_to_async that also adds the call's duration to the current handler's DB time."""
+    wrapped = database_sync_to_async(func)
+
+    @functools.wraps(func)
+    async def inner(*args, **kwargs):
+        started = perf_counter()
+        try:
+            return await wrapped(*args, **kwargs)
+        finally:
+            total = _db_time.get()
+            if total is not None:
+                total[0] += perf_counter() - started
+
+    return inner
+
+
+def observe_group_send(channel_layer, group, event_type):
+    """
+    Record the recipients of a group_send. ShardedRedisChannelLayer records
+    its own, as it fetches the member list anyway; the in-memory layer
+    exposes its groups. Other layers aren't measured.
+    """
+    if getattr(channel_layer, 'records_fanout', False):
+        return
+    groups = getattr(channel_layer, 'groups', None)
+    if isinstance(groups, dict):
+        group_send_fanout.labels(event_type).observe(len(groups.get(group, ())))
+
+
+def channel_queue_depth(channel_layer, channel):
+    """
+    Messages waiting on a channel in this process: the in-memory layer's
+    queue, or the receive buffer channels_redis fills for process-local
+    channels. None for layers exposing neither.
+    """
+    for attribute in ('channels', 'receive_buffer'):
+        queues = getattr(channel_layer, attribute, None)
+        if isinstance(queues, dict):
+            # .get(): receive_buffer is a defaultdict
+            queue = queues.get(channel)
+            return queue.qsize() if queue is not None else 0
+    return None
+
+
+# --- HTTP exposition ---
+
+class MetricsEndpoint:
+    """
+    ASGI wrapper that serves the registry on `path` and passes everything
+    else to `app`. Only clients in METRICS_ALLOWED_IPS, or requests carrying
+    METRICS_TOKEN as a bearer token, are answered; others get a 403.
+    """
+
+    def __init__(self, app, path='/metrics'):
+        self.app = app
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != self.path:
+            return await self.app(scope, receive, send)
+        if self.allowed(scope):
+            await self.respond(send, 200, registry.expose().encode())
+        else:
+            await self.respond(send, 403, b'Forbidden\n')
+
+    def allowed(self, scope):
+        client = scope.get('client')
+        if client and client[0] in getattr(settings, 'METRICS_ALLOWED_IPS', ()):
+            return True
+        token = getattr(settings, 'METRICS_TOKEN', None)
+        if not token:
+            return False
+        headers = dict(scope.get('headers', ()))
+        return hmac.compare_digest(headers.get(b'authorization', b''), f'Bearer {token}'.encode())
+
+    async def respond(self, send, status, body):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'text/plain; version=0.0.4; charset=utf-8'),
+                (b'content-length', str(len(body)).encode()),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
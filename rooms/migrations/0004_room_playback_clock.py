@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0003_room_current_artist_room_current_duration_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='current_song_url',
+            field=models.URLField(blank=True, max_length=500, null=True),
+        ),
+        migrations.AlterField(
+            model_name='room',
+            name='current_position',
+            field=models.FloatField(default=0),
+        ),
+    ]
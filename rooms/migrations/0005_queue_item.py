@@ -0,0 +1,84 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+POSITION_STEP = 1024
+
+
+def copy_queue_data(apps, schema_editor):
+    """Move each room's JSON queue into QueueItem rows, keeping the order."""
+    Room = apps.get_model('rooms', 'Room')
+    QueueItem = apps.get_model('rooms', 'QueueItem')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    user_ids = set(User.objects.values_list('id', flat=True))
+
+    items = []
+    for room in Room.objects.exclude(queue_data=[]).only('id', 'queue_data'):
+        for index, song in enumerate(room.queue_data or [], start=1):
+            if not song.get('title') or not song.get('url'):
+                continue
+            items.append(QueueItem(
+                room_id=room.id,
+                position=index * POSITION_STEP,
+                title=song['title'][:200],
+                artist=(song.get('artist') or '')[:200],
+                url=song['url'][:500],
+                added_by_id=song.get('added_by') if song.get('added_by') in user_ids else None,
+            ))
+    QueueItem.objects.bulk_create(items, batch_size=500)
+
+
+def copy_queue_items(apps, schema_editor):
+    """Rebuild the JSON queues from QueueItem rows."""
+    Room = apps.get_model('rooms', 'Room')
+    QueueItem = apps.get_model('rooms', 'QueueItem')
+
+    queues = {}
+    for item in QueueItem.objects.order_by('room_id', 'position'):
+        queues.setdefault(item.room_id, []).append({
+            'title': item.title,
+            'artist': item.artist,
+            'url': item.url,
+            'added_by': item.added_by_id,
+            'added_at': str(item.added_at),
+        })
+    for room_id, queue_data in queues.items():
+        Room.objects.filter(pk=room_id).update(queue_data=queue_data)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('rooms', '0004_room_playback_clock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.BigIntegerField()),
+                ('title', models.CharField(max_length=200)),
+                ('artist', models.CharField(blank=True, max_length=200)),
+                ('url', models.URLField(max_length=500)),
+                ('added_at', models.DateTimeField(auto_now_add=True)),
+                ('added_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='queue_items', to='rooms.room')),
+            ],
+            options={
+                'ordering': ['room', 'position'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='queueitem',
+            constraint=models.UniqueConstraint(fields=('room', 'position'), name='unique_queue_position'),
+        ),
+        migrations.RunPython(copy_queue_data, copy_queue_items),
+        migrations.RemoveField(
+            model_name='room',
+            name='queue_data',
+        ),
+    ]
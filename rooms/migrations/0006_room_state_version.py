@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0005_queue_item'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='state_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0006_room_state_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['host', 'status'], name='room_host_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['-created_at', '-id'], name='room_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='roomparticipant',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['room', 'joined_at'], name='participant_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='roomparticipant',
+            index=models.Index(fields=['user', 'room'], name='participant_user_room_idx'),
+        ),
+    ]
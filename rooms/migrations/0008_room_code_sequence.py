@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:08
+
+from django.db import migrations, models
+
+
+def create_room_code_sequence(apps, schema_editor):
+    RoomCodeSequence = apps.get_model('rooms', 'RoomCodeSequence')
+    RoomCodeSequence.objects.get_or_create(name='room_code')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0007_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomCodeSequence',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_room_code_sequence, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:10
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def backfill_activity(apps, schema_editor):
+    """Best known activity for existing rows: the room's last update, the participant's join."""
+    Room = apps.get_model('rooms', 'Room')
+    RoomParticipant = apps.get_model('rooms', 'RoomParticipant')
+    Room.objects.update(last_activity_at=models.F('updated_at'))
+    RoomParticipant.objects.update(last_seen_at=models.F('joined_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0008_room_code_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='roomparticipant',
+            name='last_seen_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_activity, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['status', 'last_activity_at'], name='room_status_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='roomparticipant',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['last_seen_at'], name='participant_last_seen_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0010_chat_message'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='room',
+            name='room_created_idx',
+        ),
+    ]
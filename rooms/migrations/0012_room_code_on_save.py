@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0011_drop_room_created_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='room',
+            name='code',
+            field=models.CharField(blank=True, max_length=6, unique=True),
+        ),
+    ]
@@ -1,18 +1,102 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 import uuid
-import string
-import random
+
+from .codes import code_for
+from .presence import get_presence
 
 User = get_user_model()
 
+class RoomQuerySet(models.QuerySet):
+    def update_playback(self, room_id, expected_version, **fields):
+        """
+        Write only the given playback columns, and only if the row is still at
+        `expected_version`. Returns False when another writer got there first.
+        """
+        return self.filter(pk=room_id, state_version=expected_version).update(
+            state_version=models.F('state_version') + 1, **fields
+        ) == 1
+
+    def with_details(self, user=None):
+        """
+        Everything RoomSerializer reads from the database, in a fixed number
+        of queries: the host, the active participants with their users, and
+        whether `user` belongs to each room. Online counts come from
+        presence (see attach_online_counts).
+        """
+        queryset = self.select_related('host').prefetch_related(
+            models.Prefetch(
+                'roomparticipant_set',
+                queryset=RoomParticipant.objects.filter(is_active=True).select_related('user'),
+                to_attr='active_participants',
+            )
+        )
+        if user is not None and user.is_authenticated:
+            queryset = queryset.annotate(
+                is_member=models.Exists(
+                    RoomParticipant.objects.filter(room=models.OuterRef('pk'), user=user)
+                )
+            )
+        return queryset
+
+    def summaries(self, user):
+        """
+        Compact room-list rows as dicts (no model instances): code, name,
+        status and what is playing. Add online counts with attach_online_counts.
+        """
+        return self.annotate(
+            is_user_host=models.ExpressionWrapper(
+                models.Q(host=user), output_field=models.BooleanField()
+            ),
+        ).values(
+            'id', 'code', 'name', 'status', 'created_at', 'max_participants',
+            'is_user_host',
+            'current_song', 'current_artist', 'is_playing',
+        )
+
+    def for_user(self, user):
+        """Rooms the user hosts or has joined."""
+        return self.filter(
+            models.Q(host=user)
+            | models.Q(pk__in=RoomParticipant.objects.filter(user=user).values('room_id'))
+        )
+
+class RoomCodeSequence(models.Model):
+    """
+    Counter behind room codes (see rooms.codes). Incrementing it with an
+    UPDATE serializes concurrent allocations across workers.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    ROOM_CODES = 'room_code'
+
+    @classmethod
+    def next_value(cls, name=ROOM_CODES):
+        with transaction.atomic():
+            if not cls.objects.filter(pk=name).update(value=models.F('value') + 1):
+                cls.objects.get_or_create(pk=name)
+                cls.objects.filter(pk=name).update(value=models.F('value') + 1)
+            return cls.objects.values_list('value', flat=True).get(pk=name)
+
+def attach_online_counts(rooms):
+    """
+    Fill in the online counts of a page of rooms with one presence read:
+    `participant_count` of summaries() rows, or Room.participant_count.
+    """
+    codes = [room['code'] if isinstance(room, dict) else room.code for room in rooms]
+    counts = get_presence().online_counts(codes)
+    for room in rooms:
+        if isinstance(room, dict):
+            room['participant_count'] = counts[room['code']]
+        else:
+            room.online_count = counts[room.code]
+    return rooms
+
 def generate_room_code():
-    """Generate a unique 6-character room code"""
-    length = 6
-    while True:
-        code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
-        if not Room.objects.filter(code=code).exists():
-            return code
+    """Allocate the next unique 6-character room code"""
+    return code_for(RoomCodeSequence.next_value())
 
 class Room(models.Model):
     ROOM_STATUS_CHOICES = [
@@ -23,7 +107,7 @@ class Room(models.Model):
     
     # Basic room info
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    code = models.CharField(max_length=6, unique=True, default=generate_room_code)
+    code = models.CharField(max_length=6, unique=True, blank=True)  # allocated on first save
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True, null=True)
     
@@ -40,37 +124,72 @@ class Room(models.Model):
     status = models.CharField(max_length=20, choices=ROOM_STATUS_CHOICES, default='active')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    last_activity_at = models.DateTimeField(default=timezone.now)  # last WebSocket activity, see rooms.sweeper
     
     # Current playback state (we'll expand this later)
     current_song = models.CharField(max_length=200, blank=True, null=True)
     is_playing = models.BooleanField(default=False)
-    current_position = models.IntegerField(default=0)  # in seconds
+    current_position = models.FloatField(default=0)  # in seconds, at playback_started_at
     # Add these fields to your existing Room model
     current_artist = models.CharField(max_length=200, blank=True, null=True)
+    current_song_url = models.URLField(max_length=500, blank=True, null=True)
     current_duration = models.IntegerField(default=0)  # song duration in seconds
-    playback_started_at = models.DateTimeField(blank=True, null=True)  # when current song started
-    queue_data = models.JSONField(default=list)  # simple queue for now
+    playback_started_at = models.DateTimeField(blank=True, null=True)  # playback clock anchor
+    state_version = models.PositiveIntegerField(default=0)  # bumped on every playback write
+    
+    objects = RoomQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # A host's rooms by status, e.g. their active rooms
+            models.Index(fields=['host', 'status'], name='room_host_status_idx'),
+            # Idle active rooms (rooms.sweeper)
+            models.Index(fields=['status', 'last_activity_at'], name='room_status_activity_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} ({self.code})"
     
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        if not self.code:
+            self.code = generate_room_code()
+        try:
+            with transaction.atomic():
+                return super().save(*args, **kwargs)
+        except IntegrityError:
+            # Allocated codes never repeat, but one can still match a code
+            # created before the allocator existed: take the next one.
+            if not Room.objects.filter(code=self.code).exists():
+                raise
+            self.code = generate_room_code()
+            return super().save(*args, **kwargs)
+    
     @property
     def participant_count(self):
-        """A convenient way to get the number of *active* participants."""
-        # This now filters the intermediate RoomParticipant table to only
-        # count users where the 'is_active' flag on that table is True.
-        return self.participants.filter(roomparticipant__is_active=True).count()
+        """The number of users connected to the room right now (rooms.presence), for display."""
+        # Rooms passed through attach_online_counts() carry the count already
+        if not hasattr(self, 'online_count'):
+            self.online_count = get_presence().online_counts([self.code])[self.code]
+        return self.online_count
     
     def is_host(self, user):
-        return self.host == user
+        return self.host_id == user.pk
+    
+    def member_count(self, exclude_user=None):
+        """The number of active participants, i.e. the places taken in the room."""
+        members = self.roomparticipant_set.filter(is_active=True)
+        if exclude_user is not None:
+            members = members.exclude(user_id=exclude_user.pk)
+        return members.count()
     
     def can_join(self, user=None):
         if self.status != 'active':
             return False
-        if self.participant_count >= self.max_participants:
+        # Members hold their place while offline; `user` is not competing for one of their own
+        if self.member_count(exclude_user=user) >= self.max_participants:
             return False
         return True
 
@@ -85,9 +204,118 @@ class RoomParticipant(models.Model):
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='guest')
     joined_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)  # Still in the room?
+    last_seen_at = models.DateTimeField(default=timezone.now)  # last join or WebSocket activity, see rooms.sweeper
     
     class Meta:
         unique_together = ['room', 'user']
+        indexes = [
+            # Active participants of a room, in join order (counts, rosters, snapshots)
+            models.Index(
+                fields=['room', 'joined_at'], condition=models.Q(is_active=True),
+                name='participant_active_idx',
+            ),
+            # A user's rooms (RoomQuerySet.for_user) without touching the table
+            models.Index(fields=['user', 'room'], name='participant_user_room_idx'),
+            # Stale active participants (rooms.sweeper)
+            models.Index(
+                fields=['last_seen_at'], condition=models.Q(is_active=True),
+                name='participant_last_seen_idx',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.name} in {self.room.name} ({self.role})"
+
+class QueueItemManager(models.Manager):
+    # Gap between neighbouring positions, leaving room to place a track
+    # between two others without rewriting the rest of the queue.
+    POSITION_STEP = 1024
+
+    def head(self, room_id):
+        """The next track to play, read through the (room, position) index."""
+        return self.filter(room_id=room_id).order_by('position').first()
+
+    def enqueue(self, room_id, attempts=3, **fields):
+        """Append a track to the end of the room's queue."""
+        for attempt in range(attempts):
+            try:
+                with transaction.atomic():
+                    # Serialize appends to the same room where the database supports row locks
+                    list(Room.objects.select_for_update().filter(pk=room_id).values_list('pk'))
+                    last = self.filter(room_id=room_id).order_by('-position').values_list(
+                        'position', flat=True
+                    ).first()
+                    position = (last or 0) + self.POSITION_STEP
+                    return self.create(room_id=room_id, position=position, **fields)
+            except IntegrityError:
+                # Another worker took the same position; read the tail again
+                if attempt == attempts - 1:
+                    raise
+
+    def dequeue(self, room_id):
+        """Remove and return the head of the room's queue, or None if it is empty."""
+        while True:
+            item = self.head(room_id)
+            if item is None:
+                return None
+            # Conditional delete: only one worker can claim a given head
+            deleted, _ = self.filter(pk=item.pk).delete()
+            if deleted:
+                return item
+
+class QueueItem(models.Model):
+    """A track waiting in a room's queue, ordered by position."""
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='queue_items')
+    position = models.BigIntegerField()
+    title = models.CharField(max_length=200)
+    artist = models.CharField(max_length=200, blank=True)
+    url = models.URLField(max_length=500)
+    added_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    added_at = models.DateTimeField(auto_now_add=True)
+    
+    objects = QueueItemManager()
+    
+    class Meta:
+        ordering = ['room', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'position'], name='unique_queue_position'),
+        ]
     
     def __str__(self):
-        return f"{self.user.name} in {self.room.name} ({self.role})"
\ No newline at end of file
+        return f"{self.title} in {self.room.code} (#{self.position})"
+    
+    def to_dict(self):
+        return {
+            'title': self.title,
+            'artist': self.artist,
+            'url': self.url,
+            'added_by': self.added_by_id,
+        }
+
+class ChatMessage(models.Model):
+    """A chat line. Written in batches by rooms.chat.ChatWriter."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='chat_messages')
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    name = models.CharField(max_length=100)  # sender's display name when sent
+    message = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['room', 'created_at']
+        indexes = [
+            # Latest messages of a room (history replay)
+            models.Index(fields=['room', '-created_at'], name='chat_room_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} in {self.room_id}: {self.message[:50]}"
+    
+    def to_dict(self):
+        return {
+            'id': self.id.hex,
+            'user_id': self.user_id,
+            'name': self.name,
+            'message': self.message,
+            'created_at': self.created_at.timestamp() * 1000,
+        }
@@ -0,0 +1,165 @@
+# rooms/outbox.py
+"""
+Outbound frame queue of one WebSocket connection.
+
+RoomConsumer puts frames here instead of awaiting the client, and a
+writer task sends them. Because handlers never wait on the client, the
+consumer keeps draining its channel-layer queue even while the client is
+slow, so one slow peer doesn't trip channel capacity for the room.
+
+Text frames queued in the same event-loop tick (a chat burst, a join
+storm) go out together as one JSON array frame when `batching` is on;
+clients opt in by negotiating a subprotocol (see rooms.wire). Binary
+frames are always sent on their own.
+
+State frames (STATE_KINDS) are snapshots, so only the latest matters: a
+new one replaces its pending predecessor instead of queueing behind it.
+Everything else (chat, roster deltas) keeps its order. Past
+WS_OUTBOX_MAX_FRAMES pending frames the client is too far behind to
+catch up and the connection is closed.
+
+Frames only pile up here if `send` waits for the client. uvicorn's does;
+under daphne, rooms.backpressure makes it wait for the transport's write
+buffer to drain.
+"""
+
+import asyncio
+import logging
+from collections import deque
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Frame kinds where a newer frame supersedes a pending one ("latest wins")
+STATE_KINDS = {'playback_synced', 'playback_changed', 'playback_anchor'}
+
+
+class Outbox:
+    def __init__(self, send, close, batching=False, max_frames=None, max_batch=None, drain_timeout=None):
+        """
+        `send(text_data=..., bytes_data=...)` writes one frame to the client;
+        `close()` is scheduled when the client falls too far behind.
+        """
+        self.send = send
+        self.close = close
+        self.batching = batching
+        self.max_frames = max_frames or getattr(settings, 'WS_OUTBOX_MAX_FRAMES', 256)
+        self.max_batch = max_batch or getattr(settings, 'WS_OUTBOX_BATCH_SIZE', 50)
+        self.drain_timeout = drain_timeout or getattr(settings, 'WS_OUTBOX_DRAIN_TIMEOUT', 5)
+        self.closed = False
+        # Entries are [kind, text, data]; a superseded entry is blanked in
+        # place and skipped by the writer, so replacing one is O(1).
+        self._queue = deque()
+        self._latest = {}
+        self._pending = 0
+        self._writer = None
+
+    def __len__(self):
+        return self._pending
+
+    def put(self, kind, text=None, data=None):
+        """Queue a text or binary frame of type `kind` (may be None)."""
+        if self.closed:
+            return
+        if kind in STATE_KINDS:
+            self._supersede(kind)
+        if self._pending >= self.max_frames:
+            metrics.ws_outbox_dropped.labels('overflow').inc(self._pending)
+            # The writer is stuck on this client; don't let close() wait for it
+            self.discard()
+            asyncio.ensure_future(self.close())
+            return
+        metrics.ws_outbox_depth.observe(self._pending)
+        entry = [kind, text, data]
+        self._queue.append(entry)
+        self._pending += 1
+        if kind in STATE_KINDS:
+            self._latest[kind] = entry
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.ensure_future(self._write())
+
+    def _supersede(self, kind):
+        entry = self._latest.pop(kind, None)
+        if entry is None:
+            return
+        entry[:] = [None, None, None]
+        self._pending -= 1
+        metrics.ws_outbox_dropped.labels('stale').inc()
+        # Compact once blanked entries outnumber live ones
+        if len(self._queue) > 2 * self._pending + 16:
+            self._queue = deque(
+                entry for entry in self._queue if entry[1] is not None or entry[2] is not None
+            )
+
+    def _popleft(self):
+        """Pop the next live entry, skipping superseded ones; None if the queue is empty."""
+        while self._queue:
+            entry = self._queue.popleft()
+            if entry[1] is None and entry[2] is None:
+                continue
+            self._pending -= 1
+            if self._latest.get(entry[0]) is entry:
+                del self._latest[entry[0]]
+            return entry
+        return None
+
+    def _peek_text(self):
+        """The next live entry's text (None for binary frames), dropping superseded entries on the way."""
+        while self._queue:
+            entry = self._queue[0]
+            if entry[1] is None and entry[2] is None:
+                self._queue.popleft()
+                continue
+            return entry[1]
+        return None
+
+    async def _write(self):
+        try:
+            while self._pending and not self.closed:
+                texts = self._take_texts(self.max_batch if self.batching else 1)
+                if not texts:
+                    _, _, data = self._popleft()
+                    await self.send(bytes_data=data)
+                    continue
+                metrics.ws_outbox_batch.observe(len(texts))
+                if len(texts) == 1:
+                    await self.send(text_data=texts[0])
+                else:
+                    await self.send(text_data='[' + ','.join(texts) + ']')
+        except Exception:
+            # The client went away mid-send; disconnect() cleans up
+            logger.debug("Outbox writer stopped", exc_info=True)
+            self.closed = True
+            self._clear()
+
+    def _take_texts(self, limit):
+        """Pop up to `limit` text frames from the head of the queue."""
+        texts = []
+        while len(texts) < limit and self._peek_text() is not None:
+            texts.append(self._popleft()[1])
+        return texts
+
+    def _clear(self):
+        self._queue.clear()
+        self._latest.clear()
+        self._pending = 0
+
+    async def drain(self):
+        """Wait until everything queued so far has been sent, or drain_timeout seconds."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.drain_timeout
+        while self._writer is not None and not self._writer.done():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            await asyncio.wait([self._writer], timeout=remaining)
+
+    def discard(self):
+        """Drop queued frames and stop the writer (the connection is gone)."""
+        self.closed = True
+        self._clear()
+        if self._writer is not None and not self._writer.done():
+            self._writer.cancel()
@@ -0,0 +1,16 @@
+# rooms/pagination.py
+
+from rest_framework.pagination import CursorPagination
+
+
+class RoomCursorPagination(CursorPagination):
+    """
+    Newest rooms first. The cursor encodes a created_at position, so pages
+    stay stable while rooms are created and cost the same however deep
+    the client pages.
+    """
+
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
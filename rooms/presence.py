@@ -0,0 +1,276 @@
+# rooms/presence.py
+"""
+Who is connected to each room, keyed by WebSocket channel name.
+
+RoomConsumer adds its channel on connect, refreshes it on every client
+`ping` (the clock-sync heartbeat) and removes it on disconnect. Entries
+expire `ttl` seconds after the last heartbeat, so a worker that dies
+without running disconnect() doesn't leave ghosts behind; the pings of
+the room's other clients sweep them out (`expire`) and announce them as
+left. Rosters and online counts are read from here instead of
+RoomParticipant rows; room capacity still counts active participants.
+
+Configured like CHANNEL_LAYERS:
+
+    ROOM_PRESENCE = {
+        'BACKEND': 'rooms.presence.RedisPresence',
+        'CONFIG': {'url': 'redis://127.0.0.1:6379/0', 'ttl': 90},
+    }
+
+InMemoryPresence only sees this process' connections, like
+InMemoryChannelLayer; use RedisPresence with several workers.
+"""
+
+import json
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+class BasePresence:
+    def __init__(self, ttl=90):
+        self.ttl = ttl
+
+    async def add(self, code, channel, member):
+        raise NotImplementedError
+
+    async def touch(self, code, channel):
+        """Refresh a channel's expiry; returns False if it was already expired and swept out."""
+        raise NotImplementedError
+
+    async def remove(self, code, channel):
+        """Remove a channel, returning its member dict (None if it was not present)."""
+        raise NotImplementedError
+
+    async def remove_expired(self, code):
+        """Remove the channels whose heartbeat lapsed, returning their member dicts."""
+        raise NotImplementedError
+
+    async def members(self, code):
+        """{channel: member} for the live channels of a room."""
+        raise NotImplementedError
+
+    def online_counts(self, codes):
+        """{code: number of online users} for several rooms. Synchronous, for REST views."""
+        raise NotImplementedError
+
+    async def join(self, code, channel, member):
+        """Add a channel; returns True if it is the member's first live channel in the room."""
+        others = await self.members(code)
+        await self.add(code, channel, member)
+        return not any(other['user_id'] == member['user_id'] for other in others.values())
+
+    async def leave(self, code, channel):
+        """Remove a channel; returns its member if that was their last live channel, else None."""
+        member = await self.remove(code, channel)
+        if member is None:
+            return None
+        remaining = await self.members(code)
+        if any(other['user_id'] == member['user_id'] for other in remaining.values()):
+            return None
+        return member
+
+    async def expire(self, code):
+        """Sweep out lapsed channels; returns the members left without a live channel."""
+        expired = await self.remove_expired(code)
+        if not expired:
+            return []
+        online = {member['user_id'] for member in (await self.members(code)).values()}
+        gone = {}
+        for member in expired:
+            if member['user_id'] not in online:
+                gone.setdefault(member['user_id'], member)
+        return list(gone.values())
+
+    async def roster(self, code):
+        """Online members of a room, one entry per user (a user may have several tabs open)."""
+        users = {}
+        for member in (await self.members(code)).values():
+            users.setdefault(member['user_id'], member)
+        return list(users.values())
+
+
+class InMemoryPresence(BasePresence):
+    def __init__(self, ttl=90, clock=time.monotonic):
+        super().__init__(ttl)
+        self.clock = clock
+        self._rooms = {}
+
+    async def add(self, code, channel, member):
+        self._rooms.setdefault(code, {})[channel] = (dict(member), self.clock() + self.ttl)
+
+    async def touch(self, code, channel):
+        entry = self._rooms.get(code, {}).get(channel)
+        if entry is None:
+            return False
+        self._rooms[code][channel] = (entry[0], self.clock() + self.ttl)
+        return True
+
+    async def remove(self, code, channel):
+        channels = self._rooms.get(code)
+        if not channels:
+            return None
+        entry = channels.pop(channel, None)
+        if not channels:
+            del self._rooms[code]
+        return entry[0] if entry else None
+
+    async def remove_expired(self, code):
+        channels = self._rooms.get(code)
+        if not channels:
+            return []
+        now = self.clock()
+        expired = [channel for channel, (_, expires_at) in channels.items() if expires_at <= now]
+        members = [channels.pop(channel)[0] for channel in expired]
+        if not channels:
+            del self._rooms[code]
+        return members
+
+    async def members(self, code):
+        return self._live(code)
+
+    def _live(self, code):
+        now = self.clock()
+        # list(): REST views read this from another thread
+        entries = list(self._rooms.get(code, {}).items())
+        return {channel: member for channel, (member, expires_at) in entries if expires_at > now}
+
+    def online_counts(self, codes):
+        return {
+            code: len({member['user_id'] for member in self._live(code).values()})
+            for code in codes
+        }
+
+
+class RedisPresence(BasePresence):
+    """
+    Per room: a sorted set of channel names scored by expiry time, and a hash
+    of channel name -> member JSON. Both keys expire when a room goes quiet.
+    """
+
+    def __init__(self, url='redis://127.0.0.1:6379/0', ttl=90, prefix='presence'):
+        super().__init__(ttl)
+        self.url = url
+        self.prefix = prefix
+        self._client = None
+        self._sync_client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis.asyncio
+
+            self._client = redis.asyncio.from_url(self.url)
+        return self._client
+
+    @property
+    def sync_client(self):
+        if self._sync_client is None:
+            import redis
+
+            self._sync_client = redis.Redis.from_url(self.url)
+        return self._sync_client
+
+    def _keys(self, code):
+        return f'{self.prefix}:{code}:expiry', f'{self.prefix}:{code}:members'
+
+    async def add(self, code, channel, member):
+        expiry_key, members_key = self._keys(code)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.zadd(expiry_key, {channel: time.time() + self.ttl})
+            pipe.hset(members_key, channel, json.dumps(member))
+            pipe.expire(expiry_key, self.ttl * 2)
+            pipe.expire(members_key, self.ttl * 2)
+            await pipe.execute()
+
+    async def touch(self, code, channel):
+        expiry_key, members_key = self._keys(code)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.zadd(expiry_key, {channel: time.time() + self.ttl}, xx=True, ch=True)
+            pipe.expire(expiry_key, self.ttl * 2)
+            pipe.expire(members_key, self.ttl * 2)
+            updated, _, _ = await pipe.execute()
+        return bool(updated)
+
+    async def remove(self, code, channel):
+        expiry_key, members_key = self._keys(code)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hget(members_key, channel)
+            pipe.zrem(expiry_key, channel)
+            pipe.hdel(members_key, channel)
+            member, _, _ = await pipe.execute()
+        return json.loads(member) if member else None
+
+    async def remove_expired(self, code):
+        expiry_key, members_key = self._keys(code)
+        expired = await self.client.zrangebyscore(expiry_key, 0, time.time())
+        if not expired:
+            return []
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hmget(members_key, expired)
+            for channel in expired:
+                pipe.zrem(expiry_key, channel)
+            pipe.hdel(members_key, *expired)
+            values, *removed, _ = await pipe.execute()
+        # Only report the channels this call removed: other workers sweep too
+        return [
+            json.loads(value)
+            for value, was_removed in zip(values, removed)
+            if value is not None and was_removed
+        ]
+
+    async def members(self, code):
+        expiry_key, members_key = self._keys(code)
+        live = await self.client.zrangebyscore(expiry_key, time.time(), '+inf')
+        if not live:
+            return {}
+        values = await self.client.hmget(members_key, live)
+        return {
+            channel.decode(): json.loads(value)
+            for channel, value in zip(live, values)
+            if value is not None
+        }
+
+    def online_counts(self, codes):
+        now = time.time()
+        with self.sync_client.pipeline(transaction=False) as pipe:
+            for code in codes:
+                pipe.zrangebyscore(self._keys(code)[0], now, '+inf')
+            live = dict(zip(codes, pipe.execute()))
+        counts = dict.fromkeys(codes, 0)
+        occupied = [code for code in codes if live[code]]
+        if occupied:
+            with self.sync_client.pipeline(transaction=False) as pipe:
+                for code in occupied:
+                    pipe.hmget(self._keys(code)[1], live[code])
+                for code, values in zip(occupied, pipe.execute()):
+                    counts[code] = len({json.loads(value)['user_id'] for value in values if value is not None})
+        return counts
+
+
+_presence = None
+
+
+def get_presence():
+    """The configured presence backend (a per-process singleton)."""
+    global _presence
+    if _presence is None:
+        config = getattr(settings, 'ROOM_PRESENCE', {})
+        backend = import_string(config.get('BACKEND', 'rooms.presence.InMemoryPresence'))
+        _presence = backend(**config.get('CONFIG', {}))
+    return _presence
+
+
+def reset_presence():
+    """Drop the backend, so the next get_presence() reads ROOM_PRESENCE again."""
+    global _presence
+    _presence = None
+
+
+@receiver(setting_changed)
+def _presence_setting_changed(setting, **kwargs):
+    if setting == 'ROOM_PRESENCE':
+        reset_presence()
@@ -0,0 +1,78 @@
+# rooms/queryplan.py
+"""
+Query plan audit for the hot lookups of the rooms app.
+
+Each entry in HOT_QUERIES builds the queryset a request path or consumer
+runs. `audit()` EXPLAINs them on the current database and reports any
+that read a whole table instead of searching an index. Placeholder ids are
+used: SQLite's plan depends on the indexes, not on matching rows.
+
+PostgreSQL's planner does depend on the rows: on small or empty tables it
+prefers a Seq Scan even where an index fits, so only audit PostgreSQL on a
+populated database that has been ANALYZEd.
+"""
+
+import re
+import uuid
+from datetime import datetime, timezone as dt_timezone
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+
+from .models import QueueItem, Room, RoomParticipant
+from .sweeper import idle_rooms, stale_participants
+
+User = get_user_model()
+
+SAMPLE_ROOM_ID = uuid.UUID(int=0)
+SAMPLE_USER = User(pk=1)
+SAMPLE_TIME = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+
+HOT_QUERIES = {
+    'room by code (load_room_state)': lambda: Room.objects.filter(code='AAAAAA', status='active'),
+    'participant role (RoomConsumer.connect)': lambda: RoomParticipant.objects.filter(
+        room_id=SAMPLE_ROOM_ID, user_id=SAMPLE_USER.pk
+    ).values_list('role', flat=True),
+    'active participants (snapshots, with_details)': lambda: RoomParticipant.objects.filter(
+        room_id=SAMPLE_ROOM_ID, is_active=True
+    ).order_by('joined_at'),
+    'rooms by host and status': lambda: Room.objects.filter(host=SAMPLE_USER, status='active'),
+    # Ordered like RoomCursorPagination. The user's rooms come from the
+    # host and participant indexes, then only those rows are sorted.
+    'room list page (RoomListCreateView)': lambda: Room.objects.for_user(SAMPLE_USER).summaries(
+        SAMPLE_USER
+    ).order_by('-created_at', '-id')[:20],
+    'room list details (?view=full)': lambda: Room.objects.for_user(SAMPLE_USER).with_details(
+        SAMPLE_USER
+    ).order_by('-created_at', '-id')[:20],
+    'queue head (QueueItem.objects.head)': lambda: QueueItem.objects.filter(
+        room_id=SAMPLE_ROOM_ID
+    ).order_by('position')[:1],
+    'playback write (update_playback)': lambda: Room.objects.filter(pk=SAMPLE_ROOM_ID, state_version=0),
+    'stale participants (sweeper)': lambda: stale_participants(SAMPLE_TIME).values_list('pk', 'room__code')[:500],
+    'idle rooms (sweeper)': lambda: idle_rooms(SAMPLE_TIME).values_list('pk', 'code')[:500],
+}
+
+# Plan lines that mean "read every row of a table". SQLite reports index
+# lookups as SEARCH; SCAN walks the whole table, even "USING INDEX".
+FULL_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (?!CONSTANT ROW\b)(\S+)'),
+    'postgresql': re.compile(r'\bSeq Scan on (\S+)'),
+}
+
+
+def full_scans(plan, vendor=None):
+    """Lines of an EXPLAIN output that scan a whole table."""
+    pattern = FULL_SCAN_PATTERNS.get(vendor or connection.vendor)
+    if pattern is None:
+        return []
+    return [line.strip() for line in plan.splitlines() if pattern.search(line)]
+
+
+def audit(queries=None):
+    """EXPLAIN each hot query; returns [(name, plan, full_scan_lines)]."""
+    results = []
+    for name, build in (queries or HOT_QUERIES).items():
+        plan = build().explain()
+        results.append((name, plan, full_scans(plan)))
+    return results
@@ -0,0 +1,100 @@
+# rooms/ratelimit.py
+"""
+Token-bucket rate limits for client WebSocket messages.
+
+WS_RATE_LIMITS maps a message type to limits per scope: the connection,
+the user (across all of their tabs) and the room. Each limit is
+(messages per second, burst):
+
+    WS_RATE_LIMITS = {
+        'chat_message': {'connection': (2, 10), 'user': (3, 15), 'room': (20, 60)},
+    }
+
+A message goes through only if every scope has a token, and then takes
+one from each. Message types without an entry are not limited. Buckets
+live in this process, like InMemoryPresence, so with several workers the
+user and room limits apply per worker.
+"""
+
+import time
+
+from django.conf import settings
+
+from .cache import TTLCache
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def has_token(self, now):
+        """Refill for the time elapsed since the last call; True if a whole token is available."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens >= 1
+
+    def take(self):
+        self.tokens -= 1
+
+    def retry_after(self):
+        """Seconds until the next token."""
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def refill_seconds(self):
+        """Seconds for an empty bucket to fill up; after that it equals a new one."""
+        return self.capacity / self.rate
+
+
+class RateLimiter:
+    """
+    Buckets are kept in a TTLCache keyed by (scope, key, message type) and
+    expire once they would have refilled, so idle users, rooms and closed
+    connections cost nothing. A check is a few dict lookups per scope.
+    """
+
+    def __init__(self, limits=None, maxsize=50000, clock=time.monotonic):
+        self.limits = limits
+        self.clock = clock
+        self._buckets = TTLCache(maxsize=maxsize, clock=clock)
+
+    def get_limits(self):
+        if self.limits is not None:
+            return self.limits
+        return getattr(settings, 'WS_RATE_LIMITS', {})
+
+    def check(self, message_type, keys):
+        """
+        Take a token for `message_type` from each scope's bucket, with `keys`
+        mapping scope -> key (e.g. {'connection': channel_name, ...}).
+        Returns None if allowed, else (scope, retry_after seconds) for the
+        first exhausted scope; nothing is taken when a message is rejected.
+        """
+        # Message types are client input and may not even be hashable
+        limits = self.get_limits().get(message_type) if isinstance(message_type, str) else None
+        if not limits:
+            return None
+        now = self.clock()
+        granted = []
+        for scope, (rate, burst) in limits.items():
+            cache_key = (scope, keys[scope], message_type)
+            bucket = self._buckets.get(cache_key)
+            if bucket is None:
+                bucket = TokenBucket(rate, burst, now)
+            elif not bucket.has_token(now):
+                return scope, bucket.retry_after()
+            granted.append((cache_key, bucket))
+        for cache_key, bucket in granted:
+            bucket.take()
+            self._buckets.set(cache_key, bucket, ttl=bucket.refill_seconds())
+        return None
+
+    def clear(self):
+        self._buckets.clear()
+
+
+rate_limiter = RateLimiter()
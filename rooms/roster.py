@@ -0,0 +1,86 @@
+# rooms/roster.py
+
+import asyncio
+import logging
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from . import metrics
+from .frames import group_event
+from .presence import get_presence
+
+logger = logging.getLogger(__name__)
+
+
+class RosterBatcher:
+    """
+    Coalesces joins and leaves per room over a short window into a single
+    `roster.update` group event carrying the deltas, so a room that
+    reconnects at once gets one frame per window instead of one per peer.
+    A user who joins and leaves within the same window cancels out.
+    """
+
+    def __init__(self, window=None):
+        self.window = window
+        self._pending = {}
+
+    def get_window(self):
+        if self.window is not None:
+            return self.window
+        return getattr(settings, 'ROSTER_UPDATE_WINDOW', 0.25)
+
+    async def join(self, code, member):
+        batch = self._batch(code)
+        if batch['left'].pop(member['user_id'], None) is None:
+            batch['joined'][member['user_id']] = member
+        await self._schedule(code)
+
+    async def leave(self, code, member):
+        batch = self._batch(code)
+        if batch['joined'].pop(member['user_id'], None) is None:
+            batch['left'][member['user_id']] = member
+        await self._schedule(code)
+
+    def _batch(self, code):
+        batch = self._pending.get(code)
+        if batch is None:
+            batch = self._pending[code] = {'joined': {}, 'left': {}, 'scheduled': False}
+        return batch
+
+    async def _schedule(self, code):
+        batch = self._pending[code]
+        if batch['scheduled']:
+            return
+        if self.get_window() <= 0:
+            await self.flush(code)
+            return
+        batch['scheduled'] = True
+        asyncio.ensure_future(self._flush_later(code))
+
+    async def _flush_later(self, code):
+        await asyncio.sleep(self.get_window())
+        try:
+            await self.flush(code)
+        except Exception:
+            logger.exception("Failed to send roster update for room %s", code)
+
+    async def flush(self, code):
+        batch = self._pending.pop(code, None)
+        if not batch or not (batch['joined'] or batch['left']):
+            return
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        group = f'room_{code}'
+        online = await get_presence().roster(code)
+        metrics.observe_group_send(channel_layer, group, 'roster.update')
+        await channel_layer.group_send(group, group_event('roster.update', {
+            'type': 'roster_update',
+            'joined': list(batch['joined'].values()),
+            'left': list(batch['left'].values()),
+            'online_count': len(online),
+        }))
+
+
+roster_updates = RosterBatcher()
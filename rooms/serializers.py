@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from .models import Room, RoomParticipant
 from django.contrib.auth import get_user_model
+from django.db.models import F
 
 User = get_user_model()
 
@@ -17,6 +18,10 @@ class RoomParticipantSerializer(serializers.ModelSerializer):
         fields = ['user', 'role', 'joined_at', 'is_active']
 
 class RoomSerializer(serializers.ModelSerializer):
+    PLAYBACK_FIELDS = {
+        'current_song', 'current_artist', 'current_duration', 'is_playing', 'current_position',
+    }
+
     host = UserSerializer(read_only=True)
     participant_count = serializers.ReadOnlyField()
     participants_detail = serializers.SerializerMethodField() 
@@ -33,12 +38,34 @@ class RoomSerializer(serializers.ModelSerializer):
             'participants_detail', 'is_user_host', 'is_user_participant'
         ]
         read_only_fields = ['id', 'code', 'created_at', 'host']
+
+    def update(self, instance, validated_data):
+        """
+        Save only the submitted columns, so settings edits never overwrite
+        playback state written concurrently by the room's consumers.
+        """
+        update_fields = [*validated_data, 'updated_at']
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        if self.PLAYBACK_FIELDS.intersection(validated_data):
+            # Make consumers holding the old playback state fail their version check
+            instance.state_version = F('state_version') + 1
+            update_fields.append('state_version')
+        instance.save(update_fields=update_fields)
+        if 'state_version' in update_fields:
+            instance.refresh_from_db(fields=['state_version'])
+        return instance
+
     def get_participants_detail(self, obj):
         """
         This method now manually fetches only the active participants for the room.
         'obj' here is the Room instance.
         """
-        active_participants = RoomParticipant.objects.filter(room=obj, is_active=True)
+        active_participants = getattr(obj, 'active_participants', None)
+        if active_participants is None:
+            active_participants = RoomParticipant.objects.filter(
+                room=obj, is_active=True
+            ).select_related('user')
         # We then serialize this filtered list using the RoomParticipantSerializer.
         return RoomParticipantSerializer(active_participants, many=True).data
     
@@ -51,6 +78,8 @@ class RoomSerializer(serializers.ModelSerializer):
     def get_is_user_participant(self, obj):
         request = self.context.get('request')
         if request and request.user.is_authenticated:
+            if hasattr(obj, 'is_member'):
+                return obj.is_member
             return obj.participants.filter(id=request.user.id).exists()
         return False
 
@@ -93,8 +122,12 @@ class JoinRoomSerializer(serializers.Serializer):
     def validate_code(self, value):
         try:
             room = Room.objects.get(code=value.upper())
-            if not room.can_join():
+            if not room.can_join(self.context['request'].user):
                 raise serializers.ValidationError("Cannot join this room (e.g., room is full or ended).")
             return value.upper()
         except Room.DoesNotExist:
             raise serializers.ValidationError("Room with this code does not exist.")
+
+class ParticipantSerializer(serializers.Serializer):
+    """The participant a host acts on (transfer-host, kick)."""
+    user_id = serializers.IntegerField()
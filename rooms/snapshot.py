@@ -0,0 +1,100 @@
+# rooms/snapshot.py
+"""
+Cached live snapshots of rooms: playback state, queue head and active
+participants, served by RoomSnapshotView without touching the database.
+
+The playback and participant parts are stored under separate cache keys so
+that consumers (playback) and the REST views (participants) never overwrite
+each other's writes. Writers only drop a part once the database has changed;
+a missing part is rebuilt from the database on read.
+"""
+
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import RoomParticipant
+from .state import load_room_state
+
+PLAYBACK_KEY = 'room-snapshot:{}:playback'
+PARTICIPANTS_KEY = 'room-snapshot:{}:participants'
+
+
+def get_cache():
+    return caches[getattr(settings, 'ROOM_SNAPSHOT_CACHE', 'default')]
+
+
+def get_ttl():
+    return getattr(settings, 'ROOM_SNAPSHOT_TTL', 300)
+
+
+def playback_snapshot(state):
+    """
+    Playback fields of a RoomState. Only the clock anchors are stored, so the
+    snapshot (and its ETag) stays the same while a song plays.
+    """
+    anchor = state.playback_started_at
+    return {
+        'current_song': state.current_song,
+        'current_artist': state.current_artist,
+        'song_url': state.current_song_url,
+        'current_duration': state.current_duration,
+        'is_playing': state.is_playing,
+        'anchor_position': state.current_position or 0,
+        'anchor_time': anchor.timestamp() * 1000 if anchor else None,
+        'queue_head': state.queue_head,
+    }
+
+
+def load_participants(code):
+    return [
+        {'user_id': user_id, 'name': name, 'role': role}
+        for user_id, name, role in RoomParticipant.objects.filter(
+            room__code=code, is_active=True
+        ).order_by('joined_at').values_list('user_id', 'user__name', 'role')
+    ]
+
+
+def get_room_snapshot(code):
+    """
+    Return (etag, body) for an active room, or None if there is no such room.
+    `body` is the encoded JSON; the ETag is a hash of it.
+    """
+    cache = get_cache()
+    playback_key, participants_key = PLAYBACK_KEY.format(code), PARTICIPANTS_KEY.format(code)
+    cached = cache.get_many([playback_key, participants_key])
+
+    playback = cached.get(playback_key)
+    if playback is None:
+        state = load_room_state(code)
+        if state is None:
+            return None
+        playback = playback_snapshot(state)
+        cache.add(playback_key, playback, get_ttl())
+
+    participants = cached.get(participants_key)
+    if participants is None:
+        participants = load_participants(code)
+        cache.add(participants_key, participants, get_ttl())
+
+    body = json.dumps(
+        {'code': code, **playback, 'participants': participants},
+        separators=(',', ':'), sort_keys=True,
+    ).encode()
+    return '"{}"'.format(hashlib.sha1(body).hexdigest()), body
+
+
+async def invalidate_playback(code):
+    """Drop the playback part after the Room row or queue changed (consumers, write-behind flushes)."""
+    await get_cache().adelete(PLAYBACK_KEY.format(code))
+
+
+def invalidate_participants(code):
+    """Drop the participant list, e.g. after a join, leave, kick or host handoff."""
+    get_cache().delete(PARTICIPANTS_KEY.format(code))
+
+
+def invalidate_snapshot(code):
+    get_cache().delete_many([PLAYBACK_KEY.format(code), PARTICIPANTS_KEY.format(code)])
@@ -0,0 +1,253 @@
+# rooms/state.py
+
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timezone as dt_timezone
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from .frames import group_event
+from .models import QueueItem, Room
+
+logger = logging.getLogger(__name__)
+
+# Identifies this worker process in state broadcasts, so a worker can skip
+# updates that it published itself.
+PROCESS_ID = uuid.uuid4().hex
+
+
+class StaleRoomState(Exception):
+    """The cached room state is older than the Room row it was about to overwrite."""
+
+
+class RoomState:
+    """
+    In-memory copy of a room's playback fields and the head of its queue.
+    Consumers read this instead of querying the Room row on every message.
+    """
+
+    FIELDS = (
+        'room_id', 'host_id', 'current_song', 'current_artist',
+        'current_song_url', 'current_duration', 'current_position', 'is_playing',
+        'playback_started_at', 'queue_head', 'version',
+    )
+
+    __slots__ = FIELDS
+
+    def __init__(self, **fields):
+        for name in self.FIELDS:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_room(cls, room, queue_head=None):
+        return cls(
+            room_id=room.id,
+            host_id=room.host_id,
+            current_song=room.current_song,
+            current_artist=room.current_artist,
+            current_song_url=room.current_song_url,
+            current_duration=room.current_duration,
+            current_position=room.current_position,
+            is_playing=room.is_playing,
+            playback_started_at=room.playback_started_at,
+            queue_head=queue_head,
+            version=room.state_version,
+        )
+
+    def update(self, fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def to_dict(self):
+        """Channel-layer friendly representation (no UUIDs or datetimes)."""
+        data = {name: getattr(self, name) for name in self.FIELDS}
+        data['room_id'] = str(self.room_id)
+        if self.playback_started_at is not None:
+            data['playback_started_at'] = self.playback_started_at.timestamp()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        data['room_id'] = uuid.UUID(data['room_id'])
+        if data.get('playback_started_at') is not None:
+            data['playback_started_at'] = datetime.fromtimestamp(
+                data['playback_started_at'], tz=dt_timezone.utc
+            )
+        return cls(**data)
+
+
+class RoomStateCache:
+    """
+    Per-process cache of RoomState keyed by room code.
+
+    Entries live as long as this process has at least one connection to the
+    room; other workers keep them fresh by publishing `room.state` events to
+    this process' RoomStateChannel.
+    """
+
+    def __init__(self):
+        self._states = {}
+        self._connections = {}
+
+    def get(self, code):
+        return self._states.get(code)
+
+    def set(self, code, state):
+        # Only cache rooms that have local connections, otherwise entries
+        # would never be released.
+        if code in self._connections:
+            self._states[code] = state
+
+    def apply(self, code, state):
+        """Cache a state received from another worker unless ours is newer."""
+        # Equal versions are accepted: buffered (not yet written) changes
+        # are published without bumping the version.
+        current = self._states.get(code)
+        if current is None or state.version >= current.version:
+            self.set(code, state)
+
+    def invalidate(self, code):
+        self._states.pop(code, None)
+
+    def acquire(self, code):
+        """Register a local connection to the room."""
+        self._connections[code] = self._connections.get(code, 0) + 1
+
+    def release(self, code):
+        """Unregister a local connection; drops the entry with the last one."""
+        remaining = self._connections.get(code, 0) - 1
+        if remaining > 0:
+            self._connections[code] = remaining
+        else:
+            self._connections.pop(code, None)
+            self._states.pop(code, None)
+        return max(remaining, 0)
+
+    def connection_count(self, code):
+        return self._connections.get(code, 0)
+
+
+room_states = RoomStateCache()
+
+
+def load_room_state(code):
+    """Load the state of an active room from the database."""
+    try:
+        room = Room.objects.get(code=code, status='active')
+    except Room.DoesNotExist:
+        return None
+    head = QueueItem.objects.head(room.id)
+    return RoomState.from_room(room, head.to_dict() if head else None)
+
+
+def state_group(code):
+    """Group with one RoomStateChannel member per worker connected to the room."""
+    return f'room_state_{code}'
+
+
+class RoomStateChannel:
+    """
+    This process' subscription to room state changes published by other
+    workers. A single channel per process joins `state_group(code)` while the
+    process has connections to the room, so a state change is delivered once
+    per worker rather than to every consumer in the room group.
+    """
+
+    def __init__(self):
+        self.channel_name = None
+        self._channel_layer = None
+        self._loop = None
+        self._lock = None
+        self._task = None
+        self._rooms = set()
+
+    async def update(self, channel_layer, code):
+        """Join or leave the room's state group to match room_states.connection_count(code)."""
+        await self._ensure_listening(channel_layer)
+        # Serialized, so a last disconnect racing a new connect can't leave
+        # the group after the connect joined it
+        async with self._lock:
+            wanted = room_states.connection_count(code) > 0
+            if wanted == (code in self._rooms):
+                return
+            if wanted:
+                await self._channel_layer.group_add(state_group(code), self.channel_name)
+                self._rooms.add(code)
+            else:
+                self._rooms.discard(code)
+                await self._channel_layer.group_discard(state_group(code), self.channel_name)
+
+    async def _ensure_listening(self, channel_layer):
+        loop = asyncio.get_running_loop()
+        if self._channel_layer is channel_layer and self._loop is loop and not self._task.done():
+            return
+        self._channel_layer = channel_layer
+        self._loop = loop
+        self._lock = asyncio.Lock()
+        self._rooms = set()
+        self.channel_name = await channel_layer.new_channel('room_state.')
+        self._task = asyncio.ensure_future(self._listen(channel_layer, self.channel_name))
+
+    async def _listen(self, channel_layer, channel_name):
+        while True:
+            try:
+                message = await channel_layer.receive(channel_name)
+                self.handle(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to receive room state")
+                await asyncio.sleep(1)
+
+    def handle(self, message):
+        code = message['code']
+        if message['type'] == 'room.invalidate':
+            room_states.invalidate(code)
+        elif message['type'] == 'room.state' and message['origin'] != PROCESS_ID:
+            room_states.apply(code, RoomState.from_dict(message['state']))
+
+
+room_state_channel = RoomStateChannel()
+
+
+async def publish_room_state(channel_layer, code, state):
+    """Send a room's changed state to the other workers connected to it."""
+    await channel_layer.group_send(state_group(code), {
+        'type': 'room.state',
+        'code': code,
+        'origin': PROCESS_ID,
+        'state': state.to_dict(),
+    })
+
+
+def broadcast_room_invalidated(code):
+    """Tell every worker to drop its cached state for the room (sync callers)."""
+    channel_layer = get_channel_layer()
+    if channel_layer is not None:
+        async_to_sync(channel_layer.group_send)(
+            state_group(code), {'type': 'room.invalidate', 'code': code}
+        )
+
+
+def broadcast_role_changed(code, user_id, role):
+    """Tell connected consumers that a participant's role changed (sync callers)."""
+    channel_layer = get_channel_layer()
+    if channel_layer is not None:
+        payload = {'user_id': user_id, 'role': role}
+        async_to_sync(channel_layer.group_send)(
+            f'room_{code}',
+            group_event('participant.role', {'type': 'role_changed', **payload}, payload=payload)
+        )
+
+
+def broadcast_participant_removed(code, user_id):
+    """Disconnect a participant that was removed from the room (sync callers)."""
+    channel_layer = get_channel_layer()
+    if channel_layer is not None:
+        async_to_sync(channel_layer.group_send)(
+            f'room_{code}',
+            {'type': 'participant.removed', 'payload': {'user_id': user_id}}
+        )
@@ -7,6 +7,7 @@ let reconnectAttempts = 0;
 let maxReconnectAttempts = 5;
 let audioPlayer = null;
 let isUpdatingFromRemote = false;
+let pingTimer = null;
 
 // Token management
 const TokenManager = {
@@ -22,6 +23,11 @@ const TokenManager = {
     
     isAuthenticated() {
         return !!this.getAccessToken();
+    },
+    
+    getUserData() {
+        const userData = localStorage.getItem('user_data');
+        return userData ? JSON.parse(userData) : null;
     }
 };
 
@@ -73,6 +79,56 @@ function updateConnectionStatus(status, message) {
     }
 }
 
+// Server playback clock
+// The server sends an anchor (position at a server timestamp); every client
+// computes the live position from it using its estimated clock offset.
+const PlaybackClock = {
+    offset: 0,          // server time minus local time, in ms
+    samples: [],
+    maxSamples: 8,
+    anchorPosition: 0,
+    anchorTime: null,
+    isPlaying: false,
+    
+    addSample(pong) {
+        if (pong.server_received === undefined || pong.timestamp === undefined) return;
+        const receivedAt = Date.now();
+        const roundTrip = (receivedAt - pong.timestamp) - (pong.server_time - pong.server_received);
+        const offset = ((pong.server_received - pong.timestamp) + (pong.server_time - receivedAt)) / 2;
+        
+        this.samples.push({ roundTrip, offset });
+        if (this.samples.length > this.maxSamples) this.samples.shift();
+        
+        // The sample with the shortest round trip has the least queuing error
+        const best = this.samples.reduce((a, b) => (b.roundTrip < a.roundTrip ? b : a));
+        this.offset = best.offset;
+    },
+    
+    serverNow() {
+        return Date.now() + this.offset;
+    },
+    
+    setAnchor(data) {
+        if (data.anchor_position === undefined) return;
+        this.anchorPosition = data.anchor_position;
+        this.anchorTime = data.anchor_time;
+        this.isPlaying = !!data.is_playing;
+    },
+    
+    anchorAt(position, isPlaying) {
+        // The host's own seek: correctDrift() must not pull it back before
+        // the server's playback_anchor arrives
+        this.anchorPosition = position;
+        this.anchorTime = this.serverNow();
+        this.isPlaying = isPlaying;
+    },
+    
+    position() {
+        if (!this.isPlaying || this.anchorTime === null) return this.anchorPosition;
+        return this.anchorPosition + Math.max(this.serverNow() - this.anchorTime, 0) / 1000;
+    }
+};
+
 // Audio Player Manager
 const AudioPlayerManager = {
     init() {
@@ -113,17 +169,11 @@ const AudioPlayerManager = {
         }
     },
     
-    onPlay() {
-        if (!isUpdatingFromRemote && isHost) {
-            this.syncPlaybackState();
-        }
-    },
+    // Play/pause go through toggle_playback, so the server clock already
+    // knows about them; only seeks need to be reported by the host.
+    onPlay() {},
     
-    onPause() {
-        if (!isUpdatingFromRemote && isHost) {
-            this.syncPlaybackState();
-        }
-    },
+    onPause() {},
     
     onEnded() {
         if (isHost) {
@@ -172,11 +222,12 @@ const AudioPlayerManager = {
         const newTime = percent * audioPlayer.duration;
         
         audioPlayer.currentTime = newTime;
+        PlaybackClock.anchorAt(newTime, !audioPlayer.paused);
         this.syncPlaybackState();
     },
     
     syncPlaybackState() {
-        // Send current playback state to other participants
+        // Report a seek so the server can re-anchor the playback clock
         RoomSocket.send({
             type: 'sync_playback',
             room_code: ROOM_CODE,
@@ -226,6 +277,33 @@ const AudioPlayerManager = {
         }
     },
     
+    correctDrift() {
+        // Keep the audio element in step with the server clock
+        if (!audioPlayer || !audioPlayer.src || isNaN(audioPlayer.duration)) return;
+        
+        if (PlaybackClock.isPlaying && audioPlayer.paused) {
+            this.setTime(PlaybackClock.position());
+            this.play();
+            return;
+        }
+        if (!PlaybackClock.isPlaying) {
+            if (!audioPlayer.paused) this.pause();
+            audioPlayer.playbackRate = 1;
+            return;
+        }
+        
+        const drift = audioPlayer.currentTime - PlaybackClock.position();
+        if (Math.abs(drift) > 0.5) {
+            audioPlayer.playbackRate = 1;
+            this.setTime(PlaybackClock.position());
+        } else if (Math.abs(drift) > 0.05) {
+            // Small drift: nudge the rate instead of an audible seek
+            audioPlayer.playbackRate = drift > 0 ? 0.97 : 1.03;
+        } else {
+            audioPlayer.playbackRate = 1;
+        }
+    },
+    
     formatTime(seconds) {
         if (isNaN(seconds)) return '0:00';
         const mins = Math.floor(seconds / 60);
@@ -256,24 +334,28 @@ const RoomSocket = {
         const socketUrl = `${protocol}//${window.location.host}/ws/rooms/${ROOM_CODE}/?token=${token}`;
         
         try {
-            roomSocket = new WebSocket(socketUrl);
+            // Offer compact binary frames; the server falls back to JSON
+            roomSocket = new WebSocket(socketUrl, Wire.PROTOCOLS);
+            roomSocket.binaryType = 'arraybuffer';
             
             roomSocket.onopen = function(e) {
-                console.log("WebSocket connected successfully", e);
+                console.log("WebSocket connected successfully", e, "protocol:", roomSocket.protocol || 'json');
                 updateConnectionStatus('connected', 'Connected');
                 reconnectAttempts = 0;
                 
-                RoomSocket.send({
-                    'type': 'ping',
-                    'timestamp': Date.now()
-                });
+                RoomSocket.startClockSync();
             };
             
             roomSocket.onmessage = function(e) {
                 console.log("WebSocket message received:", e.data);
                 try {
-                    const data = JSON.parse(e.data);
-                    handleWebSocketMessage(data);
+                    const data = typeof e.data === 'string' ? JSON.parse(e.data) : Wire.decode(e.data);
+                    // Frames sent in the same server tick arrive batched as an array
+                    if (Array.isArray(data)) {
+                        data.forEach(handleWebSocketMessage);
+                    } else {
+                        handleWebSocketMessage(data);
+                    }
                 } catch (error) {
                     console.error("Error parsing WebSocket message:", error);
                 }
@@ -281,6 +363,7 @@ const RoomSocket = {
             
             roomSocket.onclose = function(e) {
                 console.log("WebSocket connection closed. Code:", e.code, "Reason:", e.reason);
+                RoomSocket.stopClockSync();
                 
                 let statusMessage = 'Disconnected';
                 let shouldReconnect = false;
@@ -305,6 +388,10 @@ const RoomSocket = {
                         statusMessage = 'Room Not Found';
                         showAlert('This room does not exist or is no longer active.', 'error');
                         break;
+                    case 4009:
+                        statusMessage = 'Room Full';
+                        showAlert('This room is full.', 'error');
+                        break;
                     default:
                         statusMessage = 'Connection Lost';
                         shouldReconnect = true;
@@ -332,6 +419,24 @@ const RoomSocket = {
         }
     },
     
+    startClockSync: function() {
+        // A quick burst of pings for an initial offset estimate, then a slow refresh
+        const ping = () => RoomSocket.send({ 'type': 'ping', 'timestamp': Date.now() });
+        this.stopClockSync();
+        ping();
+        for (let i = 1; i < 5; i++) {
+            setTimeout(ping, i * 400);
+        }
+        pingTimer = setInterval(ping, 30000);
+    },
+    
+    stopClockSync: function() {
+        if (pingTimer) {
+            clearInterval(pingTimer);
+            pingTimer = null;
+        }
+    },
+    
     disconnect: function() {
         if (roomSocket) {
             console.log("Disconnecting WebSocket");
@@ -342,7 +447,8 @@ const RoomSocket = {
     
     send: function(data) {
         if (roomSocket && roomSocket.readyState === WebSocket.OPEN) {
-            roomSocket.send(JSON.stringify(data));
+            const binary = Wire.isBinary(roomSocket) ? Wire.encode(data) : null;
+            roomSocket.send(binary || JSON.stringify(data));
         } else {
             console.warn("WebSocket not ready, cannot send message:", data);
         }
@@ -354,17 +460,26 @@ function handleWebSocketMessage(data) {
     console.log("Handling message type:", data.type, data);
     
     switch (data.type) {
-        case 'user_joined':
-            handleUserJoin(data);
+        case 'roster_update':
+            handleRosterUpdate(data);
             break;
-        case 'user_left':
-            handleUserLeave(data);
+        case 'roster':
+            handleRoster(data);
             break;
         case 'chat_message':
             handleChatMessage(data);
             break;
+        case 'chat_history':
+            handleChatHistory(data);
+            break;
+        case 'rate_limited':
+            handleRateLimited(data);
+            break;
         case 'pong':
-            console.log("Received pong response");
+            PlaybackClock.addSample(data);
+            break;
+        case 'playback_state':
+            handlePlaybackState(data);
             break;
         case 'song_started':
             handleSongStarted(data);
@@ -378,9 +493,16 @@ function handleWebSocketMessage(data) {
         case 'playback_synced':
             handlePlaybackSync(data);
             break;
+        case 'playback_anchor':
+            // The server's anchor for our own seek; the audio is already there
+            PlaybackClock.setAnchor(data);
+            break;
         case 'room_updated':
             handleRoomUpdate(data);
             break;
+        case 'role_changed':
+            handleRoleChanged(data);
+            break;
         case 'success':
             showAlert(data.message, 'success');
             break;
@@ -394,35 +516,47 @@ function handleWebSocketMessage(data) {
 }
 
 // WebSocket Message Handlers
-function handleUserJoin(data) {
-    console.log("User joined:", data);
+function handleRoster(data) {
+    // Sent on every (re)connect: who is online right now
+    console.log("Roster:", data);
+    displayParticipants(data.participants.map(p => ({
+        user: { id: p.user_id, name: p.name },
+        role: p.role
+    })));
+    setOnlineCount(data.online_count);
+}
+
+function setOnlineCount(count) {
+    if (count === undefined) return;
+    document.getElementById('participantCount').textContent = count;
+}
+
+function handleRosterUpdate(data) {
+    // Joins and leaves batched over a short window by the server
+    console.log("Roster update:", data);
+    const container = document.getElementById('participantsList');
     
-    const existingParticipant = document.getElementById(`participant-${data.user_id}`);
-    if (existingParticipant) {
-        return;
-    }
+    const joined = data.joined.filter(p => !document.getElementById(`participant-${p.user_id}`));
+    joined.forEach(p => {
+        container.insertAdjacentHTML('beforeend', createParticipantHtml(p.user_id, p.name, p.role));
+    });
     
-    const container = document.getElementById('participantsList');
-    const participantHtml = createParticipantHtml(data.user_id, data.name, 'Guest');
-    container.insertAdjacentHTML('beforeend', participantHtml);
-    updateParticipantCount(1);
+    const left = data.left.filter(p => {
+        const element = document.getElementById(`participant-${p.user_id}`);
+        if (element) element.remove();
+        return !!element;
+    });
     
-    showAlert(`${data.name} joined the room`, 'success');
-}
-
-function handleUserLeave(data) {
-    console.log("User left:", data);
+    setOnlineCount(data.online_count);
     
-    const participantElement = document.getElementById(`participant-${data.user_id}`);
-    if (participantElement) {
-        participantElement.remove();
-        updateParticipantCount(-1);
-        showAlert(`${data.name} left the room`, 'success');
-    }
+    const names = list => list.length === 1 ? list[0].name : `${list.length} people`;
+    if (joined.length) showAlert(`${names(joined)} joined the room`, 'success');
+    if (left.length) showAlert(`${names(left)} left the room`, 'success');
 }
 
 function handleSongStarted(data) {
     console.log("Song started:", data);
+    PlaybackClock.setAnchor(data);
     if (data.song_url) {
         AudioPlayerManager.loadSong(data.song_url, data.current_song, data.current_artist);
         if (data.is_playing) {
@@ -432,26 +566,33 @@ function handleSongStarted(data) {
     updatePlaybackUI(data);
 }
 
+function handlePlaybackState(data) {
+    // Sent on connect so late joiners start at the live position
+    console.log("Playback state:", data);
+    handleSongStarted(data);
+    AudioPlayerManager.setTime(PlaybackClock.position());
+}
+
 function handleSongPaused(data) {
     console.log("Song paused:", data);
+    PlaybackClock.setAnchor(data);
     AudioPlayerManager.pause();
+    AudioPlayerManager.setTime(PlaybackClock.position());
     updatePlaybackUI(data);
 }
 
 function handleSongResumed(data) {
     console.log("Song resumed:", data);
-    if (data.current_time !== undefined) {
-        AudioPlayerManager.setTime(data.current_time);
-    }
+    PlaybackClock.setAnchor(data);
+    AudioPlayerManager.setTime(PlaybackClock.position());
     AudioPlayerManager.play();
     updatePlaybackUI(data);
 }
 
 function handlePlaybackSync(data) {
     console.log("Playback sync:", data);
-    if (data.current_time !== undefined) {
-        AudioPlayerManager.setTime(data.current_time);
-    }
+    PlaybackClock.setAnchor(data);
+    AudioPlayerManager.setTime(PlaybackClock.position());
     if (data.is_playing) {
         AudioPlayerManager.play();
     } else {
@@ -459,11 +600,69 @@ function handlePlaybackSync(data) {
     }
 }
 
+function handleRoleChanged(data) {
+    console.log("Role changed:", data);
+    const roleLabel = data.role === 'host' ? 'Host' : 'Guest';
+    const participantElement = document.getElementById(`participant-${data.user_id}`);
+    if (participantElement) {
+        const name = participantElement.querySelector('.participant-name').textContent;
+        participantElement.outerHTML = createParticipantHtml(data.user_id, name, roleLabel);
+    }
+    
+    const currentUser = TokenManager.getUserData();
+    if (currentUser && currentUser.id === data.user_id) {
+        isHost = data.role === 'host';
+        document.getElementById('yourRole').textContent = roleLabel;
+        updatePlaybackUI({ is_playing: audioPlayer && !audioPlayer.paused });
+    }
+}
+
 function handleChatMessage(data) {
     console.log("Chat message received:", data);
+    appendChatMessages([data]);
     showAlert(`${data.name}: ${data.message}`, 'success');
 }
 
+function handleChatHistory(data) {
+    console.log(`Chat history: ${data.messages.length} messages`);
+    // Sent on every (re)connect: replace what is shown
+    document.getElementById('chatMessages').innerHTML = '';
+    appendChatMessages(data.messages);
+}
+
+function appendChatMessages(messages) {
+    const container = document.getElementById('chatMessages');
+    if (!container || messages.length === 0) return;
+    const empty = container.querySelector('.chat-empty');
+    if (empty) empty.remove();
+    
+    messages.forEach(message => {
+        // Skip messages already shown (a live message can also arrive in a replay)
+        if (message.id && document.getElementById(`chat-${message.id}`)) return;
+        const item = document.createElement('div');
+        item.className = 'chat-message';
+        if (message.id) item.id = `chat-${message.id}`;
+        
+        const time = document.createElement('span');
+        time.className = 'chat-time';
+        time.textContent = new Date(message.created_at).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
+        const name = document.createElement('span');
+        name.className = 'chat-name';
+        name.textContent = message.name;
+        const text = document.createElement('span');
+        text.textContent = message.message;
+        
+        item.append(time, name, text);
+        container.appendChild(item);
+    });
+    container.scrollTop = container.scrollHeight;
+}
+
+function handleRateLimited(data) {
+    console.warn(`Rate limited: ${data.message_type} (${data.scope}), retry in ${data.retry_after}ms`);
+    showAlert('Slow down! Try again in a moment.', 'error');
+}
+
 function handleRoomUpdate(data) {
     console.log("Room updated:", data);
     if (data.room) {
@@ -530,12 +729,6 @@ function displayParticipants(participants) {
     container.innerHTML = participants.map(p => createParticipantHtml(p.user.id, p.user.name, p.role)).join('');
 }
 
-function updateParticipantCount(change) {
-    const countElement = document.getElementById('participantCount');
-    let currentCount = parseInt(countElement.textContent);
-    countElement.textContent = currentCount + change;
-}
-
 function updatePlaybackState(room) {
     const noSong = document.getElementById('noSong');
     const songPlaying = document.getElementById('songPlaying');
@@ -691,6 +884,7 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Initialize audio player
     AudioPlayerManager.init();
+    setInterval(() => AudioPlayerManager.correctDrift(), 1000);
     
     // Control button handlers
     document.getElementById('playPauseBtn').addEventListener('click', function() {
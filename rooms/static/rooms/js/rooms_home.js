@@ -89,27 +89,49 @@ async function joinRoom() {
     }
 }
 
-// Load user's rooms
-async function loadRooms() {
+// Load user's rooms, one page at a time (the API returns {next, previous, results})
+let nextRoomsUrl = null;
+
+async function loadRooms(url = '/rooms/api/rooms/') {
     const loading = document.getElementById('roomsLoading');
     const container = document.getElementById('roomsContainer');
     const empty = document.getElementById('roomsEmpty');
+    const loadMore = document.getElementById('roomsLoadMore');
+    const firstPage = url === '/rooms/api/rooms/';
     
     try {
-        const response = await apiCall('/rooms/api/rooms/');
-        const rooms = await response.json();
+        loadMore.disabled = true;
+        const response = await apiCall(url);
+        const data = await response.json();
+        const rooms = data.results;
         
         loading.style.display = 'none';
         
-        if (rooms.length === 0) {
+        if (firstPage && rooms.length === 0) {
             empty.style.display = 'block';
         } else {
             container.style.display = 'grid';
-            container.innerHTML = rooms.map(room => createRoomCard(room)).join('');
+            const cards = rooms.map(room => createRoomCard(room)).join('');
+            if (firstPage) {
+                container.innerHTML = cards;
+            } else {
+                container.insertAdjacentHTML('beforeend', cards);
+            }
         }
+        
+        nextRoomsUrl = data.next;
+        loadMore.style.display = nextRoomsUrl ? 'inline-block' : 'none';
     } catch (error) {
         loading.style.display = 'none';
         showAlert('Failed to load rooms', 'error');
+    } finally {
+        loadMore.disabled = false;
+    }
+}
+
+function loadMoreRooms() {
+    if (nextRoomsUrl) {
+        loadRooms(nextRoomsUrl);
     }
 }
 
@@ -130,8 +152,6 @@ function createRoomCard(room) {
                 </div>
             </div>
             
-            ${room.description ? `<p style="color: #666; margin-bottom: 10px;">${room.description}</p>` : ''}
-            
             <div class="room-stats">
                 <span>👥 ${room.participant_count}/${room.max_participants}</span>
                 <span>🎵 ${room.current_song || 'No song playing'}</span>
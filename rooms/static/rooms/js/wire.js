@@ -0,0 +1,182 @@
+// Compact binary frames for the room WebSocket (mirrors rooms/wire.py).
+//
+// When the server accepts the 'musicroom.msgpack' subprotocol, pong,
+// playback_synced and roster frames arrive as msgpack arrays of
+// [type code, ...fields], and ping / sync_playback may be sent that way.
+// Everything else stays JSON text.
+
+const Wire = (function() {
+    const MSGPACK_PROTOCOL = 'musicroom.msgpack';
+    const JSON_PROTOCOL = 'musicroom.json';
+
+    const FRAME_CODES = {
+        'pong': 1,
+        'playback_synced': 2,
+        'roster': 3,
+        'roster_update': 4,
+        'ping': 5,
+        'sync_playback': 6
+    };
+    const FRAME_TYPES = {};
+    Object.keys(FRAME_CODES).forEach(type => { FRAME_TYPES[FRAME_CODES[type]] = type; });
+
+    const FRAME_FIELDS = {
+        'pong': ['timestamp', 'server_received', 'server_time'],
+        'playback_synced': ['is_playing', 'anchor_position', 'anchor_time', 'server_time', 'current_time'],
+        'roster': ['participants', 'online_count'],
+        'roster_update': ['joined', 'left', 'online_count'],
+        'ping': ['timestamp'],
+        'sync_playback': ['current_time', 'is_playing']
+    };
+    const MEMBER_FIELDS = ['user_id', 'name', 'role'];
+    const MEMBER_LISTS = ['participants', 'joined', 'left'];
+
+    const textEncoder = new TextEncoder();
+    const textDecoder = new TextDecoder();
+
+    // --- msgpack: the subset used by these frames (nil, bool, numbers, str, array, map) ---
+
+    function pack(value) {
+        const bytes = [];
+        const pushUint = (n, size) => {
+            for (let shift = (size - 1) * 8; shift >= 0; shift -= 8) {
+                bytes.push(Math.floor(n / 2 ** shift) & 0xff);
+            }
+        };
+        const write = (v) => {
+            if (v === null || v === undefined) {
+                bytes.push(0xc0);
+            } else if (v === true || v === false) {
+                bytes.push(v ? 0xc3 : 0xc2);
+            } else if (typeof v === 'number') {
+                if (Number.isSafeInteger(v) && v >= 0) {
+                    if (v < 0x80) bytes.push(v);
+                    else if (v < 0x100) { bytes.push(0xcc); pushUint(v, 1); }
+                    else if (v < 0x10000) { bytes.push(0xcd); pushUint(v, 2); }
+                    else if (v < 2 ** 32) { bytes.push(0xce); pushUint(v, 4); }
+                    else { bytes.push(0xcf); pushUint(v, 8); }
+                } else if (Number.isInteger(v) && v < 0 && v >= -32) {
+                    bytes.push(v & 0xff);
+                } else {
+                    const view = new DataView(new ArrayBuffer(8));
+                    view.setFloat64(0, v);
+                    bytes.push(0xcb, ...new Uint8Array(view.buffer));
+                }
+            } else if (typeof v === 'string') {
+                const encoded = textEncoder.encode(v);
+                if (encoded.length < 32) bytes.push(0xa0 | encoded.length);
+                else if (encoded.length < 0x100) { bytes.push(0xd9); pushUint(encoded.length, 1); }
+                else if (encoded.length < 0x10000) { bytes.push(0xda); pushUint(encoded.length, 2); }
+                else { bytes.push(0xdb); pushUint(encoded.length, 4); }
+                bytes.push(...encoded);
+            } else if (Array.isArray(v)) {
+                if (v.length < 16) bytes.push(0x90 | v.length);
+                else if (v.length < 0x10000) { bytes.push(0xdc); pushUint(v.length, 2); }
+                else { bytes.push(0xdd); pushUint(v.length, 4); }
+                v.forEach(write);
+            } else {
+                const keys = Object.keys(v);
+                if (keys.length < 16) bytes.push(0x80 | keys.length);
+                else { bytes.push(0xde); pushUint(keys.length, 2); }
+                keys.forEach(key => { write(key); write(v[key]); });
+            }
+        };
+        write(value);
+        return new Uint8Array(bytes);
+    }
+
+    function unpack(buffer) {
+        const view = new DataView(buffer);
+        let offset = 0;
+        const uint = (size) => {
+            let n = 0;
+            for (let i = 0; i < size; i++) n = n * 256 + view.getUint8(offset++);
+            return n;
+        };
+        const int = (size) => {
+            const n = uint(size);
+            return n >= 2 ** (size * 8 - 1) ? n - 2 ** (size * 8) : n;
+        };
+        const str = (length) => {
+            const value = textDecoder.decode(new Uint8Array(buffer, offset, length));
+            offset += length;
+            return value;
+        };
+        const array = (length) => {
+            const items = [];
+            for (let i = 0; i < length; i++) items.push(read());
+            return items;
+        };
+        const map = (length) => {
+            const obj = {};
+            for (let i = 0; i < length; i++) {
+                const key = read();
+                obj[key] = read();
+            }
+            return obj;
+        };
+        const read = () => {
+            const byte = view.getUint8(offset++);
+            if (byte < 0x80) return byte;
+            if (byte >= 0xe0) return byte - 0x100;
+            if ((byte & 0xe0) === 0xa0) return str(byte & 0x1f);
+            if ((byte & 0xf0) === 0x90) return array(byte & 0x0f);
+            if ((byte & 0xf0) === 0x80) return map(byte & 0x0f);
+            switch (byte) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xca: { const v = view.getFloat32(offset); offset += 4; return v; }
+                case 0xcb: { const v = view.getFloat64(offset); offset += 8; return v; }
+                case 0xcc: return uint(1);
+                case 0xcd: return uint(2);
+                case 0xce: return uint(4);
+                case 0xcf: return uint(8);
+                case 0xd0: return int(1);
+                case 0xd1: return int(2);
+                case 0xd2: return int(4);
+                case 0xd3: return int(8);
+                case 0xd9: return str(uint(1));
+                case 0xda: return str(uint(2));
+                case 0xdb: return str(uint(4));
+                case 0xdc: return array(uint(2));
+                case 0xdd: return array(uint(4));
+                case 0xde: return map(uint(2));
+                case 0xdf: return map(uint(4));
+            }
+            throw new Error(`Unsupported msgpack byte 0x${byte.toString(16)}`);
+        };
+        return read();
+    }
+
+    // --- Frames ---
+
+    return {
+        PROTOCOLS: [MSGPACK_PROTOCOL, JSON_PROTOCOL],
+
+        isBinary(socket) {
+            return socket.protocol === MSGPACK_PROTOCOL;
+        },
+
+        // Binary form of a frame, or null if its type is sent as JSON
+        encode(frame) {
+            const code = FRAME_CODES[frame.type];
+            if (!code) return null;
+            return pack([code, ...FRAME_FIELDS[frame.type].map(field => frame[field])]);
+        },
+
+        decode(buffer) {
+            const values = unpack(buffer);
+            const type = FRAME_TYPES[values[0]];
+            if (!type) throw new Error(`Unknown binary frame type ${values[0]}`);
+            const frame = { type: type };
+            FRAME_FIELDS[type].forEach((field, i) => {
+                const value = values[i + 1];
+                frame[field] = MEMBER_LISTS.includes(field)
+                    ? value.map(member => Object.fromEntries(MEMBER_FIELDS.map((name, j) => [name, member[j]])))
+                    : value;
+            });
+            return frame;
+        }
+    };
+})();
@@ -0,0 +1,187 @@
+# rooms/sweeper.py
+"""
+Room lifecycle sweeper.
+
+Consumers record WebSocket activity on Room.last_activity_at and
+RoomParticipant.last_seen_at through `activity` (an ActivityBuffer), which
+writes it in batches. `sweep()` then:
+
+- deactivates participants not seen for PARTICIPANT_IDLE_TIMEOUT seconds,
+  so participant counts and can_join() stop counting clients that vanished
+  without calling LeaveRoomView;
+- ends active rooms idle for ROOM_IDLE_TIMEOUT seconds and deactivates
+  their participants.
+
+All changes are set-based UPDATEs in batches of primary keys. Run it from
+cron with `manage.py sweep_rooms`, or in-process by setting
+ROOM_SWEEP_INTERVAL (see RoomSweeper).
+"""
+
+import asyncio
+import logging
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .log import log_event
+from .models import Room, RoomParticipant
+from .snapshot import invalidate_participants, invalidate_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+def reactivate_participant(room_id, user_id, now=None):
+    """Mark a connecting participant active again: they are in the room, even if the sweeper said otherwise."""
+    RoomParticipant.objects.filter(room_id=room_id, user_id=user_id).update(
+        is_active=True, last_seen_at=now or timezone.now()
+    )
+
+
+def record_activity(participants, now=None):
+    """
+    Stamp WebSocket activity, with `participants` mapping room ids to the
+    ids of their active users: one UPDATE per room, plus one for the rooms.
+    """
+    now = now or timezone.now()
+    for room_id, user_ids in participants.items():
+        RoomParticipant.objects.filter(room_id=room_id, user_id__in=user_ids).update(last_seen_at=now)
+    if participants:
+        Room.objects.filter(pk__in=list(participants)).update(last_activity_at=now)
+
+
+class ActivityBuffer:
+    """
+    Collects WebSocket activity in memory and writes it with
+    record_activity() every ACTIVITY_TOUCH_INTERVAL seconds, so connects,
+    disconnects and messages cost a set insert instead of UPDATEs, and a
+    busy room is stamped once per interval per worker. Stamps are at most
+    one interval late, well within the sweeper's timeouts.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval
+        self._pending = {}
+        self._task = None
+
+    def get_interval(self):
+        if self.interval is not None:
+            return self.interval
+        return getattr(settings, 'ACTIVITY_TOUCH_INTERVAL', 60)
+
+    def touch(self, room_id, user_id):
+        self._pending.setdefault(room_id, set()).add(user_id)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def take(self):
+        """Remove and return the pending {room_id: user_ids}."""
+        pending, self._pending = self._pending, {}
+        return pending
+
+    async def flush(self):
+        pending = self.take()
+        if pending:
+            await database_sync_to_async(record_activity)(pending)
+
+    async def _run(self):
+        while self._pending:
+            await asyncio.sleep(self.get_interval())
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to record room activity")
+
+
+def stale_participants(cutoff):
+    return RoomParticipant.objects.filter(is_active=True, last_seen_at__lt=cutoff)
+
+
+def idle_rooms(cutoff):
+    return Room.objects.filter(status='active', last_activity_at__lt=cutoff)
+
+
+def _batches(queryset, batch_size, key):
+    """
+    Yield [(pk, key)] batches of `queryset` until it matches no rows. The
+    caller must update each batch so that it stops matching; updating a
+    batch at a time keeps every statement's locks short.
+    """
+    while True:
+        batch = list(queryset.order_by().values_list('pk', key)[:batch_size])
+        if not batch:
+            return
+        yield batch
+
+
+def sweep(now=None, room_idle=None, participant_idle=None, batch_size=500, dry_run=False):
+    """End idle rooms and deactivate stale participants. Returns counts of changed rows."""
+    now = now or timezone.now()
+    room_idle = room_idle or getattr(settings, 'ROOM_IDLE_TIMEOUT', 6 * 60 * 60)
+    participant_idle = participant_idle or getattr(settings, 'PARTICIPANT_IDLE_TIMEOUT', 10 * 60)
+    participants = stale_participants(now - timedelta(seconds=participant_idle))
+    rooms = idle_rooms(now - timedelta(seconds=room_idle))
+
+    if dry_run:
+        return {'participants': participants.count(), 'rooms': rooms.count()}
+
+    counts = {'participants': 0, 'rooms': 0}
+    stale_codes = set()
+    for batch in _batches(participants, batch_size, 'room__code'):
+        counts['participants'] += RoomParticipant.objects.filter(
+            pk__in=[pk for pk, _ in batch]
+        ).update(is_active=False)
+        stale_codes.update(code for _, code in batch)
+
+    ended_codes = []
+    for batch in _batches(rooms, batch_size, 'code'):
+        room_ids = [pk for pk, _ in batch]
+        counts['rooms'] += Room.objects.filter(pk__in=room_ids).update(status='ended', is_playing=False)
+        counts['participants'] += RoomParticipant.objects.filter(
+            room_id__in=room_ids, is_active=True
+        ).update(is_active=False)
+        ended_codes.extend(code for _, code in batch)
+
+    for code in stale_codes:
+        invalidate_participants(code)
+    for code in ended_codes:
+        invalidate_snapshot(code)
+
+    if any(counts.values()):
+        log_event(logger, logging.INFO, 'rooms.sweep', "Ended %s idle rooms, deactivated %s participants",
+                  counts['rooms'], counts['participants'], **counts)
+    return counts
+
+
+class RoomSweeper:
+    """
+    Runs sweep() every ROOM_SWEEP_INTERVAL seconds inside a worker process.
+    Started by the first RoomConsumer connection; disabled when the setting
+    is unset. Several workers sweeping at once is harmless.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval
+        self._task = None
+
+    def get_interval(self):
+        if self.interval is not None:
+            return self.interval
+        return getattr(settings, 'ROOM_SWEEP_INTERVAL', None)
+
+    def ensure_running(self):
+        if self.get_interval() and (self._task is None or self._task.done()):
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.get_interval())
+            try:
+                await database_sync_to_async(sweep)()
+            except Exception:
+                logger.exception("Room sweep failed")
+
+
+activity = ActivityBuffer()
+room_sweeper = RoomSweeper()
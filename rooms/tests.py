@@ -1,3 +1,907 @@
-from django.test import TestCase
+import asyncio
+import functools
+import time
+from datetime import timedelta
+from unittest import mock, skipIf
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from musicroom.asgi import application
+from users.models import CustomUser
+
+from . import codes, frames, metrics, queryplan, wire
+from .cache import TTLCache
+from .consumers import RoomConsumer
+from .frames import group_event
+from .state import load_room_state
+from .sweeper import record_activity
+from .writebehind import playback_writes
+from .auth import JWTAuthMiddleware
+from .backpressure import SendBackpressure, TransportWindow, daphne_transport
+from .chat import ChatHistory
+from .layerbench import fake_redis_hosts
+from .layers import GROUP_SEND_SHA, ShardedRedisChannelLayer
+from .models import ChatMessage, QueueItem, Room, RoomCodeSequence, RoomParticipant
+from .outbox import Outbox
+from .presence import InMemoryPresence, get_presence
+from .ratelimit import RateLimiter
+from .roster import RosterBatcher
+from .routing import websocket_urlpatterns
+from .snapshot import get_cache
+
+MEMORY_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+MEMORY_PRESENCE = {'BACKEND': 'rooms.presence.InMemoryPresence'}
+
+# The WebSocket stack without AllowedHostsOriginValidator
+websocket_application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+
+
+@override_settings(CHANNEL_LAYERS=MEMORY_LAYERS, ROOM_PRESENCE=MEMORY_PRESENCE)
+class HostActionTests(TestCase):
+    def setUp(self):
+        self.host = CustomUser.objects.create_user('host@example.com', 'pw', name='Host')
+        self.guest = CustomUser.objects.create_user('guest@example.com', 'pw', name='Guest')
+        self.room = Room.objects.create(name='Room', host=self.host)
+        RoomParticipant.objects.create(room=self.room, user=self.host, role='host')
+        RoomParticipant.objects.create(room=self.room, user=self.guest, role='guest')
+        self.client = APIClient()
+
+    def post(self, user, action, data):
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/rooms/api/rooms/{self.room.code}/{action}/', data, format='json')
+
+    def role(self, user):
+        return RoomParticipant.objects.get(room=self.room, user=user).role
+
+    def test_transfer_host(self):
+        response = self.post(self.host, 'transfer-host', {'user_id': self.guest.id})
+        self.assertEqual(response.status_code, 200)
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.host, self.guest)
+        self.assertEqual(self.role(self.host), 'guest')
+        self.assertEqual(self.role(self.guest), 'host')
+
+    def test_transfer_host_requires_host(self):
+        response = self.post(self.guest, 'transfer-host', {'user_id': self.guest.id})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.role(self.host), 'host')
+
+    def test_transfer_host_to_inactive_participant(self):
+        RoomParticipant.objects.filter(user=self.guest).update(is_active=False)
+        response = self.post(self.host, 'transfer-host', {'user_id': self.guest.id})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.role(self.host), 'host')
+
+    def test_invalid_user_ids_are_rejected(self):
+        for user_id in [[self.guest.id], 'abc', None, self.guest.id + 0.5]:
+            for action in ['transfer-host', 'kick']:
+                response = self.post(self.host, action, {'user_id': user_id})
+                self.assertEqual(response.status_code, 400, (action, user_id))
+        self.assertEqual(self.role(self.host), 'host')
+        self.assertTrue(RoomParticipant.objects.filter(user=self.guest).exists())
+
+    def test_kick(self):
+        response = self.post(self.host, 'kick', {'user_id': self.guest.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(RoomParticipant.objects.filter(room=self.room, user=self.guest).exists())
+
+    def test_kick_requires_host(self):
+        response = self.post(self.guest, 'kick', {'user_id': self.host.id})
+        self.assertEqual(response.status_code, 403)
+
+    def test_host_cannot_kick_themselves(self):
+        response = self.post(self.host, 'kick', {'user_id': self.host.id})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.role(self.host), 'host')
+
+
+@override_settings(ROOM_PRESENCE=MEMORY_PRESENCE)
+class RoomQueryCountTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('user@example.com', 'pw', name='User')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.guests = 0
+
+    def add_rooms(self, count, participants=3):
+        for _ in range(count):
+            room = Room.objects.create(name='Room', host=self.user)
+            RoomParticipant.objects.create(room=room, user=self.user, role='host')
+            for _ in range(participants):
+                self.guests += 1
+                guest = CustomUser.objects.create_user(f'guest{self.guests}@example.com', 'pw', name='Guest')
+                RoomParticipant.objects.create(room=room, user=guest)
+        return room
+
+    def assertQueriesDoNotGrow(self, queries, url):
+        for count in (1, 5):
+            self.add_rooms(count)
+            with self.assertNumQueries(queries):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_list(self):
+        response = self.assertQueriesDoNotGrow(1, '/rooms/api/rooms/')
+        self.assertEqual(len(response.data['results']), 6)
+
+    def test_full_list(self):
+        response = self.assertQueriesDoNotGrow(2, '/rooms/api/rooms/?view=full')
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertEqual(len(response.data['results'][0]['participants_detail']), 4)
+
+    def test_detail(self):
+        for participants in (1, 10):
+            room = self.add_rooms(1, participants)
+            with self.assertNumQueries(2):
+                response = self.client.get(f'/rooms/api/rooms/{room.code}/')
+            self.assertEqual(len(response.data['participants_detail']), participants + 1)
+
+
+class RoomCodeTests(TestCase):
+    def test_permutation_is_a_bijection(self):
+        # The full space has 36^6 codes; check the same network over 36^2
+        with mock.patch.multiple(codes, HALF_SPACE=36, CODE_SPACE=36 * 36):
+            permuted = [codes.permute(number) for number in range(36 * 36)]
+        self.assertEqual(sorted(permuted), list(range(36 * 36)))
+
+    def test_codes_are_distinct(self):
+        allocated = {codes.code_for(number) for number in range(10000)}
+        self.assertEqual(len(allocated), 10000)
+        self.assertTrue(all(len(code) == 6 and set(code) <= set(codes.ALPHABET) for code in allocated))
+
+    def test_code_is_allocated_on_save(self):
+        host = CustomUser.objects.create_user('host@example.com', 'pw', name='Host')
+        with self.assertNumQueries(0):
+            room = Room(name='Room', host=host)
+        self.assertEqual(room.code, '')
+        room.save()
+        self.assertEqual(len(room.code), 6)
+
+    def test_taken_code_is_skipped(self):
+        host = CustomUser.objects.create_user('host@example.com', 'pw', name='Host')
+        sequence = RoomCodeSequence.objects.get(pk=RoomCodeSequence.ROOM_CODES)
+        # A room created before the allocator holds the next allocated code
+        legacy = Room.objects.create(name='Legacy', host=host, code=codes.code_for(sequence.value + 1))
+
+        room = Room.objects.create(name='Room', host=host)
+        self.assertEqual(room.code, codes.code_for(sequence.value + 2))
+        self.assertNotEqual(room.code, legacy.code)
+
+
+class QueueItemManagerTests(TestCase):
+    def setUp(self):
+        self.host = CustomUser.objects.create_user('host@example.com', 'pw', name='Host')
+        self.room = Room.objects.create(name='Room', host=self.host)
+
+    def enqueue(self, title, room=None):
+        return QueueItem.objects.enqueue(
+            (room or self.room).id, title=title, url=f'https://example.com/{title}.mp3'
+        )
+
+    def test_enqueue_appends_in_order(self):
+        items = [self.enqueue(title) for title in ['a', 'b', 'c']]
+        positions = [item.position for item in items]
+        self.assertEqual(positions, sorted(positions))
+        self.assertEqual(len(set(positions)), 3)
+        self.assertEqual(QueueItem.objects.head(self.room.id).title, 'a')
+
+    def test_dequeue_pops_head(self):
+        for title in ['a', 'b']:
+            self.enqueue(title)
+        self.assertEqual(QueueItem.objects.dequeue(self.room.id).title, 'a')
+        self.assertEqual(QueueItem.objects.head(self.room.id).title, 'b')
+        self.assertEqual(QueueItem.objects.dequeue(self.room.id).title, 'b')
+        self.assertIsNone(QueueItem.objects.dequeue(self.room.id))
+        self.assertIsNone(QueueItem.objects.head(self.room.id))
+
+    def test_enqueue_after_dequeue_goes_to_the_tail(self):
+        self.enqueue('a')
+        self.enqueue('b')
+        QueueItem.objects.dequeue(self.room.id)
+        self.enqueue('c')
+        titles = list(QueueItem.objects.filter(room=self.room).values_list('title', flat=True))
+        self.assertEqual(titles, ['b', 'c'])
+
+    def test_queues_are_per_room(self):
+        other = Room.objects.create(name='Other', host=self.host)
+        self.enqueue('a')
+        self.enqueue('x', room=other)
+        self.assertEqual(QueueItem.objects.dequeue(other.id).title, 'x')
+        self.assertIsNone(QueueItem.objects.dequeue(other.id))
+        self.assertEqual(QueueItem.objects.head(self.room.id).title, 'a')
+
+
+class QueryPlanTests(TestCase):
+    def test_hot_queries_use_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Plans on an empty database are only meaningful on SQLite')
+        for name, plan, scans in queryplan.audit():
+            self.assertEqual(scans, [], f'{name}:\n{plan}')
+
+
+class ActivityTests(TestCase):
+    def test_activity_is_written_in_one_batch(self):
+        users = [CustomUser.objects.create_user(f'user{i}@example.com', 'pw', name=f'User {i}') for i in range(3)]
+        rooms = [Room.objects.create(name=f'Room {i}', host=users[i]) for i in range(2)]
+        for user in users:
+            RoomParticipant.objects.create(room=rooms[0], user=user)
+        RoomParticipant.objects.create(room=rooms[1], user=users[0])
+        stale = timezone.now() - timedelta(hours=1)
+        RoomParticipant.objects.update(last_seen_at=stale)
+        Room.objects.update(last_activity_at=stale)
+
+        pending = {rooms[0].id: {user.id for user in users}, rooms[1].id: {users[0].id}}
+        # One UPDATE per room for participants, one for the rooms
+        with self.assertNumQueries(3):
+            record_activity(pending)
+        self.assertFalse(RoomParticipant.objects.filter(last_seen_at=stale).exists())
+        self.assertFalse(Room.objects.filter(last_activity_at=stale).exists())
+
+
+class PresenceTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 0
+        self.presence = InMemoryPresence(ttl=90, clock=lambda: self.now)
+
+    def member(self, user_id):
+        return {'user_id': user_id, 'name': f'User {user_id}', 'role': 'guest'}
+
+    async def test_touch_reports_swept_channels(self):
+        await self.presence.join('ROOM', 'a', self.member(1))
+        self.now = 60
+        self.assertTrue(await self.presence.touch('ROOM', 'a'))
+        self.now = 200
+        await self.presence.expire('ROOM')
+        self.assertFalse(await self.presence.touch('ROOM', 'a'))
+        self.assertEqual(await self.presence.members('ROOM'), {})
+
+    async def test_expire_returns_users_left_offline(self):
+        await self.presence.join('ROOM', 'a', self.member(1))
+        await self.presence.join('ROOM', 'b', self.member(2))
+        await self.presence.join('ROOM', 'c', self.member(2))
+        self.now = 60
+        await self.presence.touch('ROOM', 'c')
+        self.now = 100
+        # User 2 is still online in another tab
+        self.assertEqual(await self.presence.expire('ROOM'), [self.member(1)])
+        self.assertEqual(await self.presence.expire('ROOM'), [])
+        self.assertEqual(list(await self.presence.members('ROOM')), ['c'])
+
+    async def test_online_counts(self):
+        await self.presence.join('ROOM', 'a', self.member(1))
+        await self.presence.join('ROOM', 'b', self.member(1))
+        await self.presence.join('ROOM', 'c', self.member(2))
+        self.assertEqual(self.presence.online_counts(['ROOM', 'EMPTY']), {'ROOM': 2, 'EMPTY': 0})
+        self.now = 100
+        self.assertEqual(self.presence.online_counts(['ROOM']), {'ROOM': 0})
+
+
+@override_settings(ROOM_PRESENCE=MEMORY_PRESENCE)
+@override_settings(CHANNEL_LAYERS=MEMORY_LAYERS, ROOM_PRESENCE=MEMORY_PRESENCE)
+class RosterBatcherTests(SimpleTestCase):
+    code = 'ROSTER'
+
+    def member(self, user_id):
+        return {'user_id': user_id, 'name': f'User {user_id}', 'role': 'guest'}
+
+    async def listen(self):
+        channel_layer = get_channel_layer()
+        channel = await channel_layer.new_channel()
+        await channel_layer.group_add(f'room_{self.code}', channel)
+        return channel_layer, channel
+
+    async def test_window_is_coalesced_into_one_update(self):
+        channel_layer, channel = await self.listen()
+        batcher = RosterBatcher(window=0.05)
+        for user_id in (1, 2):
+            await get_presence().join(self.code, f'channel-{user_id}', self.member(user_id))
+            await batcher.join(self.code, self.member(user_id))
+        await batcher.leave(self.code, self.member(3))
+
+        event = await asyncio.wait_for(channel_layer.receive(channel), 1)
+        self.assertEqual(event['type'], 'roster.update')
+        self.assertEqual(frames.loads(event['text']), {
+            'type': 'roster_update',
+            'joined': [self.member(1), self.member(2)],
+            'left': [self.member(3)],
+            'online_count': 2,
+        })
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(channel_layer.receive(channel), 0.1)
+
+    async def test_join_then_leave_cancels_out(self):
+        channel_layer, channel = await self.listen()
+        batcher = RosterBatcher(window=0.05)
+        await batcher.join(self.code, self.member(1))
+        await batcher.leave(self.code, self.member(1))
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(channel_layer.receive(channel), 0.2)
+
+
+@override_settings(ROOM_PRESENCE=MEMORY_PRESENCE)
+class RoomCapacityTests(TestCase):
+    def setUp(self):
+        self.host = CustomUser.objects.create_user('host@example.com', 'pw', name='Host')
+        self.room = Room.objects.create(name='Room', host=self.host, max_participants=2)
+        RoomParticipant.objects.create(room=self.room, user=self.host, role='host')
+
+    def join(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.post('/rooms/api/join/', {'code': self.room.code})
+
+    def test_participant_count_comes_from_presence(self):
+        self.assertEqual(self.room.participant_count, 0)
+        presence = get_presence()
+        for user_id, channel in [(1, 'a'), (2, 'b')]:
+            async_to_sync(presence.join)(self.room.code, channel, {'user_id': user_id})
+        room = Room.objects.get(pk=self.room.pk)
+        self.assertEqual(room.participant_count, 2)
+
+    def test_offline_members_keep_their_place(self):
+        guest = CustomUser.objects.create_user('guest@example.com', 'pw', name='Guest')
+        self.assertEqual(self.join(guest).status_code, 200)
+        # Nobody is connected, but both places are taken
+        self.assertEqual(self.room.participant_count, 0)
+        self.assertFalse(self.room.can_join())
+
+        late = CustomUser.objects.create_user('late@example.com', 'pw', name='Late')
+        self.assertEqual(self.join(late).status_code, 400)
+        self.assertFalse(RoomParticipant.objects.filter(room=self.room, user=late).exists())
+        self.assertEqual(self.room.member_count(), 2)
+
+        # Members can still re-join a full room, and a leave frees a place
+        self.assertEqual(self.join(guest).status_code, 200)
+        RoomParticipant.objects.filter(room=self.room, user=guest).update(is_active=False)
+        self.assertEqual(self.join(late).status_code, 200)
+
+
+@override_settings(CHANNEL_LAYERS=MEMORY_LAYERS)
+class WriteBehindTests(TransactionTestCase):
+    def test_flush_during_host_action_is_not_a_conflict(self):
+        host = CustomUser.objects.create_user('host@example.com', 'pw', name='Host')
+        room = Room.objects.create(name='Room', host=host, is_playing=True)
+        state = load_room_state(room.code)
+        consumer = RoomConsumer()
+        consumer.room_code = room.code
+        consumer.channel_layer = get_channel_layer()
+
+        async def seek_then_pause():
+            await consumer.buffer_room_state(state, {'current_position': 30})
+            # The flush starts writing the seek; the host pauses before it lands
+            flush = asyncio.ensure_future(playback_writes.flush_room(room.code))
+            await asyncio.sleep(0)
+            await consumer.save_room_state(state, {'is_playing': False})
+            await flush
+
+        async_to_sync(seek_then_pause)()
+        room.refresh_from_db()
+        self.assertEqual(room.current_position, 30)
+        self.assertFalse(room.is_playing)
+        self.assertEqual(room.state_version, state.version)
+        self.assertEqual(state.version, 2)
+
+
+@override_settings(CHANNEL_LAYERS=MEMORY_LAYERS)
+class RoomSnapshotTests(TransactionTestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.host = CustomUser.objects.create_user('host@example.com', 'pw', name='Host')
+        self.room = Room.objects.create(name='Room', host=self.host, current_song='Song', is_playing=True)
+        RoomParticipant.objects.create(room=self.room, user=self.host, role='host')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.host)}')
+        self.url = f'/rooms/api/rooms/{self.room.code}/snapshot/'
+
+    def test_matching_etag_is_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['current_song'], 'Song')
+        etag = response['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_seeks_refresh_the_snapshot_when_flushed(self):
+        etag = self.client.get(self.url)['ETag']
+        state = load_room_state(self.room.code)
+        consumer = RoomConsumer()
+        consumer.room_code = self.room.code
+        consumer.channel_layer = get_channel_layer()
+
+        # Buffered seeks only go to the channel layer, not the cache
+        async_to_sync(consumer.buffer_room_state)(state, {'current_position': 30})
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        async_to_sync(playback_writes.flush_room)(self.room.code)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['anchor_position'], 30)
+
+
+class ChatHistoryTests(TestCase):
+    def test_concurrent_connections_share_one_load(self):
+        host = CustomUser.objects.create_user('host@example.com', 'pw', name='Host')
+        room = Room.objects.create(name='Room', host=host)
+        for index in range(3):
+            ChatMessage.objects.create(
+                room=room, user=host, name='Host', message=f'hi {index}',
+                created_at=timezone.now() - timedelta(minutes=3 - index),
+            )
+        history = ChatHistory(size=10)
+
+        async def connect_three():
+            return await asyncio.gather(*[history.recent(room.code, room.id) for _ in range(3)])
+
+        with self.assertNumQueries(1):
+            results = async_to_sync(connect_three)()
+        for messages in results:
+            self.assertEqual([message['message'] for message in messages], ['hi 0', 'hi 1', 'hi 2'])
+
+
+@override_settings(CHANNEL_LAYERS=MEMORY_LAYERS, ROOM_PRESENCE=MEMORY_PRESENCE, WS_RATE_LIMITS={},
+                   ROSTER_UPDATE_WINDOW=0)
+class RoomConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.host = CustomUser.objects.create_user('host@example.com', 'pw', name='Host')
+        self.room = Room.objects.create(name='Room', host=self.host)
+        RoomParticipant.objects.create(room=self.room, user=self.host, role='host')
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(
+            websocket_application, f'/ws/rooms/{self.room.code}/?token={AccessToken.for_user(user)}'
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive_frames(self, communicator):
+        """The frames that arrive before the connection goes quiet."""
+        frames = []
+        while not await communicator.receive_nothing(0.1):
+            frames.append(await communicator.receive_json_from())
+        return frames
+
+    async def receive_types(self, communicator):
+        return [frame['type'] for frame in await self.receive_frames(communicator)]
+
+    async def test_returning_participant_is_refused_when_the_room_filled_up(self):
+        guest, late = [
+            await database_sync_to_async(CustomUser.objects.create_user)(f'{name}@example.com', 'pw', name=name)
+            for name in ('guest', 'late')
+        ]
+        # The sweeper deactivated the guest, and someone else took their place
+        await database_sync_to_async(Room.objects.filter(pk=self.room.pk).update)(max_participants=2)
+        await database_sync_to_async(RoomParticipant.objects.create)(room=self.room, user=guest, is_active=False)
+        await database_sync_to_async(RoomParticipant.objects.create)(room=self.room, user=late)
+
+        communicator = WebsocketCommunicator(
+            websocket_application, f'/ws/rooms/{self.room.code}/?token={AccessToken.for_user(guest)}'
+        )
+        self.assertEqual(await communicator.connect(), (False, 4009))
+        active = RoomParticipant.objects.filter(room=self.room, is_active=True)
+        self.assertEqual(await database_sync_to_async(active.count)(), 2)
+
+    async def test_lapsed_heartbeats(self):
+        guest = await database_sync_to_async(CustomUser.objects.create_user)('guest@example.com', 'pw', name='Guest')
+        await database_sync_to_async(RoomParticipant.objects.create)(room=self.room, user=guest, role='guest')
+        host = await self.connect(self.host)
+        visitor = await self.connect(guest)
+        await self.receive_types(host)
+        await self.receive_types(visitor)
+
+        presence = get_presence()
+        presence.clock = lambda: time.monotonic() + 1000
+        # The host's ping refreshes the host and sweeps out the lapsed guest
+        await host.send_json_to({'type': 'ping', 'timestamp': 1})
+        pong, update = await self.receive_frames(host)
+        self.assertEqual(pong['type'], 'pong')
+        self.assertEqual([member['user_id'] for member in update['left']], [guest.id])
+        self.assertEqual(update['online_count'], 1)
+        await self.receive_types(visitor)
+
+        # The guest's next ping brings them back
+        await visitor.send_json_to({'type': 'ping', 'timestamp': 1})
+        update = (await self.receive_frames(host))[0]
+        self.assertEqual([member['user_id'] for member in update['joined']], [guest.id])
+        self.assertEqual(update['online_count'], 2)
+        await host.disconnect()
+        await visitor.disconnect()
+
+    async def test_host_seek_is_acknowledged_with_its_anchor(self):
+        guest = await database_sync_to_async(CustomUser.objects.create_user)('guest@example.com', 'pw', name='Guest')
+        await database_sync_to_async(RoomParticipant.objects.create)(room=self.room, user=guest, role='guest')
+        host = await self.connect(self.host)
+        visitor = await self.connect(guest)
+        await self.receive_types(host)
+        await self.receive_types(visitor)
+
+        await host.send_json_to({'type': 'sync_playback', 'current_time': 42, 'is_playing': True})
+        # The host's next drift correction compares against this anchor, not the pre-seek one
+        frames = await self.receive_frames(host)
+        self.assertEqual([frame['type'] for frame in frames], ['playback_anchor'])
+        self.assertEqual(frames[0]['anchor_position'], 42)
+        self.assertTrue(frames[0]['is_playing'])
+        frames = await self.receive_frames(visitor)
+        self.assertEqual([frame['type'] for frame in frames], ['playback_synced'])
+        self.assertEqual(frames[0]['anchor_position'], 42)
+        await host.disconnect()
+        await visitor.disconnect()
+
+    async def test_broadcasts_are_encoded_once(self):
+        guest = await database_sync_to_async(CustomUser.objects.create_user)('guest@example.com', 'pw', name='Guest')
+        await database_sync_to_async(RoomParticipant.objects.create)(room=self.room, user=guest, role='guest')
+        host = await self.connect(self.host)
+        visitor = await self.connect(guest)
+        await self.receive_types(host)
+        await self.receive_types(visitor)
+
+        with mock.patch('rooms.frames.dumps', wraps=frames.dumps) as shared, \
+                mock.patch('rooms.consumers.dumps', wraps=frames.dumps) as per_connection:
+            await visitor.send_json_to({'type': 'chat_message', 'message': 'hi'})
+            texts = [await communicator.receive_from() for communicator in (host, visitor)]
+        self.assertEqual(shared.call_count, 1)
+        self.assertEqual(per_connection.call_count, 0)
+        # Both connections were sent the sender's string as is
+        self.assertEqual(texts[0], texts[1])
+        self.assertEqual(frames.loads(texts[0])['message'], 'hi')
+        await host.disconnect()
+        await visitor.disconnect()
+
+    async def test_host_is_excluded_from_playback_sync(self):
+        event = group_event('playback.sync', {'type': 'playback_synced'}, exclude_host=True)
+        consumer = RoomConsumer()
+        consumer.send_event = mock.AsyncMock()
+        consumer.role = 'host'
+        await consumer.playback_sync(event)
+        consumer.send_event.assert_not_awaited()
+
+        consumer.role = 'guest'
+        await consumer.playback_sync(event)
+        consumer.send_event.assert_awaited_once_with(event, kind='playback_synced')
+
+    async def test_non_string_message_type(self):
+        communicator = await self.connect(self.host)
+        await self.receive_types(communicator)
+        for message_type in [['x'], {'x': 1}, 7]:
+            await communicator.send_json_to({'type': message_type})
+            self.assertEqual(await self.receive_types(communicator), ['error'])
+        await communicator.send_json_to(['not', 'an', 'object'])
+        self.assertEqual(await self.receive_types(communicator), ['error'])
+        # The consumer is still alive
+        await communicator.send_json_to({'type': 'ping', 'timestamp': 1})
+        self.assertEqual(await self.receive_types(communicator), ['pong'])
+        await communicator.disconnect()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TTLCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TTLCache(maxsize=2, ttl=10, clock=self.clock)
+
+    def test_entries_expire(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2, ttl=30)
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('b'), 2)
+        self.cache.set('c', 3, ttl=0)
+        self.assertEqual(self.cache.get('c', 'missing'), 'missing')
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.pop('a'), 1)
+        self.assertIsNone(self.cache.pop('a'))
+
+
+class RateLimiterTests(SimpleTestCase):
+    KEYS = {'connection': 'c1', 'user': 1, 'room': 'ROOM'}
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def limiter(self, limits):
+        return RateLimiter({'chat_message': limits}, clock=self.clock)
+
+    def test_burst_then_refill(self):
+        limiter = self.limiter({'connection': (2, 3)})
+        for _ in range(3):
+            self.assertIsNone(limiter.check('chat_message', self.KEYS))
+        scope, retry_after = limiter.check('chat_message', self.KEYS)
+        self.assertEqual(scope, 'connection')
+        self.assertAlmostEqual(retry_after, 0.5)
+        self.clock.now = 0.5
+        self.assertIsNone(limiter.check('chat_message', self.KEYS))
+        self.assertIsNotNone(limiter.check('chat_message', self.KEYS))
+        # A full refill never exceeds the burst
+        self.clock.now = 100
+        for _ in range(3):
+            self.assertIsNone(limiter.check('chat_message', self.KEYS))
+        self.assertIsNotNone(limiter.check('chat_message', self.KEYS))
+
+    def test_rejection_takes_nothing_from_other_scopes(self):
+        limiter = self.limiter({'connection': (0.01, 5), 'room': (1, 2)})
+        self.assertIsNone(limiter.check('chat_message', self.KEYS))
+        self.assertIsNone(limiter.check('chat_message', self.KEYS))
+        for _ in range(3):
+            self.assertEqual(limiter.check('chat_message', self.KEYS)[0], 'room')
+        # Another connection in the same room is limited by the room too
+        other = {**self.KEYS, 'connection': 'c2'}
+        self.assertEqual(limiter.check('chat_message', other)[0], 'room')
+        # The rejected messages left the connection with 3 of its 5 tokens
+        limiter.limits['chat_message'] = {'connection': (0.01, 5)}
+        for _ in range(3):
+            self.assertIsNone(limiter.check('chat_message', self.KEYS))
+        self.assertEqual(limiter.check('chat_message', self.KEYS)[0], 'connection')
+
+    def test_unlimited_and_invalid_types(self):
+        limiter = self.limiter({'connection': (1, 1)})
+        self.assertIsNone(limiter.check('ping', self.KEYS))
+        self.assertIsNone(limiter.check(['chat_message'], self.KEYS))
+        self.assertIsNone(limiter.check(None, self.KEYS))
+
+
+class WireTests(SimpleTestCase):
+    FRAMES = [
+        {'type': 'pong', 'timestamp': 1700000000000.5, 'server_received': 1700000000001, 'server_time': 1700000000002},
+        {'type': 'playback_synced', 'is_playing': True, 'anchor_position': 12.5, 'anchor_time': 1700000000000,
+         'server_time': 1700000000003, 'current_time': 12.75},
+        {'type': 'roster', 'participants': [{'user_id': 1, 'name': 'Zoë', 'role': 'host'}], 'online_count': 1},
+        {'type': 'roster_update', 'joined': [], 'left': [{'user_id': 2, 'name': 'B', 'role': 'guest'}],
+         'online_count': 0},
+        {'type': 'ping', 'timestamp': 5},
+        {'type': 'sync_playback', 'current_time': 3.5, 'is_playing': False},
+    ]
+
+    def test_round_trip(self):
+        for frame in self.FRAMES:
+            data = wire.encode(frame)
+            self.assertIsInstance(data, bytes)
+            self.assertEqual(wire.decode(data), frame)
+
+    def test_other_frames_stay_json(self):
+        self.assertIsNone(wire.encode({'type': 'chat_message', 'message': 'hi'}))
+
+    def test_malformed_frames(self):
+        for data in [b'\xc1', wire.msgpack.packb([99, 1]), wire.msgpack.packb({'type': 'ping'}),
+                     wire.msgpack.packb([3, 5, 1])]:
+            with self.assertRaises(ValueError):
+                wire.decode(data)
+
+
+class FakeSend:
+    """A client connection whose sends block while `gate` is closed."""
+
+    def __init__(self):
+        self.frames = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.closed = 0
+
+    async def __call__(self, text_data=None, bytes_data=None):
+        await self.gate.wait()
+        self.frames.append(text_data if text_data is not None else bytes_data)
+
+    async def close(self):
+        self.closed += 1
+
+
+class OutboxTests(SimpleTestCase):
+    def outbox(self, **kwargs):
+        self.client = FakeSend()
+        return Outbox(self.client, self.client.close, **kwargs)
+
+    async def test_frames_of_one_tick_are_batched(self):
+        outbox = self.outbox(batching=True)
+        for index in range(3):
+            outbox.put('chat_message', text=f'{{"n":{index}}}')
+        outbox.put('pong', data=b'\x01')
+        outbox.put('chat_message', text='{"n":3}')
+        await outbox.drain()
+        self.assertEqual(self.client.frames, ['[{"n":0},{"n":1},{"n":2}]', b'\x01', '{"n":3}'])
+
+    async def test_frames_are_sent_one_by_one_without_batching(self):
+        outbox = self.outbox()
+        for index in range(3):
+            outbox.put('chat_message', text=f'{{"n":{index}}}')
+        await outbox.drain()
+        self.assertEqual(self.client.frames, ['{"n":0}', '{"n":1}', '{"n":2}'])
+
+    async def test_pending_state_frames_are_replaced(self):
+        outbox = self.outbox()
+        self.client.gate.clear()
+        outbox.put('chat_message', text='chat0')
+        await asyncio.sleep(0)
+        # While the client is busy with chat0, a newer sync replaces the pending one in place
+        for kind, text in [('chat_message', 'chat1'), ('playback_synced', 'sync1'), ('roster_update', 'roster'),
+                           ('playback_changed', 'paused'), ('playback_synced', 'sync2'), ('chat_message', 'chat2')]:
+            outbox.put(kind, text=text)
+        self.assertEqual(len(outbox), 5)
+        self.client.gate.set()
+        await outbox.drain()
+        self.assertEqual(self.client.frames, ['chat0', 'chat1', 'roster', 'paused', 'sync2', 'chat2'])
+
+    async def test_superseded_entries_are_compacted(self):
+        outbox = self.outbox()
+        self.client.gate.clear()
+        for index in range(1000):
+            outbox.put('playback_synced', text=f'{{"n":{index}}}')
+        self.assertEqual(len(outbox), 1)
+        self.assertLess(len(outbox._queue), 20)
+        self.client.gate.set()
+        await outbox.drain()
+        self.assertEqual(self.client.frames, ['{"n":999}'])
+
+    async def test_overflow_closes_the_client(self):
+        outbox = self.outbox(max_frames=3)
+        self.client.gate.clear()
+        outbox.put('chat_message', text='{"n":0}')
+        await asyncio.sleep(0)
+        # The writer is stuck sending frame 0; three more fit, the fourth overflows
+        for index in range(1, 5):
+            outbox.put('chat_message', text=f'{{"n":{index}}}')
+        await asyncio.sleep(0)
+        self.assertTrue(outbox.closed)
+        self.assertEqual(len(outbox), 0)
+        self.assertEqual(self.client.closed, 1)
+        outbox.put('chat_message', text='{"n":5}')
+        # close() must not wait for the stuck writer
+        await asyncio.wait_for(outbox.drain(), 0.1)
+        self.assertEqual(self.client.frames, [])
+
+    async def test_drain_gives_up_after_timeout(self):
+        outbox = self.outbox(drain_timeout=0.05)
+        self.client.gate.clear()
+        outbox.put('chat_message', text='{"n":0}')
+        await asyncio.wait_for(outbox.drain(), 1)
+        outbox.discard()
+
+
+class SendBackpressureTests(SimpleTestCase):
+    async def test_send_waits_while_the_window_is_paused(self):
+        sent = []
+
+        async def send(message):
+            sent.append(message['type'])
+
+        window = TransportWindow()
+        send_when_drained = SendBackpressure.wrap(send, window)
+        window.pauseProducing()
+        waiting = asyncio.ensure_future(send_when_drained({'type': 'websocket.send', 'text': 'x'}))
+        await asyncio.sleep(0.01)
+        self.assertEqual(sent, ['websocket.send'])
+        self.assertFalse(waiting.done())
+        window.resumeProducing()
+        await asyncio.wait_for(waiting, 1)
+        # Closing never waits, and a lost connection lets waiting senders through
+        window.pauseProducing()
+        await asyncio.wait_for(send_when_drained({'type': 'websocket.close'}), 1)
+        waiting = asyncio.ensure_future(send_when_drained({'type': 'websocket.send', 'text': 'x'}))
+        window.stopProducing()
+        await asyncio.wait_for(waiting, 1)
+
+    def test_other_servers_are_left_alone(self):
+        async def send(message):
+            pass
+
+        self.assertIsNone(daphne_transport(send))
+        self.assertIsNone(daphne_transport(functools.partial(send)))
+
+
+@skipIf(fakeredis is None, "fakeredis[lua] is not installed")
+class ShardedRedisChannelLayerTests(SimpleTestCase):
+    async def test_groups_live_on_the_room_code_shard(self):
+        layer = ShardedRedisChannelLayer(hosts=fake_redis_hosts(2))
+        channel = await layer.new_channel()
+        shards = set()
+        for index in range(20):
+            group = f'room_ROOM{index:02d}'
+            await layer.group_add(group, channel)
+            shard = layer.consistent_hash(group)
+            shards.add(shard)
+            stored = [await layer.connection(i).exists(layer._group_key(group)) for i in range(2)]
+            self.assertEqual(stored, [int(i == shard) for i in range(2)])
+        self.assertEqual(shards, {0, 1})
+        await layer.close_pools()
+
+    async def test_group_send_reaches_channels_on_every_shard(self):
+        # A worker's channels share one shard, so take workers until both shards have one
+        hosts = fake_redis_hosts(2)
+        workers = {}
+        while len(workers) < 2:
+            layer = ShardedRedisChannelLayer(hosts=hosts)
+            channel = await layer.new_channel()
+            workers.setdefault(layer.consistent_hash(layer.non_local_name(channel)), (layer, channel))
+        sender = workers[0][0]
+        for _, channel in workers.values():
+            await sender.group_add('room_ROOM01', channel)
+
+        await sender.group_send('room_ROOM01', {'type': 'chat.message', 'text': 'hi'})
+        for layer, channel in workers.values():
+            message = await asyncio.wait_for(layer.receive(channel), 1)
+            self.assertEqual(message, {'type': 'chat.message', 'text': 'hi'})
+            await layer.close_pools()
+
+    async def test_script_is_loaded_when_the_shard_does_not_have_it(self):
+        layer = ShardedRedisChannelLayer(hosts=fake_redis_hosts(1))
+        channel = await layer.new_channel()
+        await layer.group_add('room_ROOM01', channel)
+        connection = layer.connection(0)
+        self.assertEqual(await connection.script_exists(GROUP_SEND_SHA), [False])
+
+        # EVALSHA fails with NOSCRIPT and falls back to EVAL, which caches the script
+        with mock.patch.object(type(connection), 'eval', autospec=True, side_effect=type(connection).eval) as eval_:
+            await layer.group_send('room_ROOM01', {'type': 'chat.message', 'text': 'first'})
+            await layer.group_send('room_ROOM01', {'type': 'chat.message', 'text': 'second'})
+        self.assertEqual(eval_.call_count, 1)
+        self.assertEqual(await connection.script_exists(GROUP_SEND_SHA), [True])
+        for text in ('first', 'second'):
+            self.assertEqual((await layer.receive(channel))['text'], text)
+        await layer.close_pools()
+
+
+class MetricsTests(SimpleTestCase):
+    def test_labels_are_bounded(self):
+        self.assertEqual(metrics.message_type_label('ping'), 'ping')
+        self.assertEqual(metrics.message_type_label('whatever'), 'unknown')
+        self.assertEqual(metrics.message_type_label(['x']), 'unknown')
+        self.assertEqual(metrics.close_code_label(4003), 4003)
+        self.assertEqual(metrics.close_code_label(4999), 'other')
+
+    async def get_metrics(self, client=None, headers=()):
+        communicator = HttpCommunicator(application, 'GET', '/metrics', headers=list(headers))
+        if client:
+            communicator.scope['client'] = client
+        return await communicator.get_response()
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.5'], METRICS_TOKEN=None)
+    async def test_endpoint_allows_listed_ips(self):
+        response = await self.get_metrics(client=('10.0.0.5', 1234))
+        self.assertEqual(response['status'], 200)
+        self.assertIn(b'musicroom_ws_connections', response['body'])
+        response = await self.get_metrics(client=('203.0.113.9', 1234))
+        self.assertEqual(response['status'], 403)
+
+    @override_settings(METRICS_ALLOWED_IPS=[], METRICS_TOKEN='secret')
+    async def test_endpoint_accepts_token(self):
+        response = await self.get_metrics(client=('203.0.113.9', 1234),
+                                          headers=[(b'authorization', b'Bearer secret')])
+        self.assertEqual(response['status'], 200)
+        response = await self.get_metrics(client=('203.0.113.9', 1234),
+                                          headers=[(b'authorization', b'Bearer wrong')])
+        self.assertEqual(response['status'], 403)
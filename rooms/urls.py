@@ -9,7 +9,10 @@ urlpatterns = [
     # API URLs
     path('api/rooms/', views.RoomListCreateView.as_view(), name='api_rooms'),
     path('api/rooms/<str:code>/', views.RoomDetailView.as_view(), name='api_room_detail'),
+    path('api/rooms/<str:code>/snapshot/', views.RoomSnapshotView.as_view(), name='api_room_snapshot'),
     path('api/rooms/<str:code>/join/', views.JoinRoomView.as_view(), name='api_join_room'),
     path('api/rooms/<str:code>/leave/', views.LeaveRoomView.as_view(), name='api_leave_room'),
+    path('api/rooms/<str:code>/transfer-host/', views.TransferHostView.as_view(), name='api_transfer_host'),
+    path('api/rooms/<str:code>/kick/', views.KickParticipantView.as_view(), name='api_kick_participant'),
     path('api/join/', views.JoinRoomView.as_view(), name='api_join_room_by_code'),
 ]
\ No newline at end of file
@@ -3,26 +3,51 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from django.db import transaction
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils import timezone
+from django.utils.http import parse_etags
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from .models import Room, RoomParticipant
+from .models import Room, RoomParticipant, attach_online_counts
+from .pagination import RoomCursorPagination
+from .snapshot import get_room_snapshot, invalidate_participants, invalidate_snapshot
+from .state import (
+    broadcast_participant_removed,
+    broadcast_role_changed,
+    broadcast_room_invalidated,
+)
 from .serializers import (
     RoomSerializer, 
     CreateRoomSerializer, 
-    JoinRoomSerializer
+    JoinRoomSerializer,
+    ParticipantSerializer
 )
 
 # API Views
 class RoomListCreateView(generics.ListCreateAPIView):
+    """
+    Lists the user's rooms a page at a time, newest first.
+    Rows are compact summaries; pass ?view=full for RoomSerializer output,
+    or fetch a single room from RoomDetailView.
+    """
     serializer_class = RoomSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = RoomCursorPagination
     
     def get_queryset(self):
         # Show user's hosted rooms and participated rooms
         user = self.request.user
-        return Room.objects.filter(
-            models.Q(host=user) | models.Q(participants=user)
-        ).distinct()
+        return Room.objects.for_user(user).with_details(user)
+    
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('view') == 'full':
+            page = attach_online_counts(self.paginate_queryset(self.get_queryset()))
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        queryset = Room.objects.for_user(request.user).summaries(request.user)
+        page = attach_online_counts(self.paginate_queryset(queryset))
+        return self.get_paginated_response(page)
     
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -35,28 +60,56 @@ class RoomDetailView(generics.RetrieveUpdateDestroyAPIView):
     lookup_field = 'code'
     
     def get_queryset(self):
-        return Room.objects.all()
+        return Room.objects.with_details(self.request.user)
     
     def get_object(self):
         code = self.kwargs['code'].upper()
-        return get_object_or_404(Room, code=code)
+        return get_object_or_404(self.get_queryset(), code=code)
     
     def perform_update(self, serializer):
-        room = self.get_object()
+        room = serializer.instance
         if not room.is_host(self.request.user):
             raise PermissionError("Only the host can update the room")
         serializer.save()
+        invalidate_snapshot(room.code)
+        broadcast_room_invalidated(room.code)
     
     def perform_destroy(self, instance):
         if not instance.is_host(self.request.user):
             raise PermissionError("Only the host can delete the room")
+        code = instance.code
         instance.delete()
+        invalidate_snapshot(code)
+        broadcast_room_invalidated(code)
+
+class RoomSnapshotView(APIView):
+    """
+    Live room snapshot (playback anchors, queue head, active participants)
+    served from the cache. Supports If-None-Match, so clients polling after
+    a reconnect usually get an empty 304.
+    """
+    # Verifies the token without loading the user row
+    authentication_classes = [JWTStatelessUserAuthentication]
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, code):
+        snapshot = get_room_snapshot(code.upper())
+        if snapshot is None:
+            raise Http404
+        etag, body = snapshot
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
 
 class JoinRoomView(APIView):
     permission_classes = [IsAuthenticated]
     
     def post(self, request):
-        serializer = JoinRoomSerializer(data=request.data)
+        serializer = JoinRoomSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
             code = serializer.validated_data['code']
             room = Room.objects.get(code=code)
@@ -71,8 +124,11 @@ class JoinRoomView(APIView):
             if not created:
                 # User was already in room, just activate them
                 participant.is_active = True
-                participant.save()
+                participant.last_seen_at = timezone.now()
+                participant.save(update_fields=['is_active', 'last_seen_at'])
+            invalidate_participants(code)
             
+            room = Room.objects.with_details(request.user).get(pk=room.pk)
             room_data = RoomSerializer(room, context={'request': request}).data
             return Response({
                 'message': 'Successfully joined room',
@@ -90,7 +146,8 @@ class LeaveRoomView(APIView):
         try:
             participant = RoomParticipant.objects.get(room=room, user=request.user)
             participant.is_active = False
-            participant.save()
+            participant.save(update_fields=['is_active'])
+            invalidate_participants(room.code)
             
             return Response({'message': 'Successfully left room'})
         except RoomParticipant.DoesNotExist:
@@ -99,6 +156,79 @@ class LeaveRoomView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+class TransferHostView(APIView):
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request, code):
+        serializer = ParticipantSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        user_id = serializer.validated_data['user_id']
+        
+        with transaction.atomic():
+            # Lock the room so concurrent handoffs can't leave zero or two hosts
+            room = get_object_or_404(Room.objects.select_for_update(), code=code.upper())
+            if not room.is_host(request.user):
+                return Response(
+                    {'error': 'Only the host can hand off the room'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            
+            try:
+                new_host = RoomParticipant.objects.select_related('user').get(
+                    room=room, user_id=user_id, is_active=True
+                )
+            except RoomParticipant.DoesNotExist:
+                return Response(
+                    {'error': 'User is not an active participant'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            RoomParticipant.objects.filter(room=room, user=request.user).update(role='guest')
+            new_host.role = 'host'
+            new_host.save(update_fields=['role'])
+            room.host = new_host.user
+            room.save(update_fields=['host'])
+            
+            # Tell caches and connected clients only once the handoff is committed
+            old_host_id = request.user.id
+            transaction.on_commit(lambda: invalidate_participants(room.code))
+            transaction.on_commit(lambda: broadcast_role_changed(room.code, old_host_id, 'guest'))
+            transaction.on_commit(lambda: broadcast_role_changed(room.code, new_host.user_id, 'host'))
+        return Response({'message': f'{new_host.user.name} is now the host'})
+
+class KickParticipantView(APIView):
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request, code):
+        room = get_object_or_404(Room, code=code.upper())
+        if not room.is_host(request.user):
+            return Response(
+                {'error': 'Only the host can remove participants'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        serializer = ParticipantSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        user_id = serializer.validated_data['user_id']
+        if user_id == request.user.id:
+            return Response(
+                {'error': 'The host cannot remove themselves'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        deleted, _ = RoomParticipant.objects.filter(room=room, user_id=user_id).delete()
+        if not deleted:
+            return Response(
+                {'error': 'User is not in this room'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        invalidate_participants(room.code)
+        broadcast_participant_removed(room.code, user_id)
+        return Response({'message': 'Participant removed'})
+
 # Template Views
 def rooms_home(request):
     """Main rooms page - shows user's rooms and join form"""
@@ -108,6 +238,3 @@ def room_detail(request, code):
     """Individual room page"""
     room = get_object_or_404(Room, code=code.upper())
     return render(request, 'rooms/room_detail.html', {'room_code': code.upper()})
-
-# Import Django's Q for queryset filtering
-from django.db import models
\ No newline at end of file
@@ -0,0 +1,97 @@
+# rooms/wire.py
+"""
+Compact binary encoding for the high-frequency WebSocket frames.
+
+Clients that offer the `musicroom.msgpack` subprotocol get pong,
+playback_synced and roster frames (and may send ping and sync_playback)
+as binary msgpack arrays instead of JSON text:
+
+    [type code, field, field, ...]
+
+with fields in FRAME_FIELDS order, and roster members as
+[user_id, name, role]. Every other frame stays JSON, as does everything
+for clients that offer `musicroom.json` or no subprotocol at all. The
+layout is mirrored in static/rooms/js/wire.js.
+"""
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_PROTOCOL = 'musicroom.json'
+MSGPACK_PROTOCOL = 'musicroom.msgpack'
+
+FRAME_CODES = {
+    'pong': 1,
+    'playback_synced': 2,
+    'roster': 3,
+    'roster_update': 4,
+    'ping': 5,
+    'sync_playback': 6,
+}
+FRAME_TYPES = {code: frame_type for frame_type, code in FRAME_CODES.items()}
+
+FRAME_FIELDS = {
+    'pong': ('timestamp', 'server_received', 'server_time'),
+    'playback_synced': ('is_playing', 'anchor_position', 'anchor_time', 'server_time', 'current_time'),
+    'roster': ('participants', 'online_count'),
+    'roster_update': ('joined', 'left', 'online_count'),
+    'ping': ('timestamp',),
+    'sync_playback': ('current_time', 'is_playing'),
+}
+MEMBER_FIELDS = ('user_id', 'name', 'role')
+MEMBER_LISTS = {'participants', 'joined', 'left'}
+
+
+def select_protocol(subprotocols):
+    """The subprotocol to accept from those a client offered, or None for plain JSON."""
+    if MSGPACK_PROTOCOL in subprotocols and msgpack is not None:
+        return MSGPACK_PROTOCOL
+    if JSON_PROTOCOL in subprotocols:
+        return JSON_PROTOCOL
+    return None
+
+
+def _pack_value(field, value):
+    if field in MEMBER_LISTS:
+        return [[member.get(name) for name in MEMBER_FIELDS] for member in value]
+    return value
+
+
+def _unpack_value(field, value):
+    if field in MEMBER_LISTS:
+        return [dict(zip(MEMBER_FIELDS, member)) for member in value]
+    return value
+
+
+def encode(frame):
+    """Binary encoding of a frame, or None if its type is sent as JSON."""
+    frame_type = frame.get('type')
+    if msgpack is None or frame_type not in FRAME_CODES:
+        return None
+    fields = FRAME_FIELDS[frame_type]
+    return msgpack.packb(
+        [FRAME_CODES[frame_type], *(_pack_value(field, frame.get(field)) for field in fields)]
+    )
+
+
+def decode(data):
+    """Decode a binary frame into the dict its JSON form would have. Raises ValueError."""
+    if msgpack is None:
+        raise ValueError('msgpack is not installed')
+    try:
+        values = msgpack.unpackb(data)
+    except Exception as exc:
+        raise ValueError(f'Malformed binary frame: {exc}')
+    code = values[0] if isinstance(values, list) and values else None
+    frame_type = FRAME_TYPES.get(code) if isinstance(code, int) else None
+    if frame_type is None:
+        raise ValueError('Unknown binary frame type')
+    frame = {'type': frame_type}
+    try:
+        for field, value in zip(FRAME_FIELDS[frame_type], values[1:]):
+            frame[field] = _unpack_value(field, value)
+    except (TypeError, ValueError):
+        raise ValueError(f'Malformed {frame_type} frame')
+    return frame
@@ -0,0 +1,107 @@
+# rooms/writebehind.py
+
+import asyncio
+import contextlib
+import logging
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .models import Room
+from .snapshot import invalidate_playback
+from .state import publish_room_state
+
+logger = logging.getLogger(__name__)
+
+
+class PlaybackWriteBuffer:
+    """
+    Write-behind buffer for high-frequency playback updates (host seeks).
+
+    Consumers apply the update to the cached RoomState and broadcast it right
+    away; only the latest fields per room are kept here and written to the
+    Room row every `interval` seconds, or earlier on a state transition.
+    Flushes and consumers' own writes of a room's row take turns (see
+    `writing`), so a flush never makes a concurrent write look stale.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval
+        self._pending = {}
+        self._locks = {}
+        self._task = None
+
+    def get_interval(self):
+        if self.interval is not None:
+            return self.interval
+        return getattr(settings, 'ROOM_SYNC_FLUSH_INTERVAL', 5)
+
+    def add(self, code, state, fields):
+        """Record fields already applied to `state`, replacing older pending values."""
+        pending = self._pending.get(code)
+        if pending is None or pending[0] is not state:
+            self._pending[code] = (state, dict(fields))
+        else:
+            pending[1].update(fields)
+        self._ensure_flusher()
+
+    def take(self, code):
+        """Remove and return the pending fields of a room, to merge them into another write."""
+        pending = self._pending.pop(code, None)
+        return pending[1] if pending else {}
+
+    def has_pending(self, code):
+        return code in self._pending
+
+    @contextlib.asynccontextmanager
+    async def writing(self, code):
+        """Hold the room's write turn: versioned writes of its Room row in this process go one at a time."""
+        entry = self._locks.setdefault(code, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[code]
+
+    async def flush_room(self, code):
+        """Write a room's pending fields now, e.g. when its last local user leaves."""
+        async with self.writing(code):
+            pending = self._pending.pop(code, None)
+            if pending is None:
+                return
+            state, fields = pending
+            written = await database_sync_to_async(Room.objects.update_playback)(
+                state.room_id, state.version, **fields
+            )
+            if not written:
+                # A newer write already superseded these fields
+                return
+            state.version += 1
+        await invalidate_playback(code)
+        channel_layer = get_channel_layer()
+        if channel_layer is not None:
+            await publish_room_state(channel_layer, code, state)
+
+    async def flush(self):
+        for code in list(self._pending):
+            try:
+                await self.flush_room(code)
+            except Exception:
+                # Keep flushing the other rooms; this room's fields were dropped
+                logger.exception("Failed to flush playback position for room %s", code)
+
+    def _ensure_flusher(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while self._pending:
+            await asyncio.sleep(self.get_interval())
+            await self.flush()
+
+
+playback_writes = PlaybackWriteBuffer()